@@ -0,0 +1,335 @@
+"""
+Replays a weighted mix of the `core.apis.v1` endpoints against seeded data
+and reports latency percentiles, throughput and queries per request.
+
+    python -m benchmarks.api_suite --users 20 --products 200 --requests 2000
+    python -m benchmarks.api_suite --save-baseline benchmarks/baseline.json
+    python -m benchmarks.api_suite --baseline benchmarks/baseline.json
+
+Runs against SQLite by default, `BENCHMARK_DB=postgres` uses a local
+Postgres, see `benchmarks.settings`. With `--baseline` the process exits with
+status 1 when a scenario got slower than the tolerance allows or needs more
+queries than in the baseline.
+"""
+import argparse
+import io
+import json
+import random
+import shutil
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from typing import Dict, List, Tuple
+
+from .utils import summarize, test_environment
+
+
+SCENARIO_WEIGHTS = {
+    'list_products': 35,
+    'list_products_cursor': 10,
+    'get_product': 25,
+    'create_product': 8,
+    'update_product': 10,
+    'delete_product': 4,
+    'upload_image': 4,
+    'delete_image': 3,
+    'login': 1,
+}
+PASSWORD = 'benchmark'
+
+
+def seed(users: int, products: int, images: int) -> List[dict]:
+    """
+    Creates `users` users with `products` products each and `images` image
+    rows per product, and returns the per user state the scenarios work on.
+    """
+    from django.contrib.auth import get_user_model
+    from django.contrib.auth.hashers import make_password
+    from django.contrib.contenttypes.models import ContentType
+
+    from core.authentication import create_access_token
+    from core.models import Image, Product
+
+    User = get_user_model()
+    password = make_password(PASSWORD)
+    User.objects.bulk_create(User(username=f'benchmark{i}', password=password) for i in range(users))
+    user_ids = list(User.objects.filter(username__startswith='benchmark').values_list('id', flat=True))
+
+    Product.objects.bulk_create(
+        Product(user_id=user_id, title=f'Product {i}', description='Description', price=i + 1)
+        for user_id in user_ids
+        for i in range(products)
+    )
+    content_type = ContentType.objects.get_for_model(Product)
+    Image.objects.bulk_create(
+        Image(content_type=content_type, object_id=product_id, image=f'images/benchmark/{product_id}_{i}.jpg')
+        for product_id in Product.objects.values_list('id', flat=True)
+        for i in range(images)
+    )
+
+    states = []
+    for user_id in user_ids:
+        product_ids = list(Product.objects.filter(user_id=user_id).values_list('id', flat=True))
+        states.append({
+            'username': User.objects.get(id=user_id).username,
+            'headers': {'Authorization': f'Bearer {create_access_token({"id": user_id})}'},
+            'products': {product_id: images for product_id in product_ids},
+            'created_products': [],
+            'uploaded_images': [],
+        })
+
+    return states
+
+
+def _image_file() -> io.BytesIO:
+    from PIL import Image as PILImage
+
+    buffer = io.BytesIO()
+    PILImage.new('RGB', (64, 64), 'white').save(buffer, format='JPEG')
+    buffer.seek(0)
+    return buffer
+
+
+class Workload:
+    """
+    The scenarios of the mix, each one sends a single request for a random
+    seeded user and keeps the user state in line with the database.
+    """
+
+    def __init__(self, client, states: List[dict], rng: random.Random):
+        from core.models import Product
+
+        self.client = client
+        self.states = states
+        self.rng = rng
+        self.image_content = _image_file().getvalue()
+        self.max_image_count = Product.MAX_IMAGE_COUNT
+
+    def run(self, scenario: str):
+        state = self.rng.choice(self.states)
+        return getattr(self, scenario)(state)
+
+    def list_products(self, state: dict):
+        page = self.rng.randint(1, 3)
+        return self.client.get(f'/products?page={page}', headers=state['headers'])
+
+    def list_products_cursor(self, state: dict):
+        return self.client.get('/products?pagination=cursor', headers=state['headers'])
+
+    def get_product(self, state: dict):
+        product_id = self.rng.choice(list(state['products']))
+        return self.client.get(f'/products/{product_id}', headers=state['headers'])
+
+    def create_product(self, state: dict):
+        response = self.client.post(
+            '/products/',
+            json={'title': 'New Product', 'description': 'Description', 'price': 10},
+            headers=state['headers']
+        )
+        if response.status_code == 201:
+            product_id = response.json()['id']
+            state['products'][product_id] = 0
+            state['created_products'].append(product_id)
+        return response
+
+    def update_product(self, state: dict):
+        product_id = self.rng.choice(list(state['products']))
+        return self.client.put(
+            f'/products/{product_id}/',
+            json={'title': 'Updated Product', 'price': self.rng.randint(1, 1000)},
+            headers=state['headers']
+        )
+
+    def delete_product(self, state: dict):
+        # only products created by the workload are deleted, so the seeded
+        # data set keeps its size for the whole run
+        if not state['created_products']:
+            return self.create_product(state)
+
+        product_id = state['created_products'].pop()
+        state['products'].pop(product_id)
+        state['uploaded_images'] = [image for image in state['uploaded_images'] if image[0] != product_id]
+        return self.client.delete(f'/products/{product_id}', headers=state['headers'])
+
+    def upload_image(self, state: dict):
+        from django.core.files.uploadedfile import SimpleUploadedFile
+        from django.utils.datastructures import MultiValueDict
+
+        product_ids = [
+            product_id for product_id, count in state['products'].items() if count < self.max_image_count
+        ]
+        if not product_ids:
+            return self.delete_image(state) if state['uploaded_images'] else self.get_product(state)
+
+        product_id = self.rng.choice(product_ids)
+        image = SimpleUploadedFile('benchmark.jpeg', self.image_content, content_type='image/jpeg')
+        response = self.client.post(
+            f'/products/{product_id}/images/',
+            FILES=MultiValueDict({'images': [image]}),
+            headers=state['headers']
+        )
+        if response.status_code == 201:
+            state['products'][product_id] += 1
+            state['uploaded_images'].extend((product_id, image['id']) for image in response.json())
+        return response
+
+    def delete_image(self, state: dict):
+        if not state['uploaded_images']:
+            return self.upload_image(state)
+
+        product_id, image_id = state['uploaded_images'].pop()
+        state['products'][product_id] -= 1
+        return self.client.delete(f'/products/{product_id}/images/{image_id}/', headers=state['headers'])
+
+    def login(self, state: dict):
+        return self.client.post(
+            '/login/access-token/',
+            json={'username': state['username'], 'password': PASSWORD}
+        )
+
+
+def run(config: dict) -> Dict[str, dict]:
+    from django.core.cache import cache
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+    from ninja.testing import TestClient
+
+    from core.apis.v1 import router
+    from core.exceptions import ApiValidationError
+
+    rng = random.Random(config['seed'])
+    workload = Workload(
+        TestClient(router),
+        seed(config['users'], config['products'], config['images']),
+        rng
+    )
+    scenarios, weights = zip(*SCENARIO_WEIGHTS.items())
+    cache.clear()
+
+    timings: Dict[str, List[float]] = defaultdict(list)
+    queries: Dict[str, List[int]] = defaultdict(list)
+    errors: Dict[str, int] = defaultdict(int)
+
+    total = config['warmup'] + config['requests']
+    started_at = None
+    for i in range(total):
+        if i == config['warmup']:
+            started_at = time.perf_counter()
+
+        scenario = rng.choices(scenarios, weights)[0]
+        with CaptureQueriesContext(connection) as context:
+            start = time.perf_counter()
+            try:
+                status_code = workload.run(scenario).status_code
+            except ApiValidationError as e:
+                # the test client does not go through the api exception handlers
+                status_code = e.status_code
+            elapsed = (time.perf_counter() - start) * 1000
+
+        if i < config['warmup']:
+            continue
+
+        timings[scenario].append(elapsed)
+        queries[scenario].append(len(context))
+        if status_code >= 400:
+            errors[scenario] += 1
+
+    duration = time.perf_counter() - started_at
+    results = {
+        scenario: {
+            'requests': len(timings[scenario]),
+            'errors': errors[scenario],
+            'queries': round(sum(queries[scenario]) / len(queries[scenario]), 2),
+            **summarize(timings[scenario]),
+        }
+        for scenario in scenarios if timings[scenario]
+    }
+    results['total'] = {
+        'requests': config['requests'],
+        'errors': sum(errors.values()),
+        'queries': round(sum(map(sum, queries.values())) / config['requests'], 2),
+        'req_per_s': config['requests'] / duration,
+        **summarize([timing for values in timings.values() for timing in values]),
+    }
+    return results
+
+
+def compare(baseline: dict, results: Dict[str, dict], tolerance: float) -> List[str]:
+    """
+    Returns the regressions of `results` against the baseline, a scenario
+    regresses when its median latency grows by more than `tolerance`, it
+    needs more queries per request or fails more often. The median is
+    compared since the tail of the rarer scenarios is too noisy.
+    """
+    regressions = []
+    for scenario, expected in baseline['results'].items():
+        if (actual := results.get(scenario)) is None:
+            continue
+
+        if actual['p50_ms'] > expected['p50_ms'] * (1 + tolerance):
+            regressions.append(
+                f"{scenario}: p50 {actual['p50_ms']:.2f}ms > {expected['p50_ms']:.2f}ms (+{tolerance:.0%})"
+            )
+        if actual['queries'] > expected['queries']:
+            regressions.append(f"{scenario}: {actual['queries']} queries/request > {expected['queries']}")
+        if actual['errors'] > expected['errors']:
+            regressions.append(f"{scenario}: {actual['errors']} errors > {expected['errors']}")
+
+    return regressions
+
+
+def report(results: Dict[str, dict]) -> None:
+    columns: Tuple[str, ...] = ('requests', 'errors', 'queries', 'p50_ms', 'p95_ms', 'p99_ms')
+    print(f"{'scenario':<22}" + ''.join(f'{column:>10}' for column in columns))
+    for scenario, result in results.items():
+        print(f'{scenario:<22}' + ''.join(f'{result[column]:>10.2f}' for column in columns))
+    print(f"throughput: {results['total']['req_per_s']:.2f} req/s")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--products', type=int, default=200, help='products per user')
+    parser.add_argument('--images', type=int, default=2, help='images per product')
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--warmup', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--baseline', help='compare against this baseline file')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed p50 growth, 0.25 is 25%%')
+    parser.add_argument('--save-baseline', help='store the results as a baseline file')
+    args = parser.parse_args()
+
+    config = {key: getattr(args, key) for key in ('users', 'products', 'images', 'requests', 'warmup', 'seed')}
+    media_root = tempfile.mkdtemp(prefix='toman_shop_benchmarks')
+    try:
+        with test_environment():
+            from django.test import override_settings
+
+            with override_settings(MEDIA_ROOT=media_root):
+                results = run(config)
+    finally:
+        shutil.rmtree(media_root, ignore_errors=True)
+
+    report(results)
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            json.dump({'config': config, 'results': results}, f, indent=2, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+        if baseline['config'] != config:
+            print(f"warning: baseline was recorded with {baseline['config']}", file=sys.stderr)
+
+        if regressions := compare(baseline, results, args.tolerance):
+            print('regressions:\n  ' + '\n  '.join(regressions), file=sys.stderr)
+            sys.exit(1)
+
+        print('no regressions against the baseline')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+"""
+Compares a request that opens and closes its own Postgres connection with
+one that takes it from the `core.db_backends.postgresql_pool` pool.
+
+    BENCHMARK_DB=postgres python -m benchmarks.db_pool --requests 2000 --threads 8
+
+Each simulated request connects, runs `SELECT 1` and releases the
+connection like django does at the end of a request with `CONN_MAX_AGE = 0`.
+Runs against the configured database itself, no test database is created.
+"""
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+
+import django
+
+
+def run(engine: str, requests: int, threads: int) -> Dict[str, float]:
+    from django.db import connections
+    from django.utils.module_loading import import_string
+
+    from .utils import summarize
+
+    wrapper_class = import_string(f'{engine}.base.DatabaseWrapper')
+    settings_dict = {**connections.settings['default'], 'ENGINE': engine, 'CONN_MAX_AGE': 0}
+
+    def request(_) -> float:
+        connection = wrapper_class(settings_dict, alias='benchmark')
+        start = time.perf_counter()
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT 1')
+        # what django runs when the request finishes
+        connection.close_if_unusable_or_obsolete()
+        return (time.perf_counter() - start) * 1000
+
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        start = time.perf_counter()
+        timings: List[float] = list(executor.map(request, range(requests)))
+        elapsed = time.perf_counter() - start
+
+    return {'req_per_s': requests / elapsed, **summarize(timings)}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--threads', type=int, default=8)
+    args = parser.parse_args()
+
+    if os.getenv('BENCHMARK_DB', 'sqlite') != 'postgres':
+        sys.exit('Connection pooling is only measured on Postgres, set BENCHMARK_DB=postgres')
+
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'benchmarks.settings')
+    django.setup()
+
+    from core.db_backends.postgresql_pool.base import get_pool_stats
+
+    for name, engine in (
+        ('direct', 'django.db.backends.postgresql'),
+        ('pooled', 'core.db_backends.postgresql_pool'),
+    ):
+        result = run(engine, args.requests, args.threads)
+        print(f"{name}: " + ' '.join(f'{key}={value:.2f}' for key, value in result.items()))
+
+    print('pool: ' + ' '.join(f'{key}={value:g}' for key, value in get_pool_stats()['benchmark'].items()))
+
+
+if __name__ == '__main__':
+    main()
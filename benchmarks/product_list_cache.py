@@ -0,0 +1,53 @@
+"""
+Compares `GET /v1/products` with a cold and a warm page cache.
+
+    python -m benchmarks.product_list_cache --products 5000
+"""
+import argparse
+
+from .utils import measure, test_environment
+
+
+def run(products: int, repeat: int) -> None:
+    from django.contrib.auth import get_user_model
+    from django.core.cache import cache
+    from ninja.testing import TestClient
+
+    from core.apis.v1 import router
+    from core.authentication import create_access_token
+    from core.caching import bump_product_list_version
+    from core.models import Product
+
+    user = get_user_model().objects.create_user(username='benchmark', password='benchmark')
+    Product.objects.bulk_create(
+        Product(user=user, title=f'Product {i}', description='Description', price=i + 1)
+        for i in range(products)
+    )
+    client = TestClient(router)
+    headers = {'Authorization': f'Bearer {create_access_token({"id": user.pk})}'}
+
+    def cold() -> None:
+        bump_product_list_version(user.pk)
+        client.get('/products', headers=headers)
+
+    def warm() -> None:
+        client.get('/products', headers=headers)
+
+    cache.clear()
+    for name, func in (('cold', cold), ('warm', warm)):
+        result = measure(func, repeat)
+        print(f"{name}: " + ' '.join(f'{key}={value:.2f}' for key, value in result.items()))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--products', type=int, default=5000)
+    parser.add_argument('--repeat', type=int, default=200)
+    args = parser.parse_args()
+
+    with test_environment():
+        run(args.products, args.repeat)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,49 @@
+"""
+Load tests a running deployment, to compare the sync WSGI workers with the
+uvicorn ASGI workers under the same concurrency.
+
+    ASYNC_API=0 ./entrypoint.sh  # or ASYNC_API=1
+    python -m benchmarks.server_throughput http://localhost:8000 --token <access token>
+"""
+import argparse
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+
+from .utils import summarize
+
+
+def _request(url: str, token: str) -> float:
+    request = urllib.request.Request(url, headers={'Authorization': f'Bearer {token}'})
+    start = time.perf_counter()
+    with urllib.request.urlopen(request) as response:
+        response.read()
+
+    return (time.perf_counter() - start) * 1000
+
+
+def run(url: str, token: str, requests: int, concurrency: int) -> Dict[str, float]:
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        start = time.perf_counter()
+        timings: List[float] = list(executor.map(lambda _: _request(url, token), range(requests)))
+        elapsed = time.perf_counter() - start
+
+    return {'req_per_s': requests / elapsed, **summarize(timings)}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('base_url')
+    parser.add_argument('--token', required=True)
+    parser.add_argument('--path', default='/api/v1/products/1')
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=64)
+    args = parser.parse_args()
+
+    result = run(args.base_url.rstrip('/') + args.path, args.token, args.requests, args.concurrency)
+    print(' '.join(f'{key}={value:.2f}' for key, value in result.items()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,28 @@
+"""
+Settings for running the benchmarks locally, SQLite by default or a local
+Postgres with `BENCHMARK_DB=postgres` (configured by the usual `DB_*` vars),
+and an in-memory cache in place of Redis.
+"""
+import os
+
+from toman_shop.settings import *  # noqa
+
+if os.getenv('BENCHMARK_DB', 'sqlite') == 'sqlite':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': ':memory:',
+        }
+    }
+else:
+    DATABASES['default']['HOST'] = os.getenv('DB_HOST', 'localhost')  # noqa
+
+THROTTLE_BACKEND = 'local'
+# the mix logs in more often than a real client would
+LOGIN_RATE_THROTTLE = '1000/s'
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
@@ -1,34 +1,45 @@
-from typing import List
+from typing import List, Optional
 
+from django.conf import settings
 from django.contrib.contenttypes.models import ContentType
-from django.core.cache import cache
 from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.http import HttpResponse
 from django.shortcuts import get_object_or_404
-from ninja import Router, UploadedFile, File
-from ninja.pagination import (
-    paginate,
-    PageNumberPagination
-)
+from ninja import Router, UploadedFile, File, Query
+from ninja.pagination import paginate
 
 from core.authentication import JWTAuth
+from core.batch import apply_product_batch
+from core.caching import bump_product_list_version, cache_product_list_response
+from core.conditional import get_not_modified_response, has_preconditions, set_validators
 from core.exceptions import ApiValidationError
-from core.models import Product, Image
+from core.export import ExportFormat, export_products
+from core.instrumentation import query_budget
+from core.models import Product, Image, Tombstone
+from core.pagination import PageOrCursorPagination, PagePagination
+from core.throttling import AnonRateThrottle
+from core.uploadhandlers import discard_stored_files_on_error
+from core.sync import get_product_changes
 from core.schemas import (
     LoginRespSchema,
     LoginReqSchema,
     RefreshReqSchema,
+    ProductFilterSchema,
     ProductRespSchema,
+    PagedProductRespSchema,
     CreateProductReqSchema,
     ImageRespSchema,
     ErrorSchema,
     NoContent,
     UpdateProductReqSchema,
+    BatchProductReqSchema,
+    BatchProductRespSchema,
+    ProductChangesRespSchema,
 )
 
 router = Router()
 
-PRODUCT_LIST_CACHE_KEY = 'products:user:{user_id}'
-
 
 @router.post(
     "/login/access-token/",
@@ -36,7 +47,10 @@ PRODUCT_LIST_CACHE_KEY = 'products:user:{user_id}'
         200: LoginRespSchema,
         401: ErrorSchema
     },
+    # every attempt costs a password hash
+    throttle=AnonRateThrottle(settings.LOGIN_RATE_THROTTLE, scope='login'),
 )
+@query_budget(2)
 def get_access_token(request, body: LoginReqSchema):
     return body.generate_jwt_tokens()
 
@@ -48,6 +62,7 @@ def get_access_token(request, body: LoginReqSchema):
         401: ErrorSchema
     }
 )
+@query_budget(0)
 def get_access_token_from_refresh_token(request, body: RefreshReqSchema):
     return body.generate_jwt_tokens()
 
@@ -57,14 +72,57 @@ def get_access_token_from_refresh_token(request, body: RefreshReqSchema):
     response=List[ProductRespSchema],
     auth=JWTAuth()
 )
-@paginate(PageNumberPagination)
-def get_products(request):
-    cache_key = PRODUCT_LIST_CACHE_KEY.format(user_id=request.user.id)
-    if not (products := cache.get(cache_key)):
-        products = Product.objects.filter(user=request.user)
-        cache.set(cache_key, products)
+@query_budget(5)
+@cache_product_list_response(PagedProductRespSchema)
+@paginate(PageOrCursorPagination)
+def get_products(request, filters: ProductFilterSchema = Query(...)):
+    return filters.filter(Product.objects.filter(user_id=request.user.id))
+
+
+@router.get(
+    "/products/search",
+    response=List[ProductRespSchema],
+    auth=JWTAuth()
+)
+@query_budget(5)
+@paginate(PagePagination)
+def search_products(request, q: str = Query(..., min_length=1, max_length=100)):
+    return Product.objects.filter(user_id=request.user.id).search(q)
 
-    return products
+
+@router.get(
+    "/products/export",
+    auth=JWTAuth()
+)
+@query_budget(1)
+def export_user_products(request, export_format: ExportFormat = Query('ndjson', alias='format')):
+    return export_products(Product.objects.filter(user_id=request.user.id).order_by('id'), export_format)
+
+
+@router.get(
+    "/products/changes",
+    response={
+        200: ProductChangesRespSchema,
+        400: ErrorSchema,
+        410: ErrorSchema
+    },
+    auth=JWTAuth()
+)
+@query_budget(4)
+def get_changed_products(request, since: Optional[str] = None):
+    return get_product_changes(request.user.id, since)
+
+
+@router.post(
+    "/products/batch/",
+    response={200: BatchProductRespSchema},
+    auth=JWTAuth()
+)
+@query_budget(17)
+def batch_products(request, payload: BatchProductReqSchema):
+    results = apply_product_batch(request.user.id, payload.operations)
+    bump_product_list_version(request.user.id)
+    return {'results': results}
 
 
 @router.get(
@@ -75,8 +133,22 @@ def get_products(request):
     },
     auth=JWTAuth()
 )
-def get_product(request, product_id: int):
-    return get_object_or_404(Product, id=product_id, user=request.user)
+@query_budget(5)
+def get_product(request, product_id: int, response: HttpResponse):
+    if has_preconditions(request):
+        # checked against the annotated state, without loading the product
+        state = get_object_or_404(
+            Product.objects.only('id', 'updated_at').with_image_state(),
+            id=product_id,
+            user_id=request.user.id
+        )
+        if (not_modified := get_not_modified_response(request, state.etag, state.last_modified)) is not None:
+            return not_modified
+
+    product = get_object_or_404(Product, id=product_id, user_id=request.user.id)
+    Product.prefetch_images([product])
+    set_validators(response, product.etag, product.last_modified)
+    return product
 
 
 @router.delete(
@@ -87,12 +159,14 @@ def get_product(request, product_id: int):
     },
     auth=JWTAuth()
 )
+@query_budget(12)
 def delete_product(request, product_id: int):
-    product = get_object_or_404(Product, id=product_id, user=request.user)
-    images = product.images
-    product.delete()
-    images.delete()
-    cache.delete(PRODUCT_LIST_CACHE_KEY.format(user_id=request.user.id))
+    product = get_object_or_404(Product, id=product_id, user_id=request.user.id)
+    with transaction.atomic():
+        product.images.delete()
+        product.delete()
+        Tombstone.record_products(request.user.id, [product_id])
+    bump_product_list_version(request.user.id)
     return 204, ""
 
 
@@ -101,9 +175,11 @@ def delete_product(request, product_id: int):
     response={201: ProductRespSchema},
     auth=JWTAuth()
 )
+@query_budget(4)
 def create_product(request, payload: CreateProductReqSchema):
-    product = Product.objects.create(user=request.user, **payload.dict())
-    cache.delete(PRODUCT_LIST_CACHE_KEY.format(user_id=request.user.id))
+    product = Product.objects.create(user_id=request.user.id, **payload.dict())
+    Product.prefetch_images([product])
+    bump_product_list_version(request.user.id)
     return product
 
 
@@ -114,13 +190,15 @@ def create_product(request, payload: CreateProductReqSchema):
     },
     auth=JWTAuth()
 )
+@query_budget(5)
 def update_product(request, product_id: int, payload: UpdateProductReqSchema):
-    product = get_object_or_404(Product, id=product_id, user=request.user)
+    product = get_object_or_404(Product, id=product_id, user_id=request.user.id)
     for key, value in payload.dict(exclude_none=True).items():
         setattr(product, key, value)
 
     product.save()
-    cache.delete(PRODUCT_LIST_CACHE_KEY.format(user_id=request.user.id))
+    Product.prefetch_images([product])
+    bump_product_list_version(request.user.id)
     return product
 
 
@@ -132,26 +210,19 @@ def update_product(request, product_id: int, payload: UpdateProductReqSchema):
     },
     auth=JWTAuth(),
 )
+@query_budget(9)
 def upload_images_for_product(request, product_id: int, images: List[UploadedFile] = File(...)):
-    product = get_object_or_404(Product, id=product_id, user=request.user)
-    content_type = ContentType.objects.get_for_model(product)
-    response = []
-    for image in images:
+    with discard_stored_files_on_error(images):
+        product = get_object_or_404(Product, id=product_id, user_id=request.user.id)
         try:
-            response.append(
-                Image.objects.create(
-                    object_id=product.id,
-                    content_type=content_type,
-                    image=image
-                )
-            )
+            response = product.attach_images(images)
         except ValidationError as e:
             raise ApiValidationError(
                 e.messages[0],
                 400
             )
 
-    cache.delete(PRODUCT_LIST_CACHE_KEY.format(user_id=request.user.id))
+    bump_product_list_version(request.user.id)
     return 201, response
 
 
@@ -163,10 +234,14 @@ def upload_images_for_product(request, product_id: int, images: List[UploadedFil
     },
     auth=JWTAuth(),
 )
+@query_budget(12)
 def delete_product_image(request, product_id: int, image_id: int):
-    product = get_object_or_404(Product, id=product_id, user=request.user)
+    product = get_object_or_404(Product, id=product_id, user_id=request.user.id)
     content_type = ContentType.objects.get_for_model(product)
     image = get_object_or_404(Image, id=image_id, object_id=product.pk, content_type=content_type)
-    image.delete()
-    cache.delete(PRODUCT_LIST_CACHE_KEY.format(user_id=request.user.id))
+    with transaction.atomic():
+        image.delete()
+        product.lock_for_image_change()
+        Tombstone.record_images(request.user.id, product.pk, [image_id])
+    bump_product_list_version(request.user.id)
     return 204, ""
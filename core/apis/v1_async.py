@@ -0,0 +1,198 @@
+from typing import List
+
+from django.conf import settings
+from django.http import Http404, HttpResponse
+from ninja import Query, Router
+from ninja.pagination import paginate
+
+from core.apis import v1
+from core.authentication import AsyncJWTAuth, JWTAuth
+from core.caching import abump_product_list_version, cache_product_list_response
+from core.conditional import get_not_modified_response, has_preconditions, set_validators
+from core.export import ExportFormat, aexport_products
+from core.instrumentation import query_budget
+from core.models import Product
+from core.pagination import PageOrCursorPagination, PagePagination
+from core.throttling import AnonRateThrottle
+from core.schemas import (
+    LoginRespSchema,
+    ProductFilterSchema,
+    ProductRespSchema,
+    PagedProductRespSchema,
+    CreateProductReqSchema,
+    ImageRespSchema,
+    ErrorSchema,
+    NoContent,
+    UpdateProductReqSchema,
+    BatchProductRespSchema,
+    ProductChangesRespSchema,
+)
+
+# Same routes as `core.apis.v1` for the ASGI deployment. Reads and simple
+# writes use the async ORM, the endpoints that need a transaction or touch the
+# filesystem reuse the sync handlers, which ninja runs in a worker thread.
+router = Router()
+
+
+async def aget_product_or_404(product_id: int, user_id: int) -> Product:
+    try:
+        return await Product.objects.aget(id=product_id, user_id=user_id)
+    except Product.DoesNotExist:
+        raise Http404()
+
+
+router.post(
+    "/login/access-token/",
+    response={
+        200: LoginRespSchema,
+        401: ErrorSchema
+    },
+    throttle=AnonRateThrottle(settings.LOGIN_RATE_THROTTLE, scope='login'),
+)(v1.get_access_token)
+
+
+router.post(
+    "/login/refresh-token/",
+    response={
+        200: LoginRespSchema,
+        401: ErrorSchema
+    }
+)(v1.get_access_token_from_refresh_token)
+
+
+@router.get(
+    "/products",
+    response=List[ProductRespSchema],
+    auth=AsyncJWTAuth()
+)
+@query_budget(5)
+@cache_product_list_response(PagedProductRespSchema)
+@paginate(PageOrCursorPagination)
+async def get_products(request, filters: ProductFilterSchema = Query(...)):
+    return filters.filter(Product.objects.filter(user_id=request.user.id))
+
+
+@router.get(
+    "/products/search",
+    response=List[ProductRespSchema],
+    auth=AsyncJWTAuth()
+)
+@query_budget(5)
+@paginate(PagePagination)
+async def search_products(request, q: str = Query(..., min_length=1, max_length=100)):
+    return Product.objects.filter(user_id=request.user.id).search(q)
+
+
+@router.get(
+    "/products/export",
+    auth=AsyncJWTAuth()
+)
+@query_budget(1)
+async def export_user_products(request, export_format: ExportFormat = Query('ndjson', alias='format')):
+    return aexport_products(Product.objects.filter(user_id=request.user.id).order_by('id'), export_format)
+
+
+router.get(
+    "/products/changes",
+    response={
+        200: ProductChangesRespSchema,
+        400: ErrorSchema,
+        410: ErrorSchema
+    },
+    auth=JWTAuth()
+)(v1.get_changed_products)
+
+
+router.post(
+    "/products/batch/",
+    response={200: BatchProductRespSchema},
+    auth=JWTAuth()
+)(v1.batch_products)
+
+
+@router.get(
+    "/products/{product_id}",
+    response={
+        200: ProductRespSchema,
+        404: ErrorSchema
+    },
+    auth=AsyncJWTAuth()
+)
+@query_budget(5)
+async def get_product(request, product_id: int, response: HttpResponse):
+    if has_preconditions(request):
+        state = await Product.objects.only('id', 'updated_at').with_image_state().filter(
+            id=product_id,
+            user_id=request.user.id
+        ).afirst()
+        if state is None:
+            raise Http404()
+        if (not_modified := get_not_modified_response(request, state.etag, state.last_modified)) is not None:
+            return not_modified
+
+    product = await aget_product_or_404(product_id, request.user.id)
+    await Product.aprefetch_images([product])
+    set_validators(response, product.etag, product.last_modified)
+    return product
+
+
+router.delete(
+    "/products/{product_id}",
+    response={
+        204: NoContent,
+        404: ErrorSchema
+    },
+    auth=JWTAuth()
+)(v1.delete_product)
+
+
+@router.post(
+    "/products/",
+    response={201: ProductRespSchema},
+    auth=AsyncJWTAuth()
+)
+@query_budget(4)
+async def create_product(request, payload: CreateProductReqSchema):
+    product = await Product.objects.acreate(user_id=request.user.id, **payload.dict())
+    product._prefetched_images = []
+    await abump_product_list_version(request.user.id)
+    return product
+
+
+@router.put(
+    "/products/{product_id}/",
+    response={
+        200: ProductRespSchema
+    },
+    auth=AsyncJWTAuth()
+)
+@query_budget(5)
+async def update_product(request, product_id: int, payload: UpdateProductReqSchema):
+    product = await aget_product_or_404(product_id, request.user.id)
+    for key, value in payload.dict(exclude_none=True).items():
+        setattr(product, key, value)
+
+    await product.asave()
+    await Product.aprefetch_images([product])
+    await abump_product_list_version(request.user.id)
+    return product
+
+
+router.post(
+    "/products/{product_id}/images/",
+    response={
+        201: List[ImageRespSchema],
+        400: ErrorSchema
+    },
+    auth=JWTAuth(),
+)(v1.upload_images_for_product)
+
+
+router.delete(
+    "/products/{product_id}/images/{image_id}/",
+    response={
+        204: NoContent,
+        404: ErrorSchema
+    },
+    auth=JWTAuth(),
+)(v1.delete_product_image)
@@ -1,13 +1,27 @@
+import hashlib
+import time
+from dataclasses import dataclass
 from datetime import datetime, timedelta
-from typing import Optional
+from typing import Optional, Union
 
 import jwt
 
 from django.conf import settings
+from django.core.cache import cache
 from django.http import HttpRequest
 from django.contrib.auth import get_user_model
 from ninja.security import HttpBearer
 
+from .instrumentation import record_cache_access
+from .routers import ause_primary_after_write, use_primary_after_write
+from .utils import ExpiringLRUCache
+
+
+USER_ACTIVE_CACHE_KEY = 'auth:user:{user_id}:active'
+
+token_payload_cache = ExpiringLRUCache(settings.JWT_PAYLOAD_CACHE_SIZE)
+local_user_state_cache = ExpiringLRUCache(settings.JWT_USER_LOCAL_CACHE_SIZE)
+
 
 def create_access_token(data: dict, expires_delta: timedelta = None) -> str:
     to_encode = data.copy()
@@ -24,18 +38,90 @@ def create_refresh_token(data: dict, expires_delta: timedelta = None) -> str:
 
 
 def decode_access_token(token: str) -> Optional[dict]:
+    # Verified payloads are cached until the token's own expiry, so a token
+    # reused by a client is only verified once per process.
+    token_digest = hashlib.sha256(token.encode()).digest()
+    if (payload := token_payload_cache.get(token_digest)) is not None:
+        return dict(payload)
+
     try:
         payload = jwt.decode(token, settings.JWT_SECRET_KEY, algorithms=[settings.JWT_ALGORITHM])
-        return payload
+        if 'exp' in payload:
+            token_payload_cache.set(token_digest, payload, payload['exp'])
+        return dict(payload)
     except jwt.ExpiredSignatureError:
         return None
     except jwt.InvalidTokenError:
         return None
 
 
+@dataclass(frozen=True)
+class TokenUser:
+    """
+    Request principal built from verified token claims, used by the stateless
+    mode of `JWTAuth` instead of a user loaded from the database.
+    """
+    id: int
+
+    is_authenticated = True
+    is_anonymous = False
+
+    @property
+    def pk(self) -> int:
+        return self.id
+
+    def __str__(self) -> str:
+        return str(self.id)
+
+
+def is_user_active(user_id: int) -> bool:
+    """
+    Looks the user state up in the per-process cache, then in the shared cache
+    and only then in the database.
+    """
+    if (is_active := local_user_state_cache.get(user_id)) is not None:
+        record_cache_access(hit=True)
+        return is_active
+
+    cache_key = USER_ACTIVE_CACHE_KEY.format(user_id=user_id)
+    is_active = cache.get(cache_key)
+    record_cache_access(hit=is_active is not None)
+    if is_active is None:
+        is_active = get_user_model().objects.filter(pk=user_id, is_active=True).exists()
+        cache.set(cache_key, is_active, settings.JWT_USER_CACHE_TIMEOUT)
+
+    local_user_state_cache.set(user_id, is_active, time.time() + settings.JWT_USER_LOCAL_CACHE_TIMEOUT)
+    return is_active
+
+
+async def ais_user_active(user_id: int) -> bool:
+    if (is_active := local_user_state_cache.get(user_id)) is not None:
+        record_cache_access(hit=True)
+        return is_active
+
+    cache_key = USER_ACTIVE_CACHE_KEY.format(user_id=user_id)
+    is_active = await cache.aget(cache_key)
+    record_cache_access(hit=is_active is not None)
+    if is_active is None:
+        is_active = await get_user_model().objects.filter(pk=user_id, is_active=True).aexists()
+        await cache.aset(cache_key, is_active, settings.JWT_USER_CACHE_TIMEOUT)
+
+    local_user_state_cache.set(user_id, is_active, time.time() + settings.JWT_USER_LOCAL_CACHE_TIMEOUT)
+    return is_active
+
+
+def invalidate_user_state(user_id: int) -> None:
+    cache.delete(USER_ACTIVE_CACHE_KEY.format(user_id=user_id))
+    local_user_state_cache.delete(user_id)
+
+
 class JWTAuth(HttpBearer):
-    def authenticate(self, request: HttpRequest, token: str) -> Optional[get_user_model()]:
+    def authenticate(self, request: HttpRequest, token: str) -> Optional[Union[get_user_model(), TokenUser]]:
+        if settings.JWT_STATELESS_AUTH:
+            return self._authenticate_from_claims(request, token)
+
         if payload := decode_access_token(token):
+            use_primary_after_write(payload.get('id'))
             try:
                 user = get_user_model().objects.get(
                     pk=payload.get("id")
@@ -45,3 +131,31 @@ class JWTAuth(HttpBearer):
             except get_user_model().DoesNotExist:
                 return None
         return None
+
+    @staticmethod
+    def _authenticate_from_claims(request: HttpRequest, token: str) -> Optional[TokenUser]:
+        if not (payload := decode_access_token(token)):
+            return None
+
+        use_primary_after_write(payload.get('id'))
+        if is_user_active(payload.get('id')):
+            user = TokenUser(id=payload['id'])
+            request.user = user
+            return user
+        return None
+
+
+class AsyncJWTAuth(JWTAuth):
+    async def authenticate(self, request: HttpRequest, token: str) -> Optional[Union[get_user_model(), TokenUser]]:
+        if not (payload := decode_access_token(token)):
+            return None
+
+        await ause_primary_after_write(payload.get('id'))
+        if settings.JWT_STATELESS_AUTH:
+            user = TokenUser(id=payload['id']) if await ais_user_active(payload.get('id')) else None
+        else:
+            user = await get_user_model().objects.filter(pk=payload.get("id")).afirst()
+
+        if user is not None:
+            request.user = user
+        return user
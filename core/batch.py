@@ -0,0 +1,78 @@
+from typing import Any, Dict, List, Sequence, Set
+
+from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Image, Product, Tombstone
+
+
+def apply_product_batch(user_id: int, operations: Sequence[Any]) -> List[Dict[str, Any]]:
+    """
+    Applies a batch of `create`, `update` and `delete` operations on the
+    products of a user in one transaction, with a query per kind of operation
+    whatever the size of the batch. Operations on the same product apply in
+    order, one on a product that does not exist (anymore) is reported as not
+    found instead of failing the batch. Returns a result per operation.
+    """
+    ids = {operation.id for operation in operations if operation.op != 'create'}
+    created: List[Product] = []
+    updated: Dict[int, Product] = {}
+    updated_fields: Set[str] = set()
+    deleted: Set[int] = set()
+    results = []
+
+    with transaction.atomic():
+        products = Product.objects.select_for_update().filter(user_id=user_id, id__in=ids).in_bulk() if ids else {}
+        now = timezone.now()
+
+        for operation in operations:
+            if operation.op == 'create':
+                product = Product(user_id=user_id, **operation.dict(exclude={'op'}))
+                product._prefetched_images = []
+                created.append(product)
+                results.append((operation, 201, product))
+                continue
+
+            product = products.get(operation.id)
+            if product is None or product.id in deleted:
+                results.append((operation, 404, None))
+            elif operation.op == 'update':
+                for key, value in operation.dict(exclude={'op', 'id'}, exclude_none=True).items():
+                    setattr(product, key, value)
+                    updated_fields.add(key)
+                # `bulk_update` does not set `auto_now` fields
+                product.updated_at = now
+                updated[product.id] = product
+                results.append((operation, 200, product))
+            else:
+                deleted.add(product.id)
+                results.append((operation, 204, None))
+
+        if created:
+            Product.objects.bulk_create(created)
+
+        if to_update := [product for product in updated.values() if product.id not in deleted]:
+            Product.objects.bulk_update(to_update, [*updated_fields, 'updated_at'])
+
+        if deleted:
+            Image.objects.filter(
+                content_type=ContentType.objects.get_for_model(Product),
+                object_id__in=deleted
+            ).delete()
+            Product.objects.filter(id__in=deleted).delete()
+            Tombstone.record_products(user_id, deleted)
+
+        if updated:
+            Product.prefetch_images(updated.values())
+
+    return [
+        {
+            'op': operation.op,
+            'id': product.id if product is not None else operation.id,
+            'status': status,
+            'product': product,
+            'detail': 'Not Found' if status == 404 else None,
+        }
+        for operation, status, product in results
+    ]
@@ -0,0 +1,294 @@
+import json
+import logging
+import os
+import pickle
+import threading
+import time
+import uuid
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+from django.core.cache.backends.redis import RedisCache
+
+from .utils import ExpiringLRUCache
+
+
+logger = logging.getLogger(__name__)
+
+_MISSING = object()
+
+# deletes the key only while it holds the value, so a lock that timed out and
+# was taken over meanwhile is not released by its previous holder
+DELETE_IF_EQUAL_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+class LocalCacheTier:
+    """
+    The in-process tier shared by every thread of a worker. It only answers
+    reads while it is subscribed to the invalidation channel, entries written
+    by other workers are dropped when their invalidation arrives and expire
+    after `timeout` seconds at the latest.
+    """
+
+    RECONNECT_DELAY = 1
+
+    def __init__(self, max_entries: int, timeout: int, channel: str):
+        self.enabled = max_entries > 0
+        self.timeout = timeout
+        self.channel = channel
+        self.sender = uuid.uuid4().hex
+        self.entries = ExpiringLRUCache(max_entries)
+        # when keys were last invalidated, a value read from Redis before
+        # that may already be outdated and is not kept
+        self.invalidations = ExpiringLRUCache(max_entries)
+        self.cleared_at = 0.0
+        self.subscribed = threading.Event()
+        self._listener: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Any:
+        if not self.subscribed.is_set():
+            return _MISSING
+
+        # values are kept pickled so callers can not mutate the cached copy
+        if (data := self.entries.get(key)) is None:
+            return _MISSING
+        return pickle.loads(data)
+
+    def set(self, key: str, value: Any, timeout: Optional[int] = None, read_at: Optional[float] = None) -> None:
+        if not self.subscribed.is_set():
+            return
+
+        if read_at is not None and (
+            read_at <= self.cleared_at or read_at <= self.invalidations.get(key, self.cleared_at)
+        ):
+            return
+
+        if timeout is not None:
+            timeout = min(timeout, self.timeout)
+        else:
+            timeout = self.timeout
+        self.entries.set(key, pickle.dumps(value, pickle.HIGHEST_PROTOCOL), time.time() + timeout)
+
+    def write(self, key: str, value: Any, timeout: Optional[int] = None) -> None:
+        """
+        Keeps a value just written to Redis, values of the key read before
+        the write are not kept over it.
+        """
+        self.invalidate([key])
+        self.set(key, value, timeout)
+
+    def invalidate(self, keys: Iterable[str]) -> None:
+        now = time.monotonic()
+        for key in keys:
+            self.entries.delete(key)
+            self.invalidations.set(key, now, time.time() + self.timeout)
+
+    def clear(self) -> None:
+        self.cleared_at = time.monotonic()
+        self.entries.clear()
+        self.invalidations.clear()
+
+    def message(self, keys: Optional[Iterable[str]] = None) -> str:
+        """
+        Payload of an invalidation message, all keys are cleared without them.
+        """
+        return json.dumps({'sender': self.sender, 'keys': None if keys is None else list(keys)})
+
+    def handle_message(self, data: bytes) -> None:
+        payload = json.loads(data)
+        if payload['sender'] == self.sender:
+            return
+
+        if payload['keys'] is None:
+            self.clear()
+        else:
+            self.invalidate(payload['keys'])
+
+    def start_listener(self, client) -> None:
+        with self._lock:
+            if self._listener is None or not self._listener.is_alive():
+                self._listener = threading.Thread(target=self._listen, args=(client, ), daemon=True)
+                self._listener.start()
+
+    def _listen(self, client) -> None:
+        while True:
+            try:
+                pubsub = client.pubsub()
+                pubsub.subscribe(self.channel)
+                for message in pubsub.listen():
+                    if message['type'] == 'subscribe':
+                        self.subscribed.set()
+                    elif message['type'] == 'message':
+                        self.handle_message(message['data'])
+            except Exception:  # noqa
+                logger.warning('Lost the cache invalidation channel %s', self.channel, exc_info=True)
+            finally:
+                # invalidations may have been missed while disconnected
+                self.subscribed.clear()
+                self.clear()
+
+            time.sleep(self.RECONNECT_DELAY)
+
+
+_local_tiers: Dict[Tuple[Any, ...], LocalCacheTier] = {}
+_local_tiers_lock = threading.Lock()
+_local_tiers_pid = os.getpid()
+
+
+def get_local_tier(servers: Iterable[str], max_entries: int, timeout: int, channel: str) -> LocalCacheTier:
+    """
+    Django creates a cache backend per thread, the local tier and its listener
+    are shared per process instead. Forked workers start with empty tiers.
+    """
+    global _local_tiers_pid
+
+    key = (tuple(servers), max_entries, timeout, channel)
+    with _local_tiers_lock:
+        if _local_tiers_pid != os.getpid():
+            _local_tiers.clear()
+            _local_tiers_pid = os.getpid()
+
+        if key not in _local_tiers:
+            _local_tiers[key] = LocalCacheTier(max_entries, timeout, channel)
+        return _local_tiers[key]
+
+
+class TwoTierRedisCache(RedisCache):
+    """
+    `RedisCache` with a bounded per-worker LRU in front of it. Reads are
+    answered from the LRU when possible, writes go to Redis and publish the
+    changed keys so every other worker drops its copy.
+
+    Configured with the `LOCAL_MAX_ENTRIES`, `LOCAL_TIMEOUT` and
+    `INVALIDATION_CHANNEL` entries of `OPTIONS`, the rest of them is passed
+    to the Redis client as usual.
+    """
+
+    def __init__(self, server, params):
+        params = dict(params)
+        options = dict(params.get('OPTIONS', {}))
+        max_entries = options.pop('LOCAL_MAX_ENTRIES', 10000)
+        timeout = options.pop('LOCAL_TIMEOUT', 5)
+        channel = options.pop('INVALIDATION_CHANNEL', 'cache:invalidations')
+        params['OPTIONS'] = options
+        super().__init__(server, params)
+        self._local = get_local_tier(self._servers, max_entries, timeout, channel)
+
+    def _start_listener(self) -> None:
+        if self._local.enabled and not self._local.subscribed.is_set():
+            self._local.start_listener(self._cache.get_client(None, write=False))
+
+    def _publish(self, keys: Optional[Iterable[str]] = None) -> None:
+        if self._local.enabled:
+            self._cache.get_client(None, write=True).publish(self._local.channel, self._local.message(keys))
+
+    def get(self, key, default=None, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        if (value := self._local.get(key)) is not _MISSING:
+            return value
+
+        self._start_listener()
+        read_at = time.monotonic()
+        value = self._cache.get(key, _MISSING)
+        if value is _MISSING:
+            return default
+
+        self._local.set(key, value, read_at=read_at)
+        return value
+
+    def get_many(self, keys, version=None):
+        key_map = {self.make_and_validate_key(key, version=version): key for key in keys}
+        result = {}
+        for key in key_map:
+            if (value := self._local.get(key)) is not _MISSING:
+                result[key_map[key]] = value
+
+        if missing_keys := [key for key in key_map if key_map[key] not in result]:
+            self._start_listener()
+            read_at = time.monotonic()
+            for key, value in self._cache.get_many(missing_keys).items():
+                self._local.set(key, value, read_at=read_at)
+                result[key_map[key]] = value
+
+        return result
+
+    def has_key(self, key, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        return self._local.get(key) is not _MISSING or self._cache.has_key(key)
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        timeout = self.get_backend_timeout(timeout)
+        self._cache.set(key, value, timeout)
+        self._publish([key])
+        self._local.write(key, value, timeout)
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        timeout = self.get_backend_timeout(timeout)
+        if added := self._cache.add(key, value, timeout):
+            self._publish([key])
+            self._local.write(key, value, timeout)
+        return added
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        if not data:
+            return []
+
+        safe_data = {self.make_and_validate_key(key, version=version): value for key, value in data.items()}
+        timeout = self.get_backend_timeout(timeout)
+        self._cache.set_many(safe_data, timeout)
+        self._publish(safe_data)
+        for key, value in safe_data.items():
+            self._local.write(key, value, timeout)
+        return []
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        touched = self._cache.touch(key, self.get_backend_timeout(timeout))
+        self._local.invalidate([key])
+        return touched
+
+    def incr(self, key, delta=1, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        value = self._cache.incr(key, delta)
+        # after the write, a value read before it is not kept then
+        self._local.invalidate([key])
+        self._publish([key])
+        return value
+
+    def delete(self, key, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        deleted = self._cache.delete(key)
+        self._local.invalidate([key])
+        self._publish([key])
+        return deleted
+
+    def delete_if_equal(self, key, value, version=None) -> bool:
+        key = self.make_and_validate_key(key, version=version)
+        script = self._cache.get_client(key, write=True).register_script(DELETE_IF_EQUAL_SCRIPT)
+        if deleted := bool(script(keys=[key], args=[self._cache._serializer.dumps(value)])):
+            self._local.invalidate([key])
+            self._publish([key])
+        return deleted
+
+    def delete_many(self, keys, version=None):
+        if not keys:
+            return
+
+        safe_keys = [self.make_and_validate_key(key, version=version) for key in keys]
+        self._cache.delete_many(safe_keys)
+        self._local.invalidate(safe_keys)
+        self._publish(safe_keys)
+
+    def clear(self):
+        cleared = self._cache.clear()
+        self._local.clear()
+        self._publish()
+        return cleared
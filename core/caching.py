@@ -0,0 +1,268 @@
+import asyncio
+import hashlib
+import json
+import math
+import random
+import time
+import uuid
+from functools import wraps
+from typing import Any, Awaitable, Callable, Optional, Tuple, Type
+from urllib.parse import urlencode
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpRequest, HttpResponse
+from ninja import Schema
+from ninja.responses import NinjaJSONEncoder
+
+from .conditional import get_not_modified_response, set_validators
+from .instrumentation import measure_serialization, record_cache_access
+
+
+PRODUCT_LIST_VERSION_CACHE_KEY = 'products:user:{user_id}:version'
+PRODUCT_LIST_MODIFIED_CACHE_KEY = 'products:user:{user_id}:modified'
+PRODUCT_LIST_PAGE_CACHE_KEY = 'products:user:{user_id}:version:{version}:page:{query_digest}'
+REBUILD_LOCK_CACHE_KEY = '{key}:rebuild-lock'
+REBUILD_POLL_INTERVAL = 0.05
+
+# (value, logical expiry as unix time, seconds the last rebuild took)
+CacheEntry = Tuple[Any, float, float]
+
+
+def _is_due(entry: CacheEntry) -> bool:
+    # probabilistic early expiration, the closer the expiry and the slower the
+    # rebuild the likelier a request volunteers to rebuild ahead of time
+    _, expires_at, build_time = entry
+    early = build_time * settings.CACHE_EARLY_REFRESH_BETA * -math.log(1 - random.random())
+    return time.time() + early >= expires_at
+
+
+def _make_entry(value: Any, build_time: float, timeout: Optional[int]) -> CacheEntry:
+    return value, time.time() + timeout, build_time
+
+
+def _release_lock(lock_key: str, token: str) -> None:
+    # the lock may have timed out and been taken by another process meanwhile,
+    # the Redis backend compares and deletes in one step
+    if hasattr(cache, 'delete_if_equal'):
+        cache.delete_if_equal(lock_key, token)
+    elif cache.get(lock_key) == token:
+        cache.delete(lock_key)
+
+
+def get_or_rebuild(key: str, build: Callable[[], Any], timeout: Optional[int] = None) -> Any:
+    """
+    Returns the value cached under `key` and rebuilds it with `build` when it
+    expired, so that only one request rebuilds it at a time: the rebuild is
+    guarded by a lock taken with `cache.add` (`SET NX` on Redis), meanwhile
+    the expired value is served for `CACHE_STALE_TIMEOUT` more seconds and
+    requests without one wait for the rebuild. Values are also refreshed a
+    little ahead of their expiry, at random, so hot keys do not expire under
+    load at all.
+    """
+    timeout = cache.default_timeout if timeout is None else timeout
+    lock_key = REBUILD_LOCK_CACHE_KEY.format(key=key)
+    token = uuid.uuid4().hex
+    deadline = time.monotonic() + settings.CACHE_REBUILD_LOCK_TIMEOUT
+
+    while True:
+        entry = cache.get(key)
+        if entry is not None and not _is_due(entry):
+            record_cache_access(hit=True)
+            return entry[0]
+
+        if cache.add(lock_key, token, settings.CACHE_REBUILD_LOCK_TIMEOUT):
+            try:
+                return _rebuild(key, build, timeout)
+            finally:
+                _release_lock(lock_key, token)
+
+        if entry is not None:
+            record_cache_access(hit=True)
+            return entry[0]
+
+        if time.monotonic() >= deadline:
+            return _rebuild(key, build, timeout)
+
+        time.sleep(REBUILD_POLL_INTERVAL)
+
+
+def _rebuild(key: str, build: Callable[[], Any], timeout: Optional[int]) -> Any:
+    record_cache_access(hit=False)
+    start = time.perf_counter()
+    value = build()
+    cache.set(key, _make_entry(value, time.perf_counter() - start, timeout), timeout + settings.CACHE_STALE_TIMEOUT)
+    return value
+
+
+async def aget_or_rebuild(key: str, build: Callable[[], Awaitable[Any]], timeout: Optional[int] = None) -> Any:
+    timeout = cache.default_timeout if timeout is None else timeout
+    lock_key = REBUILD_LOCK_CACHE_KEY.format(key=key)
+    token = uuid.uuid4().hex
+    deadline = time.monotonic() + settings.CACHE_REBUILD_LOCK_TIMEOUT
+
+    while True:
+        entry = await cache.aget(key)
+        if entry is not None and not _is_due(entry):
+            record_cache_access(hit=True)
+            return entry[0]
+
+        if await cache.aadd(lock_key, token, settings.CACHE_REBUILD_LOCK_TIMEOUT):
+            try:
+                return await _arebuild(key, build, timeout)
+            finally:
+                await sync_to_async(_release_lock)(lock_key, token)
+
+        if entry is not None:
+            record_cache_access(hit=True)
+            return entry[0]
+
+        if time.monotonic() >= deadline:
+            return await _arebuild(key, build, timeout)
+
+        await asyncio.sleep(REBUILD_POLL_INTERVAL)
+
+
+async def _arebuild(key: str, build: Callable[[], Awaitable[Any]], timeout: Optional[int]) -> Any:
+    record_cache_access(hit=False)
+    start = time.perf_counter()
+    value = await build()
+    await cache.aset(
+        key,
+        _make_entry(value, time.perf_counter() - start, timeout),
+        timeout + settings.CACHE_STALE_TIMEOUT
+    )
+    return value
+
+
+def get_product_list_version(user_id: int) -> int:
+    # Versions never expire, a missing one is initialized from the clock so it
+    # can not collide with a version that pages may still be cached under.
+    return cache.get_or_set(
+        PRODUCT_LIST_VERSION_CACHE_KEY.format(user_id=user_id),
+        time.time_ns,
+        timeout=None
+    )
+
+
+async def aget_product_list_version(user_id: int) -> int:
+    return await cache.aget_or_set(
+        PRODUCT_LIST_VERSION_CACHE_KEY.format(user_id=user_id),
+        time.time_ns,
+        timeout=None
+    )
+
+
+def get_product_list_state(user_id: int) -> Tuple[int, Optional[float]]:
+    """
+    The version of the user's product list and when it last changed, unknown
+    until the next change for versions initialized on a read.
+    """
+    keys = [
+        PRODUCT_LIST_VERSION_CACHE_KEY.format(user_id=user_id),
+        PRODUCT_LIST_MODIFIED_CACHE_KEY.format(user_id=user_id),
+    ]
+    state = cache.get_many(keys)
+    if keys[0] not in state:
+        return get_product_list_version(user_id), None
+    return state[keys[0]], state.get(keys[1])
+
+
+async def aget_product_list_state(user_id: int) -> Tuple[int, Optional[float]]:
+    keys = [
+        PRODUCT_LIST_VERSION_CACHE_KEY.format(user_id=user_id),
+        PRODUCT_LIST_MODIFIED_CACHE_KEY.format(user_id=user_id),
+    ]
+    state = await cache.aget_many(keys)
+    if keys[0] not in state:
+        return await aget_product_list_version(user_id), None
+    return state[keys[0]], state.get(keys[1])
+
+
+def bump_product_list_version(user_id: int) -> None:
+    """
+    Invalidates every cached product list page of the user at once.
+    """
+    try:
+        cache.incr(PRODUCT_LIST_VERSION_CACHE_KEY.format(user_id=user_id))
+    except ValueError:
+        cache.set(PRODUCT_LIST_VERSION_CACHE_KEY.format(user_id=user_id), time.time_ns(), timeout=None)
+    cache.set(PRODUCT_LIST_MODIFIED_CACHE_KEY.format(user_id=user_id), time.time(), timeout=None)
+
+
+async def abump_product_list_version(user_id: int) -> None:
+    try:
+        await cache.aincr(PRODUCT_LIST_VERSION_CACHE_KEY.format(user_id=user_id))
+    except ValueError:
+        await cache.aset(PRODUCT_LIST_VERSION_CACHE_KEY.format(user_id=user_id), time.time_ns(), timeout=None)
+    await cache.aset(PRODUCT_LIST_MODIFIED_CACHE_KEY.format(user_id=user_id), time.time(), timeout=None)
+
+
+def get_product_list_page_cache_key(request: HttpRequest, version: int) -> str:
+    query = urlencode(sorted(request.GET.lists()), doseq=True)
+    return PRODUCT_LIST_PAGE_CACHE_KEY.format(
+        user_id=request.user.id,
+        version=version,
+        query_digest=hashlib.md5(query.encode()).hexdigest(),
+    )
+
+
+def get_product_list_page_etag(page_cache_key: str) -> str:
+    # weak, pages of a version are equivalent but not byte-identical once
+    # rebuilt, every change of a product, image variants included, bumps it
+    return 'W/"%s"' % hashlib.md5(page_cache_key.encode()).hexdigest()
+
+
+def _render(schema: Type[Schema], result: dict) -> str:
+    with measure_serialization():
+        return json.dumps(schema.from_orm(result).model_dump(), cls=NinjaJSONEncoder)
+
+
+def cache_product_list_response(schema: Type[Schema]) -> Callable:
+    """
+    Caches the serialized JSON of a paginated product list view per user and
+    query string. Must be applied on top of `paginate`, cache hits skip the
+    view, the paginator and the schema validation, concurrent misses of a page
+    rebuild it once. Pages carry an ETag of their version and query string, a
+    matching `If-None-Match` or `If-Modified-Since` is answered with a 304
+    before the page is even read from the cache. Works for sync and async
+    views.
+    """
+
+    def decorator(view_func: Callable) -> Callable:
+        if asyncio.iscoroutinefunction(view_func):
+            @wraps(view_func)
+            async def async_wrapper(request: HttpRequest, **kwargs) -> HttpResponse:
+                async def build() -> str:
+                    return _render(schema, await view_func(request, **kwargs))
+
+                version, modified_at = await aget_product_list_state(request.user.id)
+                key = get_product_list_page_cache_key(request, version)
+                etag = get_product_list_page_etag(key)
+                if (response := get_not_modified_response(request, etag, modified_at)) is not None:
+                    return response
+
+                content = await aget_or_rebuild(key, build)
+                return set_validators(
+                    HttpResponse(content, content_type='application/json; charset=utf-8'), etag, modified_at
+                )
+
+            return async_wrapper
+
+        @wraps(view_func)
+        def wrapper(request: HttpRequest, **kwargs) -> HttpResponse:
+            version, modified_at = get_product_list_state(request.user.id)
+            key = get_product_list_page_cache_key(request, version)
+            etag = get_product_list_page_etag(key)
+            if (response := get_not_modified_response(request, etag, modified_at)) is not None:
+                return response
+
+            content = get_or_rebuild(key, lambda: _render(schema, view_func(request, **kwargs)))
+            return set_validators(
+                HttpResponse(content, content_type='application/json; charset=utf-8'), etag, modified_at
+            )
+
+        return wrapper
+
+    return decorator
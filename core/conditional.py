@@ -0,0 +1,46 @@
+from datetime import datetime
+from typing import Optional, Union
+
+from django.http import HttpRequest, HttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
+
+
+Timestamp = Union[datetime, float, None]
+
+
+def _to_timestamp(last_modified: Timestamp) -> Optional[int]:
+    if isinstance(last_modified, datetime):
+        return int(last_modified.timestamp())
+    return None if last_modified is None else int(last_modified)
+
+
+def has_preconditions(request: HttpRequest) -> bool:
+    return 'HTTP_IF_NONE_MATCH' in request.META or 'HTTP_IF_MODIFIED_SINCE' in request.META
+
+
+def set_validators(response: HttpResponse, etag: str, last_modified: Timestamp = None) -> HttpResponse:
+    """
+    Adds the `ETag` and `Last-Modified` headers, responses are per user and
+    revalidated by clients before each reuse.
+    """
+    response['ETag'] = etag
+    if (timestamp := _to_timestamp(last_modified)) is not None:
+        response['Last-Modified'] = http_date(timestamp)
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
+def get_not_modified_response(
+    request: HttpRequest,
+    etag: str,
+    last_modified: Timestamp = None
+) -> Optional[HttpResponse]:
+    """
+    A 304 response when the `If-None-Match` or else the `If-Modified-Since`
+    header of the request matches, `None` when the resource has to be sent.
+    """
+    response = get_conditional_response(request, etag=etag, last_modified=_to_timestamp(last_modified))
+    if response is None:
+        return None
+    return set_validators(response, etag, last_modified)
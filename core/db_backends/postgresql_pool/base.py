@@ -0,0 +1,326 @@
+import logging
+import os
+import threading
+import time
+from collections import deque
+from functools import partial
+from typing import Callable, Deque, Dict, Optional, Tuple
+
+import psycopg2
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE
+
+from django.db.backends.postgresql import base, creation
+from django.db.backends.postgresql.psycopg_any import IsolationLevel
+
+
+logger = logging.getLogger(__name__)
+
+
+class PoolTimeout(psycopg2.OperationalError):
+    pass
+
+
+class ConnectionPool:
+    """
+    Connections of a database shared by the threads of a process. Up to
+    `max_size` connections are kept open, `max_overflow` more are opened under
+    load and closed when returned. When all are in use a checkout waits up to
+    `timeout` seconds for one to be returned. Connections idle for longer than
+    `check_interval` seconds are checked with `SELECT 1` before reuse.
+    """
+
+    def __init__(self, max_size: int, max_overflow: int, timeout: float, check_interval: float):
+        self.max_size = max_size
+        self.max_overflow = max_overflow
+        self.timeout = timeout
+        self.check_interval = check_interval
+        self.pid = os.getpid()
+        self.closed = False
+        self._condition = threading.Condition()
+        # the most recently returned connection is reused first, so the
+        # connections beyond the load of the moment stay idle
+        self._idle: Deque[Tuple[object, float]] = deque()
+        self._size = 0
+        self._waiting = 0
+        self._stats = {
+            'checkouts': 0,
+            'waits': 0,
+            'wait_seconds': 0.0,
+            'timeouts': 0,
+            'opened': 0,
+            'closed': 0,
+            'failed_checks': 0,
+        }
+
+    def getconn(self, connect: Callable[[], object]):
+        deadline = time.monotonic() + self.timeout
+        while True:
+            connection, idle_since = self._acquire(deadline)
+            if connection is None:
+                try:
+                    connection = connect()
+                except Exception:
+                    self._release_slot()
+                    raise
+                with self._condition:
+                    self._stats['opened'] += 1
+                return connection
+
+            if time.monotonic() - idle_since < self.check_interval or self._is_alive(connection):
+                return connection
+
+            with self._condition:
+                self._stats['failed_checks'] += 1
+            self._discard(connection)
+
+    def putconn(self, connection, discard: bool = False) -> None:
+        if not discard and not connection.closed:
+            try:
+                if connection.info.transaction_status != TRANSACTION_STATUS_IDLE:
+                    connection.rollback()
+                # session settings, temporary tables and locks of this
+                # checkout would leak to the next one
+                connection.autocommit = True
+                with connection.cursor() as cursor:
+                    cursor.execute('DISCARD ALL')
+            except psycopg2.Error:
+                discard = True
+
+        with self._condition:
+            if not discard and not self.closed and not connection.closed and self._size <= self.max_size:
+                self._idle.append((connection, time.monotonic()))
+                self._condition.notify()
+                return
+        self._discard(connection)
+
+    def close(self) -> None:
+        """
+        Closes the idle connections, the ones in use are closed when returned.
+        """
+        with self._condition:
+            self.closed = True
+            idle = [connection for connection, _ in self._idle]
+            self._idle.clear()
+        for connection in idle:
+            self._discard(connection)
+
+    def stats(self) -> Dict[str, float]:
+        with self._condition:
+            return {
+                'size': self._size,
+                'idle': len(self._idle),
+                'in_use': self._size - len(self._idle),
+                'waiting': self._waiting,
+                'max_size': self.max_size,
+                'max_overflow': self.max_overflow,
+                **self._stats,
+            }
+
+    def _acquire(self, deadline: float):
+        """
+        An idle connection and since when it is idle, or `(None, 0)` when a
+        new connection can be opened.
+        """
+        with self._condition:
+            self._stats['checkouts'] += 1
+            waited = False
+            start = time.monotonic()
+            try:
+                while True:
+                    if self._idle:
+                        return self._idle.pop()
+                    if self._size < self.max_size + self.max_overflow:
+                        self._size += 1
+                        return None, 0.0
+
+                    if (remaining := deadline - time.monotonic()) <= 0:
+                        self._stats['timeouts'] += 1
+                        raise PoolTimeout(
+                            f'No connection available within {self.timeout} seconds, '
+                            f'{self._size} connections in use'
+                        )
+                    if not waited:
+                        waited = True
+                        self._stats['waits'] += 1
+                    self._waiting += 1
+                    try:
+                        self._condition.wait(remaining)
+                    finally:
+                        self._waiting -= 1
+            finally:
+                if waited:
+                    self._stats['wait_seconds'] += time.monotonic() - start
+
+    def _release_slot(self) -> None:
+        with self._condition:
+            self._size -= 1
+            self._condition.notify()
+
+    def _discard(self, connection) -> None:
+        try:
+            connection.close()
+        except psycopg2.Error:
+            pass
+        with self._condition:
+            self._stats['closed'] += 1
+        self._release_slot()
+
+    @staticmethod
+    def _is_alive(connection) -> bool:
+        if connection.closed:
+            return False
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT 1')
+            return True
+        except psycopg2.Error:
+            return False
+
+
+PoolKey = Tuple[str, Tuple[Tuple[str, str], ...]]
+
+_pools: Dict[PoolKey, ConnectionPool] = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(alias: str, settings_dict: dict, conn_params: dict) -> ConnectionPool:
+    """
+    The pool of the `alias` database in this process for `conn_params`,
+    connections of a database are never handed out for another one, as for
+    the test database. Workers forked after it was created get their own.
+    """
+    key = (alias, tuple(sorted((name, repr(value)) for name, value in conn_params.items())))
+    pool = _pools.get(key)
+    if pool is not None and pool.pid == os.getpid():
+        return pool
+
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None or pool.pid != os.getpid():
+            options = settings_dict.get('POOL', {})
+            pool = _pools[key] = ConnectionPool(
+                max_size=options.get('MAX_SIZE', 10),
+                max_overflow=options.get('MAX_OVERFLOW', 10),
+                timeout=options.get('TIMEOUT', 5),
+                check_interval=options.get('CHECK_INTERVAL', 30),
+            )
+        return pool
+
+
+def close_pools(alias: str) -> None:
+    with _pools_lock:
+        pools = [_pools.pop(key) for key in list(_pools) if key[0] == alias]
+    for pool in pools:
+        if pool.pid == os.getpid():
+            pool.close()
+
+
+def get_pool_stats() -> Dict[str, Dict[str, float]]:
+    """
+    The stats of the pools of this process summed by database alias.
+    """
+    with _pools_lock:
+        pools = list(_pools.items())
+
+    stats: Dict[str, Dict[str, float]] = {}
+    for (alias, _), pool in pools:
+        if pool.pid != os.getpid():
+            continue
+        if alias in stats:
+            for name, value in pool.stats().items():
+                stats[alias][name] += value
+        else:
+            stats[alias] = pool.stats()
+    return stats
+
+
+def render_pool_metrics(stats: Optional[Dict[str, Dict[str, float]]] = None) -> str:
+    """
+    The state and counters of the pools in the Prometheus text format, the
+    pools of this process unless `stats` are given.
+    """
+    if stats is None:
+        stats = get_pool_stats()
+    lines = []
+    for name, help_text, metric_type, keys in (
+        ('db_pool_connections', 'Open pooled connections by state.', 'gauge', ('idle', 'in_use')),
+        ('db_pool_waiting', 'Checkouts waiting for a connection.', 'gauge', ('waiting', )),
+        ('db_pool_checkouts_total', 'Connections taken from the pool.', 'counter', ('checkouts', )),
+        ('db_pool_waits_total', 'Checkouts that waited for a connection.', 'counter', ('waits', )),
+        ('db_pool_wait_seconds_total', 'Time spent waiting for a connection.', 'counter', ('wait_seconds', )),
+        ('db_pool_timeouts_total', 'Checkouts that gave up waiting.', 'counter', ('timeouts', )),
+        ('db_pool_opened_total', 'Connections opened.', 'counter', ('opened', )),
+        ('db_pool_closed_total', 'Connections closed.', 'counter', ('closed', )),
+        ('db_pool_failed_checks_total', 'Idle connections found broken.', 'counter', ('failed_checks', )),
+    ):
+        lines += [f'# HELP {name} {help_text}', f'# TYPE {name} {metric_type}']
+        for alias, values in sorted(stats.items()):
+            for key in keys:
+                labels = f'alias="{alias}",state="{key}"' if len(keys) > 1 else f'alias="{alias}"'
+                lines.append(f'{name}{{{labels}}} {values[key]:g}')
+
+    return '\n'.join(lines) + '\n'
+
+
+class DatabaseCreation(creation.DatabaseCreation):
+    def _destroy_test_db(self, test_database_name, verbosity):
+        # pooled connections to the test database would block dropping it
+        close_pools(self.connection.alias)
+        super()._destroy_test_db(test_database_name, verbosity)
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    """
+    The PostgreSQL backend with connections taken from and returned to a
+    `ConnectionPool` instead of being opened and closed, configured by the
+    `POOL` dict of the database settings. With `CONN_MAX_AGE = 0` a request
+    holds a connection only while it runs.
+
+    Only the end of a request returns the connection to the pool, closing it
+    otherwise, as in management commands and the test runner, disconnects.
+    """
+
+    creation_class = DatabaseCreation
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._pool = None
+        self._release_to_pool = False
+
+    def get_connection_params(self):
+        conn_params = super().get_connection_params()
+        if self.timezone_name:
+            # the session default, `DISCARD ALL` on release resets to it
+            conn_params['options'] = f"{conn_params.get('options', '')} -c TimeZone={self.timezone_name}".strip()
+        return conn_params
+
+    def get_new_connection(self, conn_params):
+        self._pool = get_pool(self.alias, self.settings_dict, conn_params)
+        connection = self._pool.getconn(partial(super().get_new_connection, conn_params))
+        # `get_new_connection()` only sets it when a connection is opened
+        self.isolation_level = IsolationLevel(
+            self.settings_dict['OPTIONS'].get('isolation_level', IsolationLevel.READ_COMMITTED)
+        )
+        return connection
+
+    def close_if_unusable_or_obsolete(self):
+        # called by django at the start and end of each request
+        self._release_to_pool = True
+        try:
+            super().close_if_unusable_or_obsolete()
+        finally:
+            self._release_to_pool = False
+
+    def _close(self):
+        if self.connection is None:
+            return
+
+        # a connection closed inside a transaction is still referenced by this
+        # wrapper until the transaction ends
+        discard = (
+            not self._release_to_pool
+            or self.errors_occurred
+            or self.in_atomic_block
+            or self.autocommit != self.settings_dict['AUTOCOMMIT']
+        )
+        self._pool.putconn(self.connection, discard=discard)
@@ -0,0 +1,102 @@
+import csv
+import io
+import json
+from itertools import islice
+from typing import AsyncIterator, Iterable, Iterator, List, Literal
+
+from django.conf import settings
+from django.db.models import QuerySet
+from django.http import StreamingHttpResponse
+
+from .models import Product
+from .schemas import ProductRespSchema
+
+
+ExportFormat = Literal['ndjson', 'csv']
+
+CSV_FIELDS = ('id', 'title', 'price', 'description', 'created_at', 'updated_at', 'images')
+
+CONTENT_TYPES = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv; charset=utf-8',
+}
+
+
+def _iter_chunks(queryset: QuerySet) -> Iterator[List[Product]]:
+    # `iterator()` reads through a server-side cursor on PostgreSQL, so only
+    # one chunk of products is held in memory at a time
+    products = queryset.iterator(chunk_size=settings.PRODUCT_EXPORT_CHUNK_SIZE)
+    while chunk := list(islice(products, settings.PRODUCT_EXPORT_CHUNK_SIZE)):
+        yield Product.prefetch_images(chunk)
+
+
+async def _aiter_chunks(queryset: QuerySet) -> AsyncIterator[List[Product]]:
+    chunk = []
+    async for product in queryset.aiterator(chunk_size=settings.PRODUCT_EXPORT_CHUNK_SIZE):
+        chunk.append(product)
+        if len(chunk) == settings.PRODUCT_EXPORT_CHUNK_SIZE:
+            yield await Product.aprefetch_images(chunk)
+            chunk = []
+
+    if chunk:
+        yield await Product.aprefetch_images(chunk)
+
+
+def _render_chunk(products: Iterable[Product], export_format: ExportFormat) -> str:
+    items = [ProductRespSchema.from_orm(product).model_dump(mode='json') for product in products]
+    if export_format == 'ndjson':
+        return ''.join(json.dumps(item, ensure_ascii=False) + '\n' for item in items)
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for item in items:
+        item['images'] = ' '.join(image['image'] for image in item['images'])
+        writer.writerow([item[field] for field in CSV_FIELDS])
+    return buffer.getvalue()
+
+
+def _render_header(export_format: ExportFormat) -> str:
+    if export_format == 'ndjson':
+        return ''
+
+    buffer = io.StringIO()
+    csv.writer(buffer).writerow(CSV_FIELDS)
+    return buffer.getvalue()
+
+
+def _stream(queryset: QuerySet, export_format: ExportFormat) -> Iterator[str]:
+    yield _render_header(export_format)
+    for chunk in _iter_chunks(queryset):
+        yield _render_chunk(chunk, export_format)
+
+
+async def _astream(queryset: QuerySet, export_format: ExportFormat) -> AsyncIterator[str]:
+    yield _render_header(export_format)
+    async for chunk in _aiter_chunks(queryset):
+        yield _render_chunk(chunk, export_format)
+
+
+def _make_response(content, export_format: ExportFormat) -> StreamingHttpResponse:
+    response = StreamingHttpResponse(content, content_type=CONTENT_TYPES[export_format])
+    response['Content-Disposition'] = f'attachment; filename="products.{export_format}"'
+    # let nginx pass the chunks on as they are produced
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+def export_products(queryset: QuerySet, export_format: ExportFormat) -> StreamingHttpResponse:
+    """
+    Streams every product of `queryset` with its images as NDJSON, a product
+    per line, or CSV. Products are read and serialized a chunk of
+    `PRODUCT_EXPORT_CHUNK_SIZE` at a time, with a query for the images of
+    each chunk, so memory does not grow with the size of the catalog.
+    """
+    return _make_response(_stream(queryset, export_format), export_format)
+
+
+def aexport_products(queryset: QuerySet, export_format: ExportFormat) -> StreamingHttpResponse:
+    """
+    Async variant of `export_products`, ASGI servers would otherwise read a
+    synchronous stream whole before sending it.
+    """
+    return _make_response(_astream(queryset, export_format), export_format)
@@ -0,0 +1,52 @@
+import os
+import time
+from typing import Iterator, Set
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import transaction
+
+from .models import FileDeletion, Image, ImageBlob
+
+
+def delete_queued_files(batch_size: int = 500) -> int:
+    """
+    Removes a batch of queued files from the storage and returns how many
+    were claimed.
+    """
+    with transaction.atomic():
+        deletions = list(
+            FileDeletion.objects.select_for_update(skip_locked=True).order_by('id')[:batch_size]
+        )
+        for deletion in deletions:
+            default_storage.delete(deletion.name)
+
+        FileDeletion.objects.filter(id__in=[deletion.id for deletion in deletions]).delete()
+
+    return len(deletions)
+
+
+def get_referenced_file_names() -> Set[str]:
+    names = set(FileDeletion.objects.values_list('name', flat=True))
+    names.update(ImageBlob.objects.values_list('name', flat=True))
+    for image_names in Image.objects.values_list('image', 'thumbnail', 'webp').iterator(chunk_size=2000):
+        names.update(name for name in image_names if name)
+
+    return names
+
+
+def find_orphan_files(min_age_seconds: int) -> Iterator[str]:
+    """
+    Yields the names of files under `MEDIA_ROOT/images/` that no image refers
+    to. Files younger than `min_age_seconds` are skipped, they may belong to an
+    upload that is not committed yet.
+    """
+    referenced_names = get_referenced_file_names()
+    images_root = os.path.join(settings.MEDIA_ROOT, 'images')
+    max_mtime = time.time() - min_age_seconds
+    for directory, _, file_names in os.walk(images_root):
+        for file_name in file_names:
+            path = os.path.join(directory, file_name)
+            name = os.path.relpath(path, settings.MEDIA_ROOT).replace(os.sep, '/')
+            if name not in referenced_names and os.path.getmtime(path) < max_mtime:
+                yield name
@@ -0,0 +1,114 @@
+import logging
+import os
+from concurrent.futures import Executor
+from datetime import timedelta
+from typing import Dict, List, Optional
+
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
+from django.utils import timezone
+from PIL import Image as PILImage, ImageOps
+
+from .caching import bump_product_list_version
+from .models import Image, Product
+from .utils import get_image_variant_names
+
+
+logger = logging.getLogger(__name__)
+
+
+def build_image_variants(source_name: str) -> Dict[str, str]:
+    """
+    Writes the thumbnail and webp variants of an image next to it and returns
+    their names relative to MEDIA_ROOT. Runs in worker processes, so it only
+    touches the filesystem.
+    """
+    variants = get_image_variant_names(source_name)
+
+    with PILImage.open(os.path.join(settings.MEDIA_ROOT, source_name)) as source:
+        image = ImageOps.exif_transpose(source)
+        if image.mode not in ('RGB', 'RGBA'):
+            image = image.convert('RGBA' if 'A' in image.getbands() else 'RGB')
+
+        image.save(
+            os.path.join(settings.MEDIA_ROOT, variants['webp']),
+            format='WEBP',
+            quality=settings.IMAGE_WEBP_QUALITY
+        )
+        image.thumbnail(settings.IMAGE_THUMBNAIL_SIZE)
+        image.save(
+            os.path.join(settings.MEDIA_ROOT, variants['thumbnail']),
+            format='WEBP',
+            quality=settings.IMAGE_WEBP_QUALITY
+        )
+
+    return variants
+
+
+def claim_pending_images(batch_size: int) -> List[Image]:
+    """
+    Claims up to `batch_size` pending images, and the images claimed more
+    than `IMAGE_PROCESSING_TIMEOUT` seconds ago by a worker that died or was
+    stopped before finishing them.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        images = list(
+            Image.objects.select_for_update(skip_locked=True)
+            .filter(
+                variants_status=Image.VariantsStatus.PROCESSING,
+                claimed_at__lt=now - timedelta(seconds=settings.IMAGE_PROCESSING_TIMEOUT)
+            )
+            .order_by('claimed_at')[:batch_size]
+        )
+        if len(images) < batch_size:
+            images += (
+                Image.objects.select_for_update(skip_locked=True)
+                .filter(variants_status=Image.VariantsStatus.PENDING)
+                .order_by('id')[:batch_size - len(images)]
+            )
+        Image.objects.filter(id__in=[image.id for image in images]).update(
+            variants_status=Image.VariantsStatus.PROCESSING,
+            claimed_at=now
+        )
+
+    return images
+
+
+def process_pending_images(batch_size: int = 50, executor: Optional[Executor] = None) -> int:
+    """
+    Builds the variants of a batch of pending images, in the executor when one
+    is given, and returns the number of claimed images.
+    """
+    images = claim_pending_images(batch_size)
+    map_func = executor.map if executor else map
+    results = map_func(_build_image_variants_safely, [image.image.name for image in images])
+
+    for image, variants in zip(images, results):
+        if variants is None:
+            Image.objects.filter(id=image.id).update(variants_status=Image.VariantsStatus.FAILED)
+        else:
+            Image.objects.filter(id=image.id).update(variants_status=Image.VariantsStatus.READY, **variants)
+
+    if images:
+        # the variants are part of the product for clients, in its detail and
+        # in the cached list pages of its owner
+        content_type = ContentType.objects.get_for_model(Product)
+        products = Product.objects.filter(
+            id__in={image.object_id for image in images if image.content_type_id == content_type.id}
+        )
+        user_ids = set(products.values_list('user_id', flat=True))
+        products.update(updated_at=timezone.now())
+        for user_id in user_ids:
+            bump_product_list_version(user_id)
+
+    return len(images)
+
+
+def _build_image_variants_safely(source_name: str) -> Optional[Dict[str, str]]:
+    try:
+        return build_image_variants(source_name)
+    except Exception:  # noqa
+        logger.exception('Could not build the variants of %s', source_name)
+        return None
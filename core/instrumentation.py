@@ -0,0 +1,411 @@
+import asyncio
+import json
+import logging
+import os
+import socket
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from functools import lru_cache, wraps
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+import redis
+from django.conf import settings
+from django.http import HttpRequest, HttpResponse
+from ninja.renderers import JSONRenderer
+
+
+logger = logging.getLogger(__name__)
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+@dataclass
+class RequestMetrics:
+    db_queries: int = 0
+    db_time: float = 0
+    cache_hits: int = 0
+    cache_misses: int = 0
+    serialization_time: float = 0
+    query_budget: Optional[int] = None
+
+
+_current_metrics: ContextVar[Optional[RequestMetrics]] = ContextVar('request_metrics', default=None)
+
+
+@contextmanager
+def collect_request_metrics() -> Iterator[RequestMetrics]:
+    """
+    Collects the metrics of everything that runs in this context, sync views
+    and async ORM calls run in a copy of it and share the same object.
+    """
+    metrics = RequestMetrics()
+    token = _current_metrics.set(metrics)
+    try:
+        yield metrics
+    finally:
+        _current_metrics.reset(token)
+
+
+def record_query(execute, sql, params, many, context):
+    if (metrics := _current_metrics.get()) is None:
+        return execute(sql, params, many, context)
+
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        metrics.db_queries += 1
+        metrics.db_time += time.perf_counter() - start
+
+
+def install_query_recorder(sender, connection, **kwargs) -> None:
+    """
+    `connection_created` receiver, the wrapper stays on the connection wrapper
+    across reconnects so it is only added once.
+    """
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+def record_cache_access(hit: bool) -> None:
+    if metrics := _current_metrics.get():
+        if hit:
+            metrics.cache_hits += 1
+        else:
+            metrics.cache_misses += 1
+
+
+@contextmanager
+def measure_serialization() -> Iterator[None]:
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        if metrics := _current_metrics.get():
+            metrics.serialization_time += time.perf_counter() - start
+
+
+def query_budget(max_queries: int) -> Callable:
+    """
+    Declares the most queries a request to the decorated view may run, auth,
+    serialization and the first `ContentType` lookup of the process included.
+    Over budget requests raise `QueryBudgetExceeded` with
+    `QUERY_BUDGET_STRICT`, as in the tests, and are logged and counted
+    otherwise.
+    """
+
+    def decorator(view_func: Callable) -> Callable:
+        if asyncio.iscoroutinefunction(view_func):
+            @wraps(view_func)
+            async def async_wrapper(request: HttpRequest, *args, **kwargs):
+                if metrics := _current_metrics.get():
+                    metrics.query_budget = max_queries
+                return await view_func(request, *args, **kwargs)
+
+            return async_wrapper
+
+        @wraps(view_func)
+        def wrapper(request: HttpRequest, *args, **kwargs):
+            if metrics := _current_metrics.get():
+                metrics.query_budget = max_queries
+            return view_func(request, *args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+class InstrumentedJSONRenderer(JSONRenderer):
+    def render(self, request: HttpRequest, data, *, response_status: int):
+        with measure_serialization():
+            return super().render(request, data, response_status=response_status)
+
+
+class MetricsRegistry:
+    """
+    Aggregates of the request metrics by method, route and status, rendered
+    in the Prometheus text format. The registry of a process only holds what
+    was observed since its last flush to the metrics store.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._requests: Dict[Tuple[str, str, str], int] = defaultdict(int)
+        # one counter per bucket bound, the last one is +Inf
+        self._buckets: Dict[Tuple[str, str], List[int]] = defaultdict(lambda: [0] * (len(DURATION_BUCKETS) + 1))
+        self._sums: Dict[Tuple[str, str, str], float] = defaultdict(float)
+
+    def observe(self, method: str, route: str, status: int, duration: float, metrics: RequestMetrics) -> None:
+        labels = (method, route)
+        with self._lock:
+            self._requests[(method, route, str(status))] += 1
+            for i, bound in enumerate(DURATION_BUCKETS + (float('inf'), )):
+                if duration <= bound:
+                    self._buckets[labels][i] += 1
+            for name, value in (
+                ('duration_seconds', duration),
+                ('db_queries', metrics.db_queries),
+                ('db_duration_seconds', metrics.db_time),
+                ('cache_hits', metrics.cache_hits),
+                ('cache_misses', metrics.cache_misses),
+                ('serialization_seconds', metrics.serialization_time),
+            ):
+                self._sums[(name, method, route)] += value
+            if metrics.query_budget is not None and metrics.db_queries > metrics.query_budget:
+                self._sums[('query_budget_exceeded', method, route)] += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._requests.clear()
+            self._buckets.clear()
+            self._sums.clear()
+
+    def take(self) -> Dict[str, float]:
+        """
+        Empties the registry and returns its values as flat fields.
+        """
+        with self._lock:
+            values = {_field('requests', *labels): count for labels, count in self._requests.items()}
+            for labels, buckets in self._buckets.items():
+                values.update((_field('bucket', *labels, i), count) for i, count in enumerate(buckets) if count)
+            values.update((_field('sum', *labels), value) for labels, value in self._sums.items())
+            self._requests.clear()
+            self._buckets.clear()
+            self._sums.clear()
+        return values
+
+    def merge(self, values: Dict[str, float]) -> None:
+        """
+        Adds values in the format of `take()`.
+        """
+        with self._lock:
+            for field, value in values.items():
+                kind, *labels = json.loads(field)
+                if kind == 'requests':
+                    self._requests[tuple(labels)] += int(value)
+                elif kind == 'bucket':
+                    self._buckets[tuple(labels[:2])][labels[2]] += int(value)
+                else:
+                    self._sums[tuple(labels)] += value
+
+    def render(self) -> str:
+        with self._lock:
+            lines = [
+                '# HELP http_requests_total Requests by method, route and status.',
+                '# TYPE http_requests_total counter',
+            ]
+            for (method, route, status), count in sorted(self._requests.items()):
+                lines.append(f'http_requests_total{{{_labels(method, route)},status="{status}"}} {count}')
+
+            lines += [
+                '# HELP http_request_duration_seconds Request duration.',
+                '# TYPE http_request_duration_seconds histogram',
+            ]
+            for (method, route), buckets in sorted(self._buckets.items()):
+                labels = _labels(method, route)
+                for bound, value in zip(DURATION_BUCKETS + ('+Inf', ), buckets):
+                    lines.append(f'http_request_duration_seconds_bucket{{{labels},le="{bound}"}} {value}')
+                lines.append(
+                    f'http_request_duration_seconds_sum{{{labels}}} '
+                    f'{_format_value(self._sums[("duration_seconds", method, route)])}'
+                )
+                lines.append(f'http_request_duration_seconds_count{{{labels}}} {buckets[-1]}')
+
+            for name, help_text in (
+                ('db_queries', 'SQL queries run by requests.'),
+                ('db_duration_seconds', 'Time spent in SQL queries.'),
+                ('cache_hits', 'Cache hits of requests.'),
+                ('cache_misses', 'Cache misses of requests.'),
+                ('serialization_seconds', 'Time spent rendering responses.'),
+                ('query_budget_exceeded', 'Requests that ran more queries than their route budget.'),
+            ):
+                lines += [
+                    f'# HELP http_request_{name}_total {help_text}',
+                    f'# TYPE http_request_{name}_total counter',
+                ]
+                for (sum_name, method, route), value in sorted(self._sums.items()):
+                    if sum_name == name:
+                        lines.append(f'http_request_{name}_total{{{_labels(method, route)}}} {_format_value(value)}')
+
+        return '\n'.join(lines) + '\n'
+
+
+def _field(*parts) -> str:
+    return json.dumps(parts, separators=(',', ':'))
+
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(value)
+
+
+def _labels(method: str, route: str) -> str:
+    route = route.replace('\\', '\\\\').replace('"', '\\"')
+    return f'method="{method}",route="{route}"'
+
+
+registry = MetricsRegistry()
+
+
+class LocalMetricsStore:
+    """
+    Keeps the totals in this process, used by the tests and single process
+    setups.
+    """
+
+    def __init__(self):
+        self.totals = MetricsRegistry()
+
+    def add(self, values: Dict[str, float], pool_stats: Dict[str, Dict[str, float]]) -> None:
+        self.totals.merge(values)
+
+    def render(self) -> str:
+        from .db_backends.postgresql_pool.base import render_pool_metrics
+
+        return self.totals.render() + render_pool_metrics()
+
+    def clear(self) -> None:
+        self.totals.clear()
+
+
+class RedisMetricsStore:
+    """
+    Adds up the request metrics of every worker in a Redis hash, each flush
+    costs one pipelined round trip. The connection pools report their
+    current stats per worker, the ones not reported within three flush
+    intervals are of stopped workers and left out.
+    """
+
+    REQUESTS_KEY = 'metrics:requests'
+    POOLS_KEY = 'metrics:pools'
+
+    def __init__(self, url: str):
+        self.client = redis.Redis.from_url(url)
+
+    def add(self, values: Dict[str, float], pool_stats: Dict[str, Dict[str, float]]) -> None:
+        with self.client.pipeline(transaction=False) as pipeline:
+            for field, value in values.items():
+                pipeline.hincrbyfloat(self.REQUESTS_KEY, field, value)
+            pipeline.hset(
+                self.POOLS_KEY,
+                f'{socket.gethostname()}:{os.getpid()}',
+                json.dumps({'reported_at': time.time(), 'stats': pool_stats})
+            )
+            pipeline.execute()
+
+    def render(self) -> str:
+        from .db_backends.postgresql_pool.base import render_pool_metrics
+
+        totals = MetricsRegistry()
+        totals.merge({field.decode(): float(value) for field, value in self.client.hgetall(self.REQUESTS_KEY).items()})
+
+        pool_stats: Dict[str, Dict[str, float]] = {}
+        stopped = []
+        for worker, report in self.client.hgetall(self.POOLS_KEY).items():
+            report = json.loads(report)
+            if report['reported_at'] < time.time() - 3 * settings.METRICS_FLUSH_INTERVAL:
+                stopped.append(worker)
+                continue
+            for alias, stats in report['stats'].items():
+                totals_of_alias = pool_stats.setdefault(alias, dict.fromkeys(stats, 0))
+                for name, value in stats.items():
+                    totals_of_alias[name] += value
+        if stopped:
+            self.client.hdel(self.POOLS_KEY, *stopped)
+
+        return totals.render() + render_pool_metrics(pool_stats)
+
+    def clear(self) -> None:
+        self.client.delete(self.REQUESTS_KEY, self.POOLS_KEY)
+
+
+@lru_cache
+def _get_metrics_store(backend: str, redis_url: str):
+    if backend == 'local':
+        return LocalMetricsStore()
+    return RedisMetricsStore(redis_url)
+
+
+def get_metrics_store():
+    return _get_metrics_store(settings.METRICS_BACKEND, settings.METRICS_REDIS_URL)
+
+
+def flush_metrics() -> None:
+    """
+    Moves the metrics observed by this process to the metrics store.
+    """
+    from .db_backends.postgresql_pool.base import get_pool_stats
+
+    values = registry.take()
+    try:
+        get_metrics_store().add(values, get_pool_stats())
+    except redis.RedisError:
+        # kept for the next flush
+        registry.merge(values)
+        logger.warning('Could not flush the request metrics', exc_info=True)
+
+
+_flusher_pid: Optional[int] = None
+_flusher_lock = threading.Lock()
+
+
+def _flush_periodically() -> None:
+    while True:
+        time.sleep(settings.METRICS_FLUSH_INTERVAL)
+        flush_metrics()
+
+
+def start_metrics_flusher() -> None:
+    """
+    Starts the thread that flushes the metrics of this process every
+    `METRICS_FLUSH_INTERVAL` seconds, once per process. With the local store
+    they are only flushed when rendered.
+    """
+    global _flusher_pid
+
+    if _flusher_pid == os.getpid() or settings.METRICS_BACKEND == 'local':
+        return
+    with _flusher_lock:
+        if _flusher_pid != os.getpid():
+            threading.Thread(target=_flush_periodically, daemon=True).start()
+            _flusher_pid = os.getpid()
+
+
+def get_route(request: HttpRequest) -> str:
+    if (resolver_match := getattr(request, 'resolver_match', None)) is None:
+        return 'unmatched'
+    return '/' + resolver_match.route
+
+
+def server_timing(metrics: RequestMetrics, duration: float) -> str:
+    return ', '.join((
+        f'db;dur={metrics.db_time * 1000:.2f};desc="{metrics.db_queries} queries"',
+        f'cache;desc="{metrics.cache_hits} hits {metrics.cache_misses} misses"',
+        f'serialize;dur={metrics.serialization_time * 1000:.2f}',
+        f'total;dur={duration * 1000:.2f}',
+    ))
+
+
+def finish_request(request: HttpRequest, response: HttpResponse, metrics: RequestMetrics, duration: float) -> None:
+    route = get_route(request)
+    registry.observe(request.method, route, response.status_code, duration, metrics)
+    start_metrics_flusher()
+
+    if settings.SERVER_TIMING_HEADER:
+        response['Server-Timing'] = server_timing(metrics, duration)
+
+    if metrics.query_budget is not None and metrics.db_queries > metrics.query_budget:
+        message = (
+            f'{request.method} {route} ran {metrics.db_queries} queries, '
+            f'its budget is {metrics.query_budget}'
+        )
+        if settings.QUERY_BUDGET_STRICT:
+            raise QueryBudgetExceeded(message)
+        logger.warning(message)
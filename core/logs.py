@@ -0,0 +1,231 @@
+import copy
+import fcntl
+import json
+import logging
+import os
+import queue
+import random
+import socket
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler, TimedRotatingFileHandler
+from pathlib import Path
+from typing import Iterator, Optional
+
+
+_current_request_id: ContextVar[Optional[str]] = ContextVar('request_id', default=None)
+
+# attributes of every `LogRecord`, the others were passed in `extra`
+RECORD_ATTRIBUTES = frozenset(vars(logging.makeLogRecord({}))) | {'message', 'asctime', 'taskName'}
+
+
+@contextmanager
+def request_id_context(request_id: Optional[str] = None) -> Iterator[str]:
+    """
+    Tags the records logged in this context with `request_id`, a new one
+    when none is given.
+    """
+    request_id = request_id or uuid.uuid4().hex
+    token = _current_request_id.set(request_id)
+    try:
+        yield request_id
+    finally:
+        _current_request_id.reset(token)
+
+
+class RequestIdFilter(logging.Filter):
+    def filter(self, record: logging.LogRecord) -> bool:
+        if not hasattr(record, 'request_id') and (request_id := _current_request_id.get()) is not None:
+            record.request_id = request_id
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Passes a `rate` fraction of the records below `WARNING`, and every
+    record at or above it.
+    """
+
+    def __init__(self, rate: float = 1.0, name: str = ''):
+        super().__init__(name)
+        self.rate = rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        return record.levelno >= logging.WARNING or random.random() < self.rate
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    A JSON object per line with the time, level, logger, message, the
+    `extra` fields of the record and the formatted exception if any.
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        entry.update(
+            (key, value) for key, value in vars(record).items()
+            if key not in RECORD_ATTRIBUTES and not key.startswith('_')
+        )
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry['exception'] = record.exc_text
+        if record.stack_info:
+            entry['stack'] = self.formatStack(record.stack_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class _Listener(QueueListener):
+    def enqueue_sentinel(self) -> None:
+        # waits for room instead of failing when the queue is full
+        self.queue.put(self._sentinel)
+
+
+class QueuedFileHandler(QueueHandler):
+    """
+    Hands records over to a background thread that formats them and writes
+    them to `filename`, rotated at `max_bytes` or else on the `when`
+    interval, so logging calls never wait on the disk. Records logged while
+    `queue_size` records are pending are dropped and counted, and a warning
+    with the count is written once the queue has room again.
+
+    Each process writes and rotates its own files, `filename` with the host
+    name and pid before the suffix, rotating a file other processes write to
+    would move or delete their lines. A process holds a lock on a `.lock`
+    file next to them while it writes. The files of the processes that
+    stopped are kept like rotated ones, the newest `backup_count` of them,
+    and the others removed when a process starts writing.
+    """
+
+    def __init__(
+        self,
+        filename: str,
+        max_bytes: int = 0,
+        backup_count: int = 0,
+        when: Optional[str] = None,
+        queue_size: int = 10000,
+    ):
+        self.filename = Path(filename)
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.when = when
+        self.queue_size = queue_size
+        self.dropped = 0
+        self.target = None
+        self.listener = None
+        self.lock_file = None
+        super().__init__(queue.Queue(queue_size))
+        self._start()
+
+    def _start(self) -> None:
+        self.pid = os.getpid()
+        name = f'{self.filename.stem}.{socket.gethostname()}.{self.pid}'
+        filename = self.filename.with_name(f'{name}{self.filename.suffix}')
+        self.filename.parent.mkdir(parents=True, exist_ok=True)
+        if self.lock_file is not None:
+            # the parent's, closing it in the child keeps the parent's lock
+            self.lock_file.close()
+        self.lock_file = open(self.filename.with_name(f'{name}.lock'), 'w')
+        try:
+            fcntl.flock(self.lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            # held by another handler of this process for the same file
+            pass
+        self._prune()
+
+        if self.when:
+            target = TimedRotatingFileHandler(filename, when=self.when, backupCount=self.backup_count, delay=True)
+        else:
+            target = RotatingFileHandler(filename, maxBytes=self.max_bytes, backupCount=self.backup_count, delay=True)
+        if self.target is not None:
+            target.setFormatter(self.target.formatter)
+            self.target.close()
+        self.target = target
+        self.listener = _Listener(self.queue, self.target, respect_handler_level=False)
+        self.listener.start()
+
+    def _prune(self) -> None:
+        stem, suffix = self.filename.stem, self.filename.suffix
+        running = set()
+        for lock_path in self.filename.parent.glob(f'{stem}.*.lock'):
+            try:
+                with open(lock_path, 'a') as lock_file:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    lock_path.unlink()
+            except OSError:
+                # held by a running process
+                running.add(lock_path.stem)
+
+        stopped = [
+            path for path in self.filename.parent.glob(f'{stem}.*{suffix}*')
+            if suffix in path.name[len(stem) + 1:]
+            and path.name[:path.name.index(suffix, len(stem) + 1)] not in running
+            and path.suffix != '.lock'
+        ]
+        stopped.sort(key=_get_mtime, reverse=True)
+        for path in stopped[self.backup_count:]:
+            path.unlink(missing_ok=True)
+
+    def setFormatter(self, fmt: Optional[logging.Formatter]) -> None:
+        # records are formatted by the listener thread
+        self.target.setFormatter(fmt)
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # the arguments are resolved here as they may change after the call,
+        # the rest of the formatting is left to the listener thread
+        record = copy.copy(record)
+        record.msg, record.args = record.getMessage(), None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        if self.pid != os.getpid():
+            # forked, the listener thread was not copied and the file is
+            # the parent's
+            self.queue = queue.Queue(self.queue_size)
+            self._start()
+
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+            return
+
+        if self.dropped:
+            dropped, self.dropped = self.dropped, 0
+            warning = logging.makeLogRecord({
+                'name': __name__,
+                'levelno': logging.WARNING,
+                'levelname': 'WARNING',
+                'msg': f'Dropped {dropped} log records, the queue was full',
+            })
+            try:
+                self.queue.put_nowait(warning)
+            except queue.Full:
+                self.dropped += dropped
+
+    def flush(self) -> None:
+        self.target.flush()
+
+    def close(self) -> None:
+        # called by `logging.shutdown()` at exit too
+        if self.listener is not None and self.pid == os.getpid():
+            # writes the pending records before returning
+            self.listener.stop()
+            self.listener = None
+            self.target.close()
+            self.lock_file.close()
+        super().close()
+
+
+def _get_mtime(path: Path) -> float:
+    try:
+        return path.stat().st_mtime
+    except OSError:
+        return 0.0
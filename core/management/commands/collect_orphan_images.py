@@ -0,0 +1,28 @@
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+
+from core.files import find_orphan_files
+
+
+class Command(BaseCommand):
+    help = 'Removes files under MEDIA_ROOT/images/ that no Image row refers to.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--min-age',
+            type=int,
+            default=3600,
+            help='Only files older than this many seconds are removed.'
+        )
+        parser.add_argument('--dry-run', action='store_true')
+
+    def handle(self, *args, **options):
+        count = 0
+        for name in find_orphan_files(options['min_age']):
+            if not options['dry_run']:
+                default_storage.delete(name)
+            self.stdout.write(name)
+            count += 1
+
+        action = 'Found' if options['dry_run'] else 'Removed'
+        self.stdout.write(f'{action} {count} orphan files')
@@ -0,0 +1,24 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from core.sync import compact_tombstones
+
+
+class Command(BaseCommand):
+    help = 'Removes the tombstones of deleted products and images older than the sync retention.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--poll-interval', type=float, default=3600.0)
+        parser.add_argument('--once', action='store_true', help='Remove the expired tombstones and exit.')
+
+    def handle(self, *args, **options):
+        while True:
+            deleted = compact_tombstones(options['batch_size'])
+            if deleted:
+                self.stdout.write(f'Deleted {deleted} tombstones')
+            elif options['once']:
+                return
+            else:
+                time.sleep(options['poll_interval'])
@@ -0,0 +1,24 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from core.files import delete_queued_files
+
+
+class Command(BaseCommand):
+    help = 'Removes queued media files from the storage in batches.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--poll-interval', type=float, default=5.0)
+        parser.add_argument('--once', action='store_true', help='Remove the queued files and exit.')
+
+    def handle(self, *args, **options):
+        while True:
+            deleted = delete_queued_files(options['batch_size'])
+            if deleted:
+                self.stdout.write(f'Deleted {deleted} files')
+            elif options['once']:
+                return
+            else:
+                time.sleep(options['poll_interval'])
@@ -0,0 +1,27 @@
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from django.core.management.base import BaseCommand
+
+from core.images import process_pending_images
+
+
+class Command(BaseCommand):
+    help = 'Builds the thumbnail and webp variants of uploaded images in a process pool.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=2)
+        parser.add_argument('--batch-size', type=int, default=50)
+        parser.add_argument('--poll-interval', type=float, default=1.0)
+        parser.add_argument('--once', action='store_true', help='Process the pending images and exit.')
+
+    def handle(self, *args, **options):
+        with ProcessPoolExecutor(max_workers=options['workers']) as executor:
+            while True:
+                processed = process_pending_images(options['batch_size'], executor)
+                if processed:
+                    self.stdout.write(f'Processed {processed} images')
+                elif options['once']:
+                    return
+                else:
+                    time.sleep(options['poll_interval'])
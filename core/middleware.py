@@ -0,0 +1,208 @@
+import logging
+import re
+import time
+from typing import Optional
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.http import HttpRequest, HttpResponse
+from django.utils.functional import empty
+from django.utils.deprecation import MiddlewareMixin
+
+from .instrumentation import collect_request_metrics, finish_request, get_route
+from .logs import request_id_context
+from .models import Product
+from .routers import apin_to_primary, pin_to_primary, route_request_reads, route_streamed_reads
+from .uploadhandlers import StreamingImageUploadHandler
+
+
+access_logger = logging.getLogger('core.access')
+
+REQUEST_ID_PATTERN = re.compile(r'[\w.-]{1,128}')
+
+
+class ImageUploadHandlerMiddleware(MiddlewareMixin):
+    """
+    Installs `StreamingImageUploadHandler` on the image upload endpoints before
+    the view parses the multipart body. The streamed files are removed when
+    the request fails, also when ninja rejects it before the view runs.
+    """
+
+    IMAGE_UPLOAD_VIEWS = {
+        'upload_images_for_product': (Product, 'product_id', 'images'),
+    }
+
+    def process_view(self, request: HttpRequest, view_func, view_args, view_kwargs):
+        if request.method != 'POST' or request.resolver_match is None:
+            return None
+
+        if upload_view := self.IMAGE_UPLOAD_VIEWS.get(request.resolver_match.url_name):
+            model_cls, object_id_kwarg, field_name = upload_view
+            request.image_upload_handler = StreamingImageUploadHandler(
+                request, model_cls, view_kwargs[object_id_kwarg], field_name
+            )
+            request.upload_handlers = [request.image_upload_handler, *request.upload_handlers]
+
+        return None
+
+    def process_response(self, request: HttpRequest, response: HttpResponse) -> HttpResponse:
+        if response.status_code >= 400 and (handler := getattr(request, 'image_upload_handler', None)):
+            handler.discard()
+        return response
+
+
+class RequestMetricsMiddleware:
+    """
+    Records the queries, cache accesses and serialization time of each
+    request, sends them back in `Server-Timing` and adds them to the
+    per process metrics registry.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request: HttpRequest):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        with collect_request_metrics() as metrics:
+            start = time.perf_counter()
+            response = self.get_response(request)
+            finish_request(request, response, metrics, time.perf_counter() - start)
+
+        return response
+
+    async def __acall__(self, request: HttpRequest):
+        with collect_request_metrics() as metrics:
+            start = time.perf_counter()
+            response = await self.get_response(request)
+            finish_request(request, response, metrics, time.perf_counter() - start)
+
+        return response
+
+
+def _get_user_id(request: HttpRequest) -> Optional[int]:
+    user = getattr(request, 'user', None)
+    return user.pk if user is not None and user.is_authenticated else None
+
+
+class ReadReplicaMiddleware:
+    """
+    Routes the reads of each request to a replica, see
+    `core.routers.PrimaryReplicaRouter`, also while a streamed response is
+    consumed. After a request that wrote, the reads of its user stick to the
+    primary for `DATABASE_PRIMARY_STICKY_SECONDS`.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request: HttpRequest):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        with route_request_reads() as routing:
+            response = self.get_response(request)
+            if routing is not None and routing.wrote:
+                pin_to_primary(_get_user_id(request))
+
+        if routing is not None and response.streaming:
+            route_streamed_reads(response, routing)
+
+        return response
+
+    async def __acall__(self, request: HttpRequest):
+        with route_request_reads() as routing:
+            response = await self.get_response(request)
+            if routing is not None and routing.wrote:
+                await apin_to_primary(await sync_to_async(_get_user_id)(request))
+
+        if routing is not None and response.streaming:
+            route_streamed_reads(response, routing)
+
+        return response
+
+
+def _get_loaded_user_id(request: HttpRequest) -> Optional[int]:
+    # the lazy session user of `AuthenticationMiddleware` is not loaded only
+    # for the log line
+    user = getattr(request, 'user', None)
+    if user is None or getattr(user, '_wrapped', None) is empty or not user.is_authenticated:
+        return None
+    return user.pk
+
+
+def log_access(request: HttpRequest, response: HttpResponse, request_id: str, duration: float) -> None:
+    if response.status_code >= 500:
+        level = logging.ERROR
+    elif response.status_code >= 400:
+        level = logging.WARNING
+    else:
+        level = logging.INFO
+
+    access_logger.log(
+        level,
+        '%s %s %s',
+        request.method,
+        request.path,
+        response.status_code,
+        extra={
+            'request_id': request_id,
+            'method': request.method,
+            'route': get_route(request),
+            'status': response.status_code,
+            'latency_ms': round(duration * 1000, 2),
+            'user_id': _get_loaded_user_id(request),
+        }
+    )
+
+
+class AccessLogMiddleware:
+    """
+    Tags everything logged during a request with its id, the `X-Request-ID`
+    header set by nginx or a new one, sends the id back and logs a line per
+    request to `core.access`.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    @staticmethod
+    def _get_request_id(request: HttpRequest) -> Optional[str]:
+        request_id = request.headers.get('X-Request-ID', '')
+        return request_id if REQUEST_ID_PATTERN.fullmatch(request_id) else None
+
+    def __call__(self, request: HttpRequest):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        with request_id_context(self._get_request_id(request)) as request_id:
+            start = time.perf_counter()
+            response = self.get_response(request)
+            log_access(request, response, request_id, time.perf_counter() - start)
+
+        response['X-Request-ID'] = request_id
+        return response
+
+    async def __acall__(self, request: HttpRequest):
+        with request_id_context(self._get_request_id(request)) as request_id:
+            start = time.perf_counter()
+            response = await self.get_response(request)
+            log_access(request, response, request_id, time.perf_counter() - start)
+
+        response['X-Request-ID'] = request_id
+        return response
@@ -0,0 +1,33 @@
+# Generated by Django 4.2 on 2026-10-18 12:10
+
+import core.utils
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0002_product_user_id_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='image',
+            name='thumbnail',
+            field=models.ImageField(blank=True, upload_to=core.utils.get_upload_image_path, verbose_name='thumbnail'),
+        ),
+        migrations.AddField(
+            model_name='image',
+            name='variants_status',
+            field=models.PositiveSmallIntegerField(choices=[(0, 'pending'), (1, 'processing'), (2, 'ready'), (3, 'failed')], default=0, verbose_name='variants status'),
+        ),
+        migrations.AddField(
+            model_name='image',
+            name='webp',
+            field=models.ImageField(blank=True, upload_to=core.utils.get_upload_image_path, verbose_name='webp'),
+        ),
+        migrations.AddIndex(
+            model_name='image',
+            index=models.Index(condition=models.Q(('variants_status', 0)), fields=['id'], name='core_image_pending_idx'),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 4.2 on 2026-10-18 12:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0004_file_deletion'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImageBlob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='created_at')),
+                ('digest', models.CharField(max_length=64, unique=True, verbose_name='digest')),
+                ('name', models.CharField(db_index=True, max_length=255, verbose_name='name')),
+                ('ref_count', models.PositiveIntegerField(default=0, verbose_name='reference count')),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+    ]
@@ -0,0 +1,64 @@
+# Generated by Django 4.2 on 2026-10-18 12:37
+
+import django.contrib.postgres.search
+from django.contrib.postgres.operations import BtreeGinExtension, TrigramExtension
+from django.db import migrations
+
+
+# The vector is maintained by the database so bulk writes and `update()` keep
+# it current too. The GIN indexes lead with `user_id` (btree_gin) since every
+# search is scoped to one user.
+SEARCH_SQL = """
+CREATE FUNCTION core_product_search_vector_update() RETURNS trigger AS $$
+BEGIN
+    NEW.search_vector :=
+        setweight(to_tsvector('simple', coalesce(NEW.title, '')), 'A') ||
+        setweight(to_tsvector('simple', coalesce(NEW.description, '')), 'B');
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER core_product_search_vector_trigger
+    BEFORE INSERT OR UPDATE OF title, description ON core_product
+    FOR EACH ROW EXECUTE FUNCTION core_product_search_vector_update();
+
+UPDATE core_product SET search_vector =
+    setweight(to_tsvector('simple', coalesce(title, '')), 'A') ||
+    setweight(to_tsvector('simple', coalesce(description, '')), 'B');
+
+CREATE INDEX core_product_search_vector_idx ON core_product USING gin (user_id, search_vector);
+CREATE INDEX core_product_title_trgm_idx ON core_product USING gin (user_id, title gin_trgm_ops);
+"""
+
+REVERSE_SEARCH_SQL = """
+DROP INDEX IF EXISTS core_product_title_trgm_idx;
+DROP INDEX IF EXISTS core_product_search_vector_idx;
+DROP TRIGGER IF EXISTS core_product_search_vector_trigger ON core_product;
+DROP FUNCTION IF EXISTS core_product_search_vector_update();
+"""
+
+
+def run_on_postgresql(sql):
+    def run(apps, schema_editor):
+        if schema_editor.connection.vendor == 'postgresql':
+            schema_editor.execute(sql)
+
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_image_blob'),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        BtreeGinExtension(),
+        migrations.AddField(
+            model_name='product',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True, verbose_name='search vector'),
+        ),
+        migrations.RunPython(run_on_postgresql(SEARCH_SQL), run_on_postgresql(REVERSE_SEARCH_SQL)),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 4.2 on 2026-10-18 13:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0008_tombstone'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='image',
+            name='claimed_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True, verbose_name='claimed at'),
+        ),
+        migrations.AddIndex(
+            model_name='image',
+            index=models.Index(condition=models.Q(('variants_status', 1)), fields=['claimed_at'], name='core_image_processing_idx'),
+        ),
+    ]
@@ -1,15 +1,30 @@
-import os.path
+import hashlib
+import os
 from abc import abstractmethod
+from collections import Counter, defaultdict
+from datetime import datetime
+from typing import Iterable, List, Optional, Sequence, Tuple
 
+from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.db import models
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVectorField, TrigramWordSimilarity
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.db import connections, models, transaction
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.contenttypes.fields import GenericForeignKey
-from django.db.models import QuerySet
+from django.db.models import Case, Count, F, Max, OuterRef, Q, QuerySet, Subquery, Sum, Value, When
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 from django.core.validators import ValidationError, MinValueValidator
 
-from .utils import get_upload_image_path
+from .utils import (
+    IMAGE_BLOB_PREFIX,
+    get_file_digest,
+    get_image_blob_path,
+    get_image_variant_names,
+    get_upload_image_path
+)
 
 
 class BaseModel(models.Model):
@@ -35,22 +50,263 @@ class BaseModelWithImage(BaseModel):
         raise NotImplementedError()
 
     @property
-    def images(self) -> QuerySet["Image"]:
+    def images(self) -> QuerySet["Image"] | List["Image"]:
+        if (prefetched_images := getattr(self, '_prefetched_images', None)) is not None:
+            return prefetched_images
+
         return Image.objects.filter(
             content_type=ContentType.objects.get_for_model(self),
             object_id=self.pk,
         )
 
+    @classmethod
+    def prefetch_images(cls, objects: Iterable["BaseModelWithImage"]) -> List["BaseModelWithImage"]:
+        """
+        Load the images of all given objects with a single query and attach them,
+        so that reading `images` afterwards does not hit the database per object.
+        """
+        objects = list(objects)
+        if not objects:
+            return objects
+
+        images_by_object_id = defaultdict(list)
+        for image in Image.objects.filter(
+            content_type=ContentType.objects.get_for_model(cls),
+            object_id__in={obj.pk for obj in objects},
+        ).order_by('id'):
+            images_by_object_id[image.object_id].append(image)
+
+        for obj in objects:
+            obj._prefetched_images = images_by_object_id[obj.pk]
+
+        return objects
+
+    @classmethod
+    async def aprefetch_images(cls, objects: Iterable["BaseModelWithImage"]) -> List["BaseModelWithImage"]:
+        """
+        Async variant of `prefetch_images`, the content type is matched through
+        a join so no synchronous content type lookup is needed.
+        """
+        objects = list(objects)
+        if not objects:
+            return objects
+
+        images_by_object_id = defaultdict(list)
+        async for image in Image.objects.filter(
+            content_type__app_label=cls._meta.app_label,
+            content_type__model=cls._meta.model_name,
+            object_id__in={obj.pk for obj in objects},
+        ).order_by('id'):
+            images_by_object_id[image.object_id].append(image)
+
+        for obj in objects:
+            obj._prefetched_images = images_by_object_id[obj.pk]
+
+        return objects
+
+    def lock_for_image_change(self) -> None:
+        """
+        Locks the object row for a change of its images, models that track
+        their modification time override it to bump it with the same query.
+        """
+        list(type(self).objects.select_for_update().filter(pk=self.pk).order_by().values_list('pk'))
+
+    def attach_images(self, files: Sequence[File]) -> List["Image"]:
+        """
+        Validate a batch of images against a single count of the existing ones,
+        taken while the object row is locked, and insert them with one query.
+        Files with a `storage_name` are already in the storage under that name.
+        """
+        content_type = ContentType.objects.get_for_model(self)
+        images = [
+            Image(content_type=content_type, object_id=self.pk, image=getattr(file, 'storage_name', file))
+            for file in files
+        ]
+        for image in images:
+            image.clean_fields(exclude=['content_type'])
+            image._validate_image_size_limit()
+
+        with transaction.atomic():
+            self.lock_for_image_change()
+            count = Image.objects.filter(content_type=content_type, object_id=self.pk).count()
+            if count + len(images) > self.MAX_IMAGE_COUNT:
+                raise ValidationError(_('Image count cannot exceed %s') % self.MAX_IMAGE_COUNT)
+
+            if settings.IMAGE_CONTENT_ADDRESSED_STORAGE:
+                for image, name in zip(images, ImageBlob.objects.acquire(files)):
+                    image.image = name
+
+            return Image.objects.bulk_create(images)
+
+
+class FileDeletion(BaseModel):
+    """
+    A media file queued for removal, the files are deleted in batches by the
+    `delete_files` command instead of inside the request.
+    """
+    name = models.CharField(_('name'), max_length=255)
+
+    @classmethod
+    def enqueue(cls, names: Iterable[str]) -> None:
+        cls.objects.bulk_create(cls(name=name) for name in names if name)
+
+
+class ImageBlobQuerySet(models.QuerySet):
+
+    def acquire(self, files: Sequence[File]) -> List[str]:
+        """
+        Returns the blob name of each file and takes a reference on it. Only
+        files whose content is not stored yet are written, under a name derived
+        from their SHA-256, the others are dropped.
+        """
+        digests = [getattr(file, 'sha256', None) or get_file_digest(file) for file in files]
+        names = dict(self.select_for_update().filter(digest__in=set(digests)).values_list('digest', 'name'))
+
+        new_blobs = {}
+        for file, digest in zip(files, digests):
+            if digest in names or digest in new_blobs:
+                if storage_name := getattr(file, 'storage_name', None):
+                    default_storage.delete(storage_name)
+                continue
+
+            new_blobs[digest] = (file, get_image_blob_path(digest, file.name))
+
+        if new_blobs:
+            # a released blob with the same name may still be queued for deletion
+            FileDeletion.objects.filter(
+                name__in=[
+                    name
+                    for _, blob_name in new_blobs.values()
+                    for name in (blob_name, *get_image_variant_names(blob_name).values())
+                ]
+            ).delete()
+            for file, name in new_blobs.values():
+                _write_blob(file, name)
+
+            self.bulk_create(
+                [ImageBlob(digest=digest, name=name) for digest, (_, name) in new_blobs.items()],
+                ignore_conflicts=True
+            )
+            names.update(self.filter(digest__in=new_blobs).values_list('digest', 'name'))
+            for digest, (_, name) in new_blobs.items():
+                if names[digest] != name:
+                    # a concurrent upload stored the same content under another extension
+                    default_storage.delete(name)
+
+        self.filter(digest__in=set(digests)).update(
+            ref_count=F('ref_count') + Case(
+                *[When(digest=digest, then=Value(count)) for digest, count in Counter(digests).items()]
+            )
+        )
+        return [names[digest] for digest in digests]
+
+    def release(self, names: Iterable[str]) -> List[str]:
+        """
+        Drops one reference per given name and returns the files of the blobs
+        that are not referenced anymore, including their variants.
+        """
+        counts = Counter(names)
+        if not counts:
+            return []
+
+        self.filter(name__in=counts).update(
+            ref_count=F('ref_count') - Case(
+                *[When(name=name, then=Value(count)) for name, count in counts.items()]
+            )
+        )
+        released = list(self.filter(name__in=counts, ref_count=0).values_list('name', flat=True))
+        self.filter(name__in=released).delete()
+        return [
+            name
+            for blob_name in released
+            for name in (blob_name, *get_image_variant_names(blob_name).values())
+        ]
+
+
+class ImageBlob(BaseModel):
+    """
+    An image file stored under the hash of its content and shared by all the
+    images with the same content.
+    """
+    digest = models.CharField(_('digest'), max_length=64, unique=True)
+    name = models.CharField(_('name'), max_length=255, db_index=True)
+    ref_count = models.PositiveIntegerField(_('reference count'), default=0)
+
+    objects = ImageBlobQuerySet.as_manager()
+
+
+def _write_blob(file: File, name: str) -> None:
+    path = default_storage.path(name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    if storage_name := getattr(file, 'storage_name', None):
+        os.replace(default_storage.path(storage_name), path)
+        return
+
+    with open(path, 'wb') as blob:
+        for chunk in file.chunks():
+            blob.write(chunk)
+
+
+def _enqueue_image_file_deletions(rows: Iterable[Tuple[str, str, str]]) -> None:
+    # Files of content addressed images are shared, they are only deleted with
+    # the last reference to their blob.
+    blob_names = []
+    names = []
+    for row in rows:
+        if row[0].startswith(IMAGE_BLOB_PREFIX):
+            blob_names.append(row[0])
+        else:
+            names.extend(row)
+
+    FileDeletion.enqueue(names + ImageBlob.objects.release(blob_names))
+
+
+class ImageQuerySet(models.QuerySet):
+
+    def delete(self):
+        # like `Collector.delete()`, no savepoint when called in a transaction
+        with transaction.atomic(using=self.db, savepoint=False):
+            _enqueue_image_file_deletions(self.values_list('image', 'thumbnail', 'webp'))
+            return super().delete()
+
 
 class Image(BaseModel):
+
+    class VariantsStatus(models.IntegerChoices):
+        PENDING = 0, _('pending')
+        PROCESSING = 1, _('processing')
+        READY = 2, _('ready')
+        FAILED = 3, _('failed')
+
     image = models.ImageField(verbose_name=_('image'), upload_to=get_upload_image_path)
+    thumbnail = models.ImageField(verbose_name=_('thumbnail'), upload_to=get_upload_image_path, blank=True)
+    webp = models.ImageField(verbose_name=_('webp'), upload_to=get_upload_image_path, blank=True)
+    variants_status = models.PositiveSmallIntegerField(
+        _('variants status'),
+        choices=VariantsStatus.choices,
+        default=VariantsStatus.PENDING
+    )
+    # when a worker claimed the image for processing
+    claimed_at = models.DateTimeField(_('claimed at'), null=True, blank=True, editable=False)
     content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE)
     object_id = models.PositiveIntegerField()
     content_object = GenericForeignKey('content_type', 'object_id')
 
+    objects = ImageQuerySet.as_manager()
+
     class Meta:
         indexes = [
             models.Index(fields=['content_type', 'object_id']),
+            models.Index(
+                fields=['id'],
+                condition=models.Q(variants_status=0),
+                name='core_image_pending_idx'
+            ),
+            models.Index(
+                fields=['claimed_at'],
+                condition=models.Q(variants_status=1),
+                name='core_image_processing_idx'
+            ),
         ]
 
     def _validate_image_size_limit(self) -> None:
@@ -80,10 +336,83 @@ class Image(BaseModel):
         super().save(*args, **kwargs)
 
     def delete(self, using=None, keep_parents=False):
-        to_delete = str(self.image.file)
-        super().delete(using, keep_parents)
-        if os.path.exists(to_delete):
-            os.remove(to_delete)
+        with transaction.atomic(using=using, savepoint=False):
+            _enqueue_image_file_deletions([(self.image.name, self.thumbnail.name, self.webp.name)])
+            return super().delete(using, keep_parents)
+
+
+# text search configuration of the search vector trigger, see migration 0006
+PRODUCT_SEARCH_CONFIG = 'simple'
+
+# Sort keys of the product list. Each ordering ends with `id` in the same
+# direction, so it is unique for keyset pagination and is backed by one of
+# the `(user, <field>, id)` indexes of `Product`.
+PRODUCT_ORDERINGS = {
+    '-id': ('-id', ),
+    'price': ('price', 'id'),
+    '-price': ('-price', '-id'),
+    'created_at': ('created_at', 'id'),
+    '-created_at': ('-created_at', '-id'),
+    'updated_at': ('updated_at', 'id'),
+    '-updated_at': ('-updated_at', '-id'),
+    'title': ('title', 'id'),
+    '-title': ('-title', '-id'),
+}
+
+
+class ProductQuerySet(models.QuerySet):
+
+    def search(self, query: str) -> QuerySet:
+        """
+        Products whose title or description match `query`, best matches first.
+        On PostgreSQL the query is matched against `search_vector` and, so that
+        typos still find something, by trigram similarity against the title,
+        both backed by GIN indexes. Other databases get a case-insensitive
+        match of every word, newest first.
+        """
+        if not query.split():
+            return self.none()
+
+        if connections[self.db].vendor == 'postgresql':
+            search_query = SearchQuery(query, config=PRODUCT_SEARCH_CONFIG, search_type='websearch')
+            return self.filter(
+                Q(search_vector=search_query) | Q(title__trigram_word_similar=query)
+            ).annotate(
+                rank=SearchRank(F('search_vector'), search_query) + TrigramWordSimilarity(query, 'title')
+            ).order_by('-rank', '-id')
+
+        condition = Q()
+        for word in query.split():
+            condition &= Q(title__icontains=word) | Q(description__icontains=word)
+        return self.filter(condition)
+
+    def with_image_state(self) -> QuerySet:
+        """
+        Annotates what the images of each product contribute to its `etag` and
+        `last_modified`, so they can be checked without loading the images.
+        """
+        images = Image.objects.filter(
+            content_type__app_label=self.model._meta.app_label,
+            content_type__model=self.model._meta.model_name,
+            object_id=OuterRef('pk'),
+        ).order_by().values('object_id')
+
+        def aggregate(expression):
+            return Subquery(images.annotate(value=expression).values('value'))
+
+        return self.annotate(
+            image_count=aggregate(Count('id')),
+            image_max_id=aggregate(Max('id')),
+            image_variants_status=aggregate(Sum('variants_status')),
+            image_created_at=aggregate(Max('created_at')),
+        )
+
+
+class ProductManager(models.Manager.from_queryset(ProductQuerySet)):
+
+    def get_queryset(self):
+        # the search vector is only ever read by the database
+        return super().get_queryset().defer('search_vector')
 
 
 class Product(BaseModelWithImage):
@@ -91,14 +420,106 @@ class Product(BaseModelWithImage):
     price = models.PositiveIntegerField(_('price'), validators=[MinValueValidator(1)])
     description = models.TextField(_('description'))
     updated_at = models.DateTimeField(_('updated_at'), auto_now=True)
+    # kept up to date by a trigger on PostgreSQL
+    search_vector = SearchVectorField(_('search vector'), null=True, editable=False)
 
     user = models.ForeignKey(get_user_model(), verbose_name=_('user'), on_delete=models.CASCADE)
 
     MAX_IMAGE_COUNT = 5
     MAX_IMAGE_SIZE_MB = 2
 
+    objects = ProductManager()
+
     class Meta:
         indexes = [
-            models.Index(fields=['id', 'user_id']),
+            models.Index(fields=['user', '-id']),
+            models.Index(fields=['user', 'price', 'id'], name='core_product_price_idx'),
+            models.Index(fields=['user', 'created_at', 'id'], name='core_product_created_idx'),
+            models.Index(fields=['user', 'updated_at', 'id'], name='core_product_updated_idx'),
+            models.Index(fields=['user', 'title', 'id'], name='core_product_title_idx'),
+            # `LIKE 'prefix%'` can only use an index in the collation order
+            # on PostgreSQL with the pattern operator class
+            models.Index(
+                fields=['user', 'title'],
+                opclasses=['int4_ops', 'varchar_pattern_ops'],
+                name='core_product_title_prefix_idx'
+            ),
         ]
         ordering = ('-id', )
+
+    def _get_image_state(self) -> Tuple[int, Optional[int], int, Optional[datetime]]:
+        if hasattr(self, 'image_count'):
+            return (
+                self.image_count or 0,
+                self.image_max_id,
+                self.image_variants_status or 0,
+                self.image_created_at,
+            )
+
+        images = list(self.images)
+        return (
+            len(images),
+            max((image.id for image in images), default=None),
+            sum(image.variants_status for image in images),
+            max((image.created_at for image in images), default=None),
+        )
+
+    def lock_for_image_change(self) -> None:
+        # images are part of the product for clients, the UPDATE takes the
+        # same row lock as SELECT FOR UPDATE
+        self.updated_at = timezone.now()
+        Product.objects.filter(pk=self.pk).update(updated_at=self.updated_at)
+
+    @property
+    def etag(self) -> str:
+        """
+        Strong ETag of the API representation. Image ids only grow, so their
+        count and highest id change with any addition or removal, and the sum
+        of their variant statuses grows as the variants are built.
+        """
+        count, max_id, variants_status, _ = self._get_image_state()
+        state = f'{self.pk}:{self.updated_at.isoformat()}:{count}:{max_id}:{variants_status}'
+        return '"%s"' % hashlib.md5(state.encode()).hexdigest()
+
+    @property
+    def last_modified(self) -> datetime:
+        image_created_at = self._get_image_state()[3]
+        return max(self.updated_at, image_created_at) if image_created_at else self.updated_at
+
+
+class Tombstone(BaseModel):
+    """
+    Marks a deleted product or image for the delta sync of clients, kept for
+    `PRODUCT_SYNC_TOMBSTONE_RETENTION_DAYS` by the `compact_tombstones`
+    command.
+    """
+
+    class Kind(models.IntegerChoices):
+        PRODUCT = 0, _('product')
+        IMAGE = 1, _('image')
+
+    user = models.ForeignKey(get_user_model(), verbose_name=_('user'), on_delete=models.CASCADE, db_index=False)
+    kind = models.PositiveSmallIntegerField(_('kind'), choices=Kind.choices)
+    object_id = models.PositiveBigIntegerField(_('object id'))
+    # the product of a deleted image
+    product_id = models.PositiveBigIntegerField(_('product id'), null=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'created_at', 'id'], name='core_tombstone_user_idx'),
+            models.Index(fields=['created_at'], name='core_tombstone_created_idx'),
+        ]
+
+    @classmethod
+    def record_products(cls, user_id: int, product_ids: Iterable[int]) -> None:
+        cls.objects.bulk_create(
+            cls(user_id=user_id, kind=cls.Kind.PRODUCT, object_id=product_id) for product_id in product_ids
+        )
+
+    @classmethod
+    def record_images(cls, user_id: int, product_id: int, image_ids: Iterable[int]) -> None:
+        cls.objects.bulk_create(
+            cls(user_id=user_id, kind=cls.Kind.IMAGE, object_id=image_id, product_id=product_id)
+            for image_id in image_ids
+        )
+
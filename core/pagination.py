@@ -0,0 +1,204 @@
+from datetime import date
+from typing import Any, List, Literal, Optional, Sequence, Type
+
+from django.core import signing
+from django.db.models import Q, QuerySet
+from django.http import HttpRequest
+from ninja import Field, Schema
+from ninja.conf import settings
+from ninja.pagination import AsyncPaginationBase
+
+from .exceptions import ApiValidationError
+from .models import BaseModelWithImage
+
+
+CURSOR_SALT = 'core.pagination.cursor'
+
+
+class PrefetchImagesMixin:
+    """
+    Attaches the images of a paginated page with one query, so serializing
+    `images` of each item does not cost a query per item.
+    """
+
+    def _prefetch_images(self, result: dict, queryset: QuerySet) -> dict:
+        if model_cls := self._get_model_with_image(queryset):
+            result['items'] = model_cls.prefetch_images(result['items'])
+
+        return result
+
+    async def _aprefetch_images(self, result: dict, queryset: QuerySet) -> dict:
+        if model_cls := self._get_model_with_image(queryset):
+            result['items'] = await model_cls.aprefetch_images(result['items'])
+
+        return result
+
+    @staticmethod
+    def _get_model_with_image(queryset: QuerySet) -> Optional[Type[BaseModelWithImage]]:
+        model_cls = getattr(queryset, 'model', None)
+        if model_cls is not None and issubclass(model_cls, BaseModelWithImage):
+            return model_cls
+        return None
+
+
+def encode_cursor(ordering: Sequence[str], values: Sequence[Any]) -> str:
+    values = [value.isoformat() if isinstance(value, date) else value for value in values]
+    return signing.dumps([list(ordering), values], salt=CURSOR_SALT)
+
+
+def decode_cursor(cursor: str, ordering: Sequence[str]) -> List[Any]:
+    """
+    Values of the ordering fields of the last item of the previous page. A
+    cursor is only valid for the ordering it was issued for.
+    """
+    try:
+        cursor_ordering, values = signing.loads(cursor, salt=CURSOR_SALT)
+    except (signing.BadSignature, TypeError, ValueError):
+        raise ApiValidationError('Invalid cursor', status_code=400)
+
+    if cursor_ordering != list(ordering) or len(values) != len(ordering):
+        raise ApiValidationError('Invalid cursor', status_code=400)
+
+    return values
+
+
+def get_seek_condition(ordering: Sequence[str], values: Sequence[Any]) -> Q:
+    """
+    Items after `values` in `ordering`, whose last field must be unique. The
+    leading bound on the first field lets the database start the index scan
+    right at the cursor.
+    """
+    condition = Q()
+    for i, field in enumerate(ordering):
+        name = field.lstrip('-')
+        lookup = 'lt' if field.startswith('-') else 'gt'
+        condition |= Q(
+            **{prev.lstrip('-'): value for prev, value in zip(ordering[:i], values[:i])},
+            **{f'{name}__{lookup}': values[i]}
+        )
+
+    first = ordering[0]
+    bound = Q(**{f"{first.lstrip('-')}__{'lte' if first.startswith('-') else 'gte'}": values[0]})
+    return bound & condition
+
+
+class PageOrCursorPagination(PrefetchImagesMixin, AsyncPaginationBase):
+    """
+    Page number pagination by default, keyset pagination with
+    `?pagination=cursor`. The keyset mode seeks past the last item of the
+    previous page in the ordering of the queryset, `-id` by default, instead
+    of an OFFSET, so deep pages cost the same as the first one. Orderings
+    must end with a unique field.
+    """
+
+    class Input(Schema):
+        pagination: Literal['page', 'cursor'] = 'page'
+        page: int = Field(1, ge=1)
+        cursor: Optional[str] = None
+
+    class Output(Schema):
+        items: List[Any]
+        count: Optional[int] = None
+        next: Optional[str] = None
+
+    def __init__(self, page_size: int = settings.PAGINATION_PER_PAGE, **kwargs: Any) -> None:
+        self.page_size = page_size
+        super().__init__(**kwargs)
+
+    def paginate_queryset(self, queryset: QuerySet, pagination: Input, **params: Any) -> Any:
+        request = params['request']
+        if pagination.pagination == 'cursor':
+            result = self._paginate_by_cursor(queryset, pagination, request)
+        else:
+            result = self._paginate_by_page(queryset, pagination, request)
+
+        return self._prefetch_images(result, queryset)
+
+    async def apaginate_queryset(self, queryset: QuerySet, pagination: Input, **params: Any) -> Any:
+        request = params['request']
+        if pagination.pagination == 'cursor':
+            result = await self._apaginate_by_cursor(queryset, pagination, request)
+        else:
+            result = await self._apaginate_by_page(queryset, pagination, request)
+
+        return await self._aprefetch_images(result, queryset)
+
+    def _paginate_by_page(self, queryset: QuerySet, pagination: Input, request: HttpRequest) -> dict:
+        offset = (pagination.page - 1) * self.page_size
+        count = self._items_count(queryset)
+        return self._page_result(list(queryset[offset:offset + self.page_size]), count, pagination, request)
+
+    async def _apaginate_by_page(self, queryset: QuerySet, pagination: Input, request: HttpRequest) -> dict:
+        offset = (pagination.page - 1) * self.page_size
+        count = await self._aitems_count(queryset)
+        items = [item async for item in queryset[offset:offset + self.page_size]]
+        return self._page_result(items, count, pagination, request)
+
+    def _page_result(self, items: List[Any], count: int, pagination: Input, request: HttpRequest) -> dict:
+        next_url = None
+        if pagination.page * self.page_size < count:
+            next_url = self._build_next_url(request, page=pagination.page + 1)
+
+        return {
+            'items': items,
+            'count': count,
+            'next': next_url,
+        }
+
+    def _paginate_by_cursor(self, queryset: QuerySet, pagination: Input, request: HttpRequest) -> dict:
+        ordering = self._get_ordering(queryset)
+        items = list(self._get_cursor_queryset(queryset, ordering, pagination))
+        return self._cursor_result(items, ordering, request)
+
+    async def _apaginate_by_cursor(self, queryset: QuerySet, pagination: Input, request: HttpRequest) -> dict:
+        ordering = self._get_ordering(queryset)
+        items = [item async for item in self._get_cursor_queryset(queryset, ordering, pagination)]
+        return self._cursor_result(items, ordering, request)
+
+    @staticmethod
+    def _get_ordering(queryset: QuerySet) -> List[str]:
+        return list(queryset.query.order_by) or ['-id']
+
+    def _get_cursor_queryset(self, queryset: QuerySet, ordering: List[str], pagination: Input) -> QuerySet:
+        if pagination.cursor:
+            queryset = queryset.filter(get_seek_condition(ordering, decode_cursor(pagination.cursor, ordering)))
+
+        return queryset.order_by(*ordering)[:self.page_size + 1]
+
+    def _cursor_result(self, items: List[Any], ordering: List[str], request: HttpRequest) -> dict:
+        next_url = None
+        if len(items) > self.page_size:
+            items = items[:self.page_size]
+            values = [getattr(items[-1], field.lstrip('-')) for field in ordering]
+            next_url = self._build_next_url(request, cursor=encode_cursor(ordering, values))
+
+        return {
+            'items': items,
+            'next': next_url,
+        }
+
+    @staticmethod
+    def _build_next_url(request: HttpRequest, **params: Any) -> str:
+        query = request.GET.copy()
+        for key, value in params.items():
+            query[key] = value
+
+        return request.build_absolute_uri(f'?{query.urlencode()}')
+
+
+class PagePagination(PageOrCursorPagination):
+    """
+    Page number pagination only, for querysets in an order of their own such
+    as search results by rank, which the keyset mode on `-id` would lose.
+    """
+
+    class Input(Schema):
+        page: int = Field(1, ge=1)
+
+    def paginate_queryset(self, queryset: QuerySet, pagination: Input, **params: Any) -> Any:
+        result = self._paginate_by_page(queryset, pagination, params['request'])
+        return self._prefetch_images(result, queryset)
+
+    async def apaginate_queryset(self, queryset: QuerySet, pagination: Input, **params: Any) -> Any:
+        result = await self._apaginate_by_page(queryset, pagination, params['request'])
+        return await self._aprefetch_images(result, queryset)
@@ -0,0 +1,134 @@
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import AsyncIterator, Iterable, Iterator, Optional
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.http import StreamingHttpResponse
+
+
+PRIMARY_PIN_CACHE_KEY = 'db:primary:{user_id}'
+
+
+@dataclass
+class ReadRouting:
+    replica: str
+    use_primary: bool = False
+    wrote: bool = False
+
+
+_current_routing: ContextVar[Optional[ReadRouting]] = ContextVar('read_routing', default=None)
+
+
+@contextmanager
+def route_request_reads() -> Iterator[Optional[ReadRouting]]:
+    """
+    Sends the reads of everything that runs in this context to one of the
+    `DATABASE_REPLICAS`, until something is written. Reads outside of a
+    request, as in management commands, stay on the primary.
+    """
+    if not settings.DATABASE_REPLICAS:
+        yield None
+        return
+
+    routing = ReadRouting(replica=random.choice(settings.DATABASE_REPLICAS))
+    token = _current_routing.set(routing)
+    try:
+        yield routing
+    finally:
+        _current_routing.reset(token)
+
+
+def _iter_routed(content: Iterable[bytes], routing: ReadRouting) -> Iterator[bytes]:
+    iterator = iter(content)
+    while True:
+        token = _current_routing.set(routing)
+        try:
+            chunk = next(iterator, None)
+        finally:
+            _current_routing.reset(token)
+        if chunk is None:
+            return
+        yield chunk
+
+
+async def _aiter_routed(content: AsyncIterator[bytes], routing: ReadRouting) -> AsyncIterator[bytes]:
+    iterator = aiter(content)
+    while True:
+        token = _current_routing.set(routing)
+        try:
+            chunk = await anext(iterator, None)
+        finally:
+            _current_routing.reset(token)
+        if chunk is None:
+            return
+        yield chunk
+
+
+def route_streamed_reads(response: StreamingHttpResponse, routing: ReadRouting) -> None:
+    """
+    Keeps the reads of a streamed response on the replica of its request.
+    The server consumes the stream after `route_request_reads` exited, the
+    reads would go to the primary otherwise.
+    """
+    if response.is_async:
+        response.streaming_content = _aiter_routed(response.streaming_content, routing)
+    else:
+        response.streaming_content = _iter_routed(response.streaming_content, routing)
+
+
+def _pin_key(user_id: int) -> str:
+    return PRIMARY_PIN_CACHE_KEY.format(user_id=user_id)
+
+
+def use_primary_after_write(user_id: int) -> None:
+    """
+    Reads the primary for the rest of the request when the user wrote in the
+    last `DATABASE_PRIMARY_STICKY_SECONDS`, replicas may not have the write yet.
+    """
+    if (routing := _current_routing.get()) is not None and not routing.use_primary:
+        routing.use_primary = bool(cache.get(_pin_key(user_id)))
+
+
+async def ause_primary_after_write(user_id: int) -> None:
+    if (routing := _current_routing.get()) is not None and not routing.use_primary:
+        routing.use_primary = bool(await cache.aget(_pin_key(user_id)))
+
+
+def pin_to_primary(user_id: Optional[int]) -> None:
+    if user_id is not None:
+        cache.set(_pin_key(user_id), True, settings.DATABASE_PRIMARY_STICKY_SECONDS)
+
+
+async def apin_to_primary(user_id: Optional[int]) -> None:
+    if user_id is not None:
+        await cache.aset(_pin_key(user_id), True, settings.DATABASE_PRIMARY_STICKY_SECONDS)
+
+
+class PrimaryReplicaRouter:
+    """
+    Writes go to the primary, reads of a request to its replica. Reads inside
+    a transaction, after a write of the request or while the user is pinned
+    by `use_primary_after_write` go to the primary.
+    """
+
+    def db_for_read(self, model, **hints) -> str:
+        routing = _current_routing.get()
+        if routing is None or routing.use_primary or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        return routing.replica
+
+    def db_for_write(self, model, **hints) -> str:
+        if (routing := _current_routing.get()) is not None:
+            routing.use_primary = routing.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints) -> bool:
+        # replicas hold the same rows as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints) -> bool:
+        return db == DEFAULT_DB_ALIAS
@@ -1,8 +1,10 @@
 from datetime import datetime
-from typing import Optional, List
+from typing import Annotated, Literal, Optional, List, Union
 
+from django.conf import settings
 from django.contrib.auth import get_user_model
-from ninja import Schema
+from django.db.models import Q, QuerySet
+from ninja import FilterSchema, Schema
 from pydantic import model_validator, Field, field_validator
 from typing_extensions import Self
 
@@ -12,6 +14,7 @@ from .authentication import (
     decode_access_token
 )
 from .exceptions import ApiValidationError
+from .models import PRODUCT_ORDERINGS
 
 
 class NoContent(Schema):
@@ -73,6 +76,8 @@ class LoginRespSchema(Schema):
 class ImageRespSchema(Schema):
     id: int
     image: str
+    thumbnail: Optional[str] = None
+    webp: Optional[str] = None
 
 
 class BaseProductSchema(Schema):
@@ -88,6 +93,43 @@ class ProductRespSchema(BaseProductSchema):
     images: Optional[List[ImageRespSchema]]
 
 
+class PagedProductRespSchema(Schema):
+    items: List[ProductRespSchema]
+    count: Optional[int] = None
+    next: Optional[str] = None
+
+
+class DeletedImageSchema(Schema):
+    id: int
+    product_id: int
+
+
+class ProductChangesRespSchema(Schema):
+    products: List[ProductRespSchema]
+    deleted_products: List[int]
+    deleted_images: List[DeletedImageSchema]
+    cursor: str
+    has_more: bool
+
+
+class ProductFilterSchema(FilterSchema):
+    min_price: Optional[int] = Field(None, ge=0, json_schema_extra={'q': 'price__gte'})
+    max_price: Optional[int] = Field(None, ge=0, json_schema_extra={'q': 'price__lte'})
+    created_after: Optional[datetime] = Field(None, json_schema_extra={'q': 'created_at__gte'})
+    created_before: Optional[datetime] = Field(None, json_schema_extra={'q': 'created_at__lt'})
+    updated_after: Optional[datetime] = Field(None, json_schema_extra={'q': 'updated_at__gte'})
+    updated_before: Optional[datetime] = Field(None, json_schema_extra={'q': 'updated_at__lt'})
+    title: Optional[str] = Field(None, min_length=1, max_length=255, json_schema_extra={'q': 'title__startswith'})
+    sort: Literal[tuple(PRODUCT_ORDERINGS)] = '-id'
+
+    def filter_sort(self, value: str) -> Q:
+        # not a condition, applied with `order_by`
+        return Q()
+
+    def filter(self, queryset: QuerySet) -> QuerySet:
+        return super().filter(queryset).order_by(*PRODUCT_ORDERINGS[self.sort])
+
+
 class CreateProductReqSchema(BaseProductSchema): ...  # noqa
 
 
@@ -104,3 +146,39 @@ class UpdateProductReqSchema(Schema):
                 raise ApiValidationError('Invalid price', status_code=400)
 
         return value
+
+
+class BatchCreateProductSchema(CreateProductReqSchema):
+    op: Literal['create']
+
+
+class BatchUpdateProductSchema(UpdateProductReqSchema):
+    op: Literal['update']
+    id: int
+    price: int | None = None
+
+
+class BatchDeleteProductSchema(Schema):
+    op: Literal['delete']
+    id: int
+
+
+class BatchProductReqSchema(Schema):
+    operations: List[
+        Annotated[
+            Union[BatchCreateProductSchema, BatchUpdateProductSchema, BatchDeleteProductSchema],
+            Field(discriminator='op')
+        ]
+    ] = Field(..., min_length=1, max_length=settings.PRODUCT_BATCH_MAX_OPERATIONS)
+
+
+class BatchProductResultSchema(Schema):
+    op: str
+    id: Optional[int]
+    status: int
+    product: Optional[ProductRespSchema] = None
+    detail: Optional[str] = None
+
+
+class BatchProductRespSchema(Schema):
+    results: List[BatchProductResultSchema]
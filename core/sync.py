@@ -0,0 +1,121 @@
+from datetime import datetime, timedelta
+from typing import List, Optional, Sequence, Tuple
+
+from django.conf import settings
+from django.core import signing
+from django.db.models import Model, QuerySet
+from django.utils import timezone
+
+from .exceptions import ApiValidationError
+from .models import Product, Tombstone
+from .pagination import get_seek_condition
+
+
+SYNC_CURSOR_SALT = 'core.sync.cursor'
+
+# the timestamp and id of the last change a client has seen
+Position = Tuple[datetime, int]
+
+
+def encode_sync_cursor(products: Position, tombstones: Position) -> str:
+    return signing.dumps(
+        {
+            'products': [products[0].isoformat(), products[1]],
+            'tombstones': [tombstones[0].isoformat(), tombstones[1]],
+        },
+        salt=SYNC_CURSOR_SALT
+    )
+
+
+def decode_sync_cursor(cursor: str) -> Tuple[Position, Position]:
+    try:
+        payload = signing.loads(cursor, salt=SYNC_CURSOR_SALT)
+        return tuple(
+            (datetime.fromisoformat(payload[stream][0]), int(payload[stream][1]))
+            for stream in ('products', 'tombstones')
+        )
+    except (signing.BadSignature, KeyError, IndexError, TypeError, ValueError):
+        raise ApiValidationError('Invalid cursor', status_code=400)
+
+
+def _read_after(queryset: QuerySet, ordering: Sequence[str], position: Position, limit: int) -> List[Model]:
+    return list(queryset.filter(get_seek_condition(ordering, position)).order_by(*ordering)[:limit + 1])
+
+
+def _paginate(
+    items: List[Model], field: str, limit: int, current: Position, settled: datetime
+) -> Tuple[List[Model], Position, bool]:
+    """
+    The page of `items`, the position to continue from and whether there are
+    more. The position only moves past settled changes, a transaction that
+    commits late with an older timestamp is read by the next sync then.
+    """
+    page = items[:limit]
+    if len(items) > limit and getattr(page[-1], field) <= settled:
+        return page, (getattr(page[-1], field), page[-1].id), True
+    # caught up with the settled changes, the next sync reads the unsettled ones again
+    return page, max(current, (settled, 0)), False
+
+
+def get_product_changes(user_id: int, cursor: Optional[str]) -> dict:
+    """
+    The products of a user created or updated, including changes of their
+    images, and the products and images deleted since `cursor`, with the
+    cursor to continue from. Both are read in `(timestamp, id)` order from
+    their indexes, up to `PRODUCT_SYNC_PAGE_SIZE` of each at a time.
+
+    Without a cursor the sync starts from now, clients take a cursor before
+    downloading the catalog. Cursors older than the tombstone retention are
+    rejected with 410, deletions may have been compacted since.
+    """
+    now = timezone.now()
+    settled = now - timedelta(seconds=settings.PRODUCT_SYNC_LAG_SECONDS)
+    if cursor is None:
+        products_position = tombstones_position = (settled, 0)
+    else:
+        products_position, tombstones_position = decode_sync_cursor(cursor)
+
+    retention = timedelta(days=settings.PRODUCT_SYNC_TOMBSTONE_RETENTION_DAYS)
+    if min(products_position[0], tombstones_position[0]) < now - retention:
+        raise ApiValidationError('Cursor expired, the catalog has to be downloaded again', status_code=410)
+
+    limit = settings.PRODUCT_SYNC_PAGE_SIZE
+    products = _read_after(
+        Product.objects.filter(user_id=user_id), ('updated_at', 'id'), products_position, limit
+    )
+    tombstones = _read_after(
+        Tombstone.objects.filter(user_id=user_id), ('created_at', 'id'), tombstones_position, limit
+    )
+    products, products_position, has_more_products = _paginate(
+        products, 'updated_at', limit, products_position, settled
+    )
+    tombstones, tombstones_position, has_more_tombstones = _paginate(
+        tombstones, 'created_at', limit, tombstones_position, settled
+    )
+
+    return {
+        'products': Product.prefetch_images(products),
+        'deleted_products': [
+            tombstone.object_id for tombstone in tombstones if tombstone.kind == Tombstone.Kind.PRODUCT
+        ],
+        'deleted_images': [
+            {'id': tombstone.object_id, 'product_id': tombstone.product_id}
+            for tombstone in tombstones if tombstone.kind == Tombstone.Kind.IMAGE
+        ],
+        'cursor': encode_sync_cursor(products_position, tombstones_position),
+        'has_more': has_more_products or has_more_tombstones,
+    }
+
+
+def compact_tombstones(batch_size: int = 1000) -> int:
+    """
+    Deletes a batch of tombstones older than the retention and returns how
+    many were deleted.
+    """
+    expired_before = timezone.now() - timedelta(days=settings.PRODUCT_SYNC_TOMBSTONE_RETENTION_DAYS)
+    ids = list(
+        Tombstone.objects.filter(created_at__lt=expired_before).order_by('created_at')
+        .values_list('id', flat=True)[:batch_size]
+    )
+    Tombstone.objects.filter(id__in=ids).delete()
+    return len(ids)
@@ -1,19 +1,33 @@
+import csv
+import io
+import json
+from datetime import timedelta
+from urllib.parse import parse_qs, urlencode, urlparse
+
 from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
 from django.core.files.uploadedfile import SimpleUploadedFile
-from django.test import TestCase
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils.datastructures import MultiValueDict
+from django.test import TestCase, override_settings
+from django.utils import timezone
 from django.contrib.auth import get_user_model
 from ninja.testing import TestClient
-from core.models import Product, Image
+from core.models import Product, Image, Tombstone
 from ..apis.v1 import router
 from ..authentication import create_access_token, create_refresh_token
 from ..exceptions import ApiValidationError
+from ..sync import compact_tombstones, encode_sync_cursor
+from .utils import RebindRouterMixin
 
 User = get_user_model()
 
 
-class ApiTests(TestCase):
+class ApiTests(RebindRouterMixin, TestCase):
 
     def setUp(self):
+        cache.clear()
 
         self.client = TestClient(router)
         self.user = User.objects.create_user(username="testuser", password="password")
@@ -70,6 +84,162 @@ class ApiTests(TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertEqual(len(response.json()['items']), 1)
 
+    def test_get_products_query_count_is_constant(self):
+        headers = {"Authorization": f"Bearer {self.access_token}"}
+        content_type = ContentType.objects.get_for_model(Product)
+        for page_size in (1, 20):
+            cache.clear()
+            while Product.objects.filter(user=self.user).count() < page_size:
+                product = Product.objects.create(user=self.user, title="Product", description="Description", price=1)
+                Image.objects.create(
+                    object_id=product.id,
+                    content_type=content_type,
+                    image=SimpleUploadedFile("picture.jpeg", b"file_content", content_type="image/jpeg")
+                )
+
+            # user, products, count, images
+            with self.assertNumQueries(4):
+                response = self.client.get("/products", headers=headers)
+
+            self.assertEqual(len(response.json()['items']), page_size)
+            self.assertTrue(all(len(item['images']) == 1 for item in response.json()['items']))
+
+    def test_get_products_response_cache(self):
+        headers = {"Authorization": f"Bearer {self.access_token}"}
+        response = self.client.get("/products", headers=headers)
+        self.assertEqual(response.json()['count'], 1)
+
+        # only the user is loaded on a cache hit
+        with self.assertNumQueries(1):
+            cached_response = self.client.get("/products", headers=headers)
+        self.assertEqual(cached_response.json(), response.json())
+
+        data = {"title": "New Product", "description": "Description", "price": 10}
+        self.client.post("/products/", json=data, headers=headers)
+        response = self.client.get("/products", headers=headers)
+        self.assertEqual(response.json()['count'], 2)
+
+        self.client.delete(f"/products/{self.product.id}/images/{self.image.id}/", headers=headers)
+        response = self.client.get("/products", headers=headers)
+        self.assertEqual(sum(len(item['images']) for item in response.json()['items']), 0)
+
+    def test_get_products_by_cursor(self):
+        headers = {"Authorization": f"Bearer {self.access_token}"}
+        Product.objects.bulk_create(
+            Product(user=self.user, title=f"Product {i}", description="Description", price=1) for i in range(150)
+        )
+        expected_ids = list(Product.objects.filter(user=self.user).values_list('id', flat=True))
+
+        ids = []
+        path = "/products?pagination=cursor"
+        while path:
+            response = self.client.get(path, headers=headers)
+            self.assertEqual(response.status_code, 200)
+            ids += [item['id'] for item in response.json()['items']]
+            self.assertIsNone(response.json()['count'])
+            if next_url := response.json()['next']:
+                path = f"/products?{urlparse(next_url).query}"
+            else:
+                path = None
+
+        self.assertEqual(ids, expected_ids)
+
+        with self.assertRaisesMessage(ApiValidationError, 'Invalid cursor'):
+            self.client.get("/products?pagination=cursor&cursor=bad_cursor", headers=headers)
+
+    def test_get_products_filtered_and_sorted(self):
+        headers = {"Authorization": f"Bearer {self.access_token}"}
+        cheap, expensive, other = Product.objects.bulk_create([
+            Product(user=self.user, title="Product Cheap", description="Description", price=5),
+            Product(user=self.user, title="Product Expensive", description="Description", price=500),
+            Product(user=self.user, title="Other", description="Description", price=50),
+        ])
+
+        response = self.client.get("/products?min_price=10&max_price=100", headers=headers)
+        self.assertEqual([item['id'] for item in response.json()['items']], [other.id, self.product.id])
+
+        response = self.client.get("/products?title=Product&sort=-price", headers=headers)
+        self.assertEqual([item['id'] for item in response.json()['items']], [expensive.id, cheap.id])
+
+        Product.objects.filter(id=other.id).update(updated_at=timezone.now() - timedelta(days=2))
+        query = urlencode({"updated_after": timezone.now() - timedelta(days=1), "sort": "price"})
+        response = self.client.get(f"/products?{query}", headers=headers)
+        self.assertEqual(
+            [item['id'] for item in response.json()['items']],
+            [cheap.id, self.product.id, expensive.id]
+        )
+
+        response = self.client.get("/products?sort=random", headers=headers)
+        self.assertEqual(response.status_code, 422)
+
+    def test_get_products_sorted_by_cursor(self):
+        headers = {"Authorization": f"Bearer {self.access_token}"}
+        Product.objects.bulk_create(
+            Product(user=self.user, title=f"Product {i}", description="Description", price=i % 7 + 1)
+            for i in range(150)
+        )
+        expected_ids = list(
+            Product.objects.filter(user=self.user).order_by('price', 'id').values_list('id', flat=True)
+        )
+
+        ids = []
+        path = "/products?pagination=cursor&sort=price"
+        while path:
+            response = self.client.get(path, headers=headers)
+            ids += [item['id'] for item in response.json()['items']]
+            if next_url := response.json()['next']:
+                path = f"/products?{urlparse(next_url).query}"
+            else:
+                path = None
+
+        self.assertEqual(ids, expected_ids)
+
+        # cursors are bound to the sort they were issued for
+        response = self.client.get("/products?pagination=cursor&sort=price", headers=headers)
+        cursor = parse_qs(urlparse(response.json()['next']).query)['cursor'][0]
+        with self.assertRaisesMessage(ApiValidationError, 'Invalid cursor'):
+            self.client.get(f"/products?pagination=cursor&sort=title&cursor={cursor}", headers=headers)
+
+    def test_get_products_filtered_response_cache(self):
+        headers = {"Authorization": f"Bearer {self.access_token}"}
+        response = self.client.get("/products?min_price=5&sort=price", headers=headers)
+        self.assertEqual(response.json()['count'], 1)
+
+        with self.assertNumQueries(1):
+            cached_response = self.client.get("/products?sort=price&min_price=5", headers=headers)
+        self.assertEqual(cached_response.json(), response.json())
+
+        response = self.client.get("/products?min_price=50&sort=price", headers=headers)
+        self.assertEqual(response.json()['count'], 0)
+
+        data = {"title": "New Product", "description": "Description", "price": 100}
+        self.client.post("/products/", json=data, headers=headers)
+        response = self.client.get("/products?min_price=50&sort=price", headers=headers)
+        self.assertEqual(response.json()['count'], 1)
+
+    def test_search_products(self):
+        headers = {"Authorization": f"Bearer {self.access_token}"}
+        apple, pear, _ = Product.objects.bulk_create([
+            Product(user=self.user, title="Red Apple", description="Fresh fruit", price=1),
+            Product(user=self.user, title="Green Pear", description="Tastes like an apple", price=1),
+            Product(user=self.user, title="Chair", description="Wooden", price=1),
+        ])
+        other_user = User.objects.create_user(username="otheruser", password="password")
+        Product.objects.create(user=other_user, title="Apple", description="Description", price=1)
+
+        # user, count, products, images
+        with self.assertNumQueries(4):
+            response = self.client.get("/products/search?q=APPLE", headers=headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([item['id'] for item in response.json()['items']], [pear.id, apple.id])
+        self.assertEqual(response.json()['count'], 2)
+
+        response = self.client.get("/products/search?q=apple fresh", headers=headers)
+        self.assertEqual([item['id'] for item in response.json()['items']], [apple.id])
+
+        response = self.client.get("/products/search?q=table", headers=headers)
+        self.assertEqual(response.json()['items'], [])
+
     def test_get_product(self):
         headers = {"Authorization": f"Bearer {self.access_token}"}
         response = self.client.get(f"/products/{self.product.id}", headers=headers)
@@ -79,6 +249,75 @@ class ApiTests(TestCase):
         response = self.client.get(f"/products/0", headers=headers)
         self.assertEqual(response.status_code, 404)
 
+    def test_get_product_conditional(self):
+        headers = {"Authorization": f"Bearer {self.access_token}"}
+        response = self.client.get(f"/products/{self.product.id}", headers=headers)
+        etag, last_modified = response['ETag'], response['Last-Modified']
+        self.assertIn('private', response['Cache-Control'])
+
+        # user, product and image state
+        with self.assertNumQueries(2):
+            response = self.client.get(f"/products/{self.product.id}", headers={**headers, "IF-NONE-MATCH": etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+        self.assertEqual(response.content, b'')
+
+        response = self.client.get(
+            f"/products/{self.product.id}", headers={**headers, "IF-MODIFIED-SINCE": last_modified}
+        )
+        self.assertEqual(response.status_code, 304)
+
+        response = self.client.get("/products/0", headers={**headers, "IF-NONE-MATCH": etag})
+        self.assertEqual(response.status_code, 404)
+
+        # a new image set changes the etag
+        self.client.delete(f"/products/{self.product.id}/images/{self.image.id}/", headers=headers)
+        response = self.client.get(f"/products/{self.product.id}", headers={**headers, "IF-NONE-MATCH": etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        etag = response['ETag']
+
+        Image.objects.filter(object_id=self.product.id).update(variants_status=Image.VariantsStatus.READY)
+        Image.objects.create(
+            object_id=self.product.id,
+            content_type=ContentType.objects.get_for_model(Product),
+            image=SimpleUploadedFile("picture.jpeg", b"file_content", content_type="image/jpeg")
+        )
+        response = self.client.get(f"/products/{self.product.id}", headers={**headers, "IF-NONE-MATCH": etag})
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+
+        self.client.put(f"/products/{self.product.id}/", json={"price": 20}, headers=headers)
+        response = self.client.get(f"/products/{self.product.id}", headers={**headers, "IF-NONE-MATCH": etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['price'], 20)
+
+    def test_get_products_conditional(self):
+        headers = {"Authorization": f"Bearer {self.access_token}"}
+        response = self.client.get("/products?page=1", headers=headers)
+        etag = response['ETag']
+        self.assertTrue(etag.startswith('W/'))
+
+        # only the user is loaded
+        with self.assertNumQueries(1):
+            response = self.client.get("/products?page=1", headers={**headers, "IF-NONE-MATCH": etag})
+        self.assertEqual(response.status_code, 304)
+
+        # other query strings are other pages
+        response = self.client.get("/products?page=1&sort=price", headers={**headers, "IF-NONE-MATCH": etag})
+        self.assertEqual(response.status_code, 200)
+
+        data = {"title": "New Product", "description": "Description", "price": 10}
+        self.client.post("/products/", json=data, headers=headers)
+        response = self.client.get("/products?page=1", headers={**headers, "IF-NONE-MATCH": etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['count'], 2)
+
+        # the time of the last change is known from then on
+        last_modified = response['Last-Modified']
+        response = self.client.get("/products?page=1", headers={**headers, "IF-MODIFIED-SINCE": last_modified})
+        self.assertEqual(response.status_code, 304)
+
     def test_delete_product(self):
         headers = {"Authorization": f"Bearer {self.access_token}"}
         response = self.client.delete(f"/products/{self.product.id}", headers=headers)
@@ -119,6 +358,190 @@ class ApiTests(TestCase):
         except ApiValidationError as e:
             self.assertIn('Invalid price', str(e))
 
+    @override_settings(PRODUCT_EXPORT_CHUNK_SIZE=2)
+    def test_export_products(self):
+        headers = {"Authorization": f"Bearer {self.access_token}"}
+        Product.objects.bulk_create(
+            Product(user=self.user, title=f"Product {i}", description="Description", price=1) for i in range(4)
+        )
+        expected_ids = list(Product.objects.filter(user=self.user).order_by('id').values_list('id', flat=True))
+
+        # user, products, images per chunk of 2
+        with self.assertNumQueries(5):
+            response = self.client.get("/products/export", headers=headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        items = [json.loads(line) for line in response.content.decode().splitlines()]
+        self.assertEqual([item['id'] for item in items], expected_ids)
+        self.assertEqual(items[0]['images'][0]['id'], self.image.id)
+
+        response = self.client.get("/products/export?format=csv", headers=headers)
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+        rows = list(csv.DictReader(io.StringIO(response.content.decode())))
+        self.assertEqual([int(row['id']) for row in rows], expected_ids)
+        self.assertEqual(rows[0]['title'], self.product.title)
+        self.assertEqual(rows[0]['images'], self.image.image.url)
+        self.assertEqual(rows[1]['images'], '')
+
+    def test_batch_products(self):
+        headers = {"Authorization": f"Bearer {self.access_token}"}
+        other = Product.objects.create(user=self.user, title="Other", description="Description", price=1)
+        other_user = User.objects.create_user(username="otheruser", password="password")
+        foreign = Product.objects.create(user=other_user, title="Foreign", description="Description", price=1)
+        self.client.get("/products", headers=headers)
+
+        operations = [
+            {"op": "create", "title": "New Product", "description": "Description", "price": 10},
+            {"op": "update", "id": self.product.id, "price": 20},
+            {"op": "update", "id": other.id, "title": "Renamed"},
+            {"op": "delete", "id": other.id},
+            {"op": "update", "id": other.id, "title": "Deleted"},
+            {"op": "delete", "id": foreign.id},
+        ]
+        response = self.client.post("/products/batch/", json={"operations": operations}, headers=headers)
+        self.assertEqual(response.status_code, 200)
+        results = response.json()['results']
+        self.assertEqual([result['status'] for result in results], [201, 200, 200, 204, 404, 404])
+
+        created = Product.objects.get(title="New Product")
+        self.assertEqual(results[0]['id'], created.id)
+        self.assertEqual(results[0]['product']['images'], [])
+        self.assertEqual(results[1]['product']['price'], 20)
+        self.assertEqual(len(results[1]['product']['images']), 1)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.price, 20)
+        self.assertFalse(Product.objects.filter(id=other.id).exists())
+        self.assertTrue(Product.objects.filter(id=foreign.id).exists())
+
+        # the cached list pages of the user are invalidated
+        response = self.client.get("/products", headers=headers)
+        self.assertEqual(response.json()['count'], 2)
+
+    def test_batch_products_query_count_is_constant(self):
+        headers = {"Authorization": f"Bearer {self.access_token}"}
+        for size in (1, 20):
+            products = Product.objects.bulk_create(
+                Product(user=self.user, title="Product", description="Description", price=1) for _ in range(size * 2)
+            )
+            operations = [
+                *({"op": "create", "title": "Product", "description": "Description", "price": 1} for _ in range(size)),
+                *({"op": "update", "id": product.id, "price": 2} for product in products[:size]),
+                *({"op": "delete", "id": product.id} for product in products[size:]),
+            ]
+            # user, savepoint, lock, insert, update, images (2), delete, tombstones, image prefetch, release
+            with self.assertNumQueries(11):
+                response = self.client.post("/products/batch/", json={"operations": operations}, headers=headers)
+            self.assertEqual(len(response.json()['results']), size * 3)
+
+    @override_settings(PRODUCT_SYNC_LAG_SECONDS=0)
+    def test_get_product_changes(self):
+        headers = {"Authorization": f"Bearer {self.access_token}"}
+        response = self.client.get("/products/changes", headers=headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['products'], [])
+        cursor = response.json()['cursor']
+
+        created = Product.objects.create(user=self.user, title="Created", description="Description", price=1)
+        deleted = Product.objects.create(user=self.user, title="Deleted", description="Description", price=1)
+        self.client.delete(f"/products/{deleted.id}", headers=headers)
+        # deleting an image counts as a change of its product
+        self.client.delete(f"/products/{self.product.id}/images/{self.image.id}/", headers=headers)
+
+        # user, products, tombstones, images
+        with self.assertNumQueries(4):
+            response = self.client.get(f"/products/changes?{urlencode({'since': cursor})}", headers=headers)
+        data = response.json()
+        self.assertEqual([product['id'] for product in data['products']], [created.id, self.product.id])
+        self.assertEqual(data['products'][1]['images'], [])
+        self.assertEqual(data['deleted_products'], [deleted.id])
+        self.assertEqual(data['deleted_images'], [{"id": self.image.id, "product_id": self.product.id}])
+        self.assertFalse(data['has_more'])
+
+        response = self.client.get(f"/products/changes?{urlencode({'since': data['cursor']})}", headers=headers)
+        self.assertEqual(response.json()['products'], [])
+        self.assertEqual(response.json()['deleted_products'], [])
+
+    @override_settings(PRODUCT_SYNC_LAG_SECONDS=0, PRODUCT_SYNC_PAGE_SIZE=1)
+    def test_get_product_changes_by_page(self):
+        headers = {"Authorization": f"Bearer {self.access_token}"}
+        cursor = self.client.get("/products/changes", headers=headers).json()['cursor']
+        other = Product.objects.create(user=self.user, title="Other", description="Description", price=1)
+        self.product.save()
+
+        ids = []
+        has_more = True
+        while has_more:
+            data = self.client.get(f"/products/changes?{urlencode({'since': cursor})}", headers=headers).json()
+            ids += [product['id'] for product in data['products']]
+            cursor, has_more = data['cursor'], data['has_more']
+        self.assertEqual(ids, [other.id, self.product.id])
+
+    @override_settings(PRODUCT_SYNC_LAG_SECONDS=60, PRODUCT_SYNC_PAGE_SIZE=1)
+    def test_get_product_changes_within_the_lag(self):
+        headers = {"Authorization": f"Bearer {self.access_token}"}
+        cursor = self.client.get("/products/changes", headers=headers).json()['cursor']
+        # changed within the lag, like the product of `setUp()`
+        first = self.product
+        Product.objects.create(user=self.user, title="Second", description="Description", price=1)
+
+        data = self.client.get(f"/products/changes?{urlencode({'since': cursor})}", headers=headers).json()
+        self.assertEqual([product['id'] for product in data['products']], [first.id])
+        # the cursor stays before the unsettled changes
+        self.assertFalse(data['has_more'])
+
+        # a transaction that stamped its change earlier commits late
+        late = Product.objects.create(user=self.user, title="Late", description="Description", price=1)
+        Product.objects.filter(id=late.id).update(updated_at=first.updated_at - timedelta(seconds=1))
+        data = self.client.get(f"/products/changes?{urlencode({'since': data['cursor']})}", headers=headers).json()
+        self.assertEqual([product['id'] for product in data['products']], [late.id])
+
+    def test_get_product_changes_invalid_cursor(self):
+        headers = {"Authorization": f"Bearer {self.access_token}"}
+        with self.assertRaisesMessage(ApiValidationError, 'Invalid cursor'):
+            self.client.get("/products/changes?since=invalid", headers=headers)
+
+        expired = timezone.now() - timedelta(days=31)
+        cursor = encode_sync_cursor((expired, 0), (timezone.now(), 0))
+        with self.assertRaisesMessage(ApiValidationError, 'Cursor expired'):
+            self.client.get(f"/products/changes?{urlencode({'since': cursor})}", headers=headers)
+
+    def test_compact_tombstones(self):
+        Tombstone.record_products(self.user.id, [1, 2])
+        Tombstone.objects.filter(object_id=1).update(created_at=timezone.now() - timedelta(days=31))
+        self.assertEqual(compact_tombstones(), 1)
+        self.assertEqual(list(Tombstone.objects.values_list('object_id', flat=True)), [2])
+
+    def test_upload_images_for_product_query_count_is_constant(self):
+        headers = {"Authorization": f"Bearer {self.access_token}"}
+        self.image.delete()
+
+        query_counts = []
+        for count in (1, Product.MAX_IMAGE_COUNT - 1):
+            files = [
+                SimpleUploadedFile(f"picture{i}.jpeg", b"file_content", content_type="image/jpeg")
+                for i in range(count)
+            ]
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.post(
+                    f"/products/{self.product.id}/images/", FILES=MultiValueDict({"images": files}), headers=headers
+                )
+            self.assertEqual(response.status_code, 201)
+            self.assertEqual(len(response.json()), count)
+            query_counts.append(len(queries))
+
+        self.assertEqual(query_counts[0], query_counts[1])
+        self.assertEqual(Image.objects.count(), Product.MAX_IMAGE_COUNT)
+
+        with self.assertRaisesMessage(ApiValidationError, 'Image count cannot exceed'):
+            self.client.post(
+                f"/products/{self.product.id}/images/",
+                FILES=MultiValueDict(
+                    {"images": [SimpleUploadedFile("picture.jpeg", b"file_content", content_type="image/jpeg")]}
+                ),
+                headers=headers
+            )
+
     def test_delete_product_image(self):
         headers = {"Authorization": f"Bearer {self.access_token}"}
         response = self.client.delete(f"/products/{self.product.id}/images/{self.image.id}/", headers=headers)
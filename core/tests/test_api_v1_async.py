@@ -0,0 +1,111 @@
+import json
+
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.contrib.auth import get_user_model
+from django.test import RequestFactory, TestCase
+from ninja.testing import TestAsyncClient
+
+from core.models import Product, Image
+from ..apis.v1_async import export_user_products, router
+from ..authentication import create_access_token
+
+User = get_user_model()
+
+
+class AsyncApiTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+
+        self.client = TestAsyncClient(router)
+        self.user = User.objects.create_user(username="testuser", password="password")
+
+        self.product = Product.objects.create(
+            user=self.user,
+            title="Test Product",
+            description="Test Description",
+            price=10,
+        )
+        self.image = Image.objects.create(
+            object_id=self.product.id,
+            content_type=ContentType.objects.get_for_model(Product),
+            image=SimpleUploadedFile("picture.jpeg", b"file_content", content_type="image/jpeg")
+        )
+        self.headers = {"Authorization": f"Bearer {create_access_token({'id': self.user.pk})}"}
+
+    async def test_get_products(self):
+        response = await self.client.get("/products", headers=self.headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['count'], 1)
+        self.assertEqual(len(response.json()['items'][0]['images']), 1)
+
+        response = await self.client.get("/products?pagination=cursor", headers=self.headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([item['id'] for item in response.json()['items']], [self.product.id])
+
+        response = await self.client.get("/products", headers={"Authorization": "Bearer bad_token"})
+        self.assertEqual(response.status_code, 401)
+
+    async def test_search_products(self):
+        response = await self.client.get("/products/search?q=test", headers=self.headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([item['id'] for item in response.json()['items']], [self.product.id])
+        self.assertEqual(len(response.json()['items'][0]['images']), 1)
+
+        response = await self.client.get("/products/search?q=missing", headers=self.headers)
+        self.assertEqual(response.json()['count'], 0)
+
+    async def test_export_products(self):
+        # ninja's test client can only read synchronous streams
+        request = RequestFactory().get("/products/export")
+        request.user = self.user
+        response = await export_user_products(request, export_format='ndjson')
+        self.assertTrue(response.is_async)
+        content = b''.join([part async for part in response.streaming_content])
+        item = json.loads(content)
+        self.assertEqual(item['id'], self.product.id)
+        self.assertEqual(item['images'][0]['id'], self.image.id)
+
+    async def test_get_product(self):
+        response = await self.client.get(f"/products/{self.product.id}", headers=self.headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["title"], self.product.title)
+        self.assertEqual(response.json()["images"][0]["id"], self.image.id)
+
+        response = await self.client.get("/products/0", headers=self.headers)
+        self.assertEqual(response.status_code, 404)
+
+    async def test_get_product_conditional(self):
+        response = await self.client.get(f"/products/{self.product.id}", headers=self.headers)
+        etag = response['ETag']
+
+        response = await self.client.get(
+            f"/products/{self.product.id}", headers={**self.headers, "IF-NONE-MATCH": etag}
+        )
+        self.assertEqual(response.status_code, 304)
+
+        response = await self.client.get("/products/0", headers={**self.headers, "IF-NONE-MATCH": etag})
+        self.assertEqual(response.status_code, 404)
+
+    async def test_create_and_update_product(self):
+        data = {"title": "New Product", "description": "Description", "price": 10}
+        response = await self.client.post("/products/", json=data, headers=self.headers)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(await Product.objects.acount(), 2)
+
+        response = await self.client.put(
+            f"/products/{self.product.id}/", json={"title": "Updated Product", "price": 20}, headers=self.headers
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["title"], "Updated Product")
+
+        response = await self.client.get("/products", headers=self.headers)
+        self.assertEqual(response.json()['count'], 2)
+
+    async def test_delete_product(self):
+        response = await self.client.delete(f"/products/{self.product.id}", headers=self.headers)
+        self.assertEqual(response.status_code, 204)
+        self.assertFalse(await Product.objects.filter(id=self.product.id).aexists())
+        self.assertFalse(await Image.objects.aexists())
@@ -0,0 +1,91 @@
+import time
+from datetime import timedelta
+from unittest import mock
+
+import jwt
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from ninja.testing import TestClient
+
+from core.models import Product
+from ..apis.v1 import router
+from ..authentication import (
+    create_access_token,
+    decode_access_token,
+    invalidate_user_state,
+    token_payload_cache
+)
+from .utils import RebindRouterMixin
+
+User = get_user_model()
+
+
+class TokenPayloadCacheTests(TestCase):
+
+    def setUp(self):
+        token_payload_cache.clear()
+
+    def test_repeated_token_is_verified_once(self):
+        token = create_access_token({'id': 1})
+        with mock.patch('core.authentication.jwt.decode', wraps=jwt.decode) as decode:
+            self.assertEqual(decode_access_token(token)['id'], 1)
+            self.assertEqual(decode_access_token(token)['id'], 1)
+
+        self.assertEqual(decode.call_count, 1)
+        self.assertEqual((token_payload_cache.hits, token_payload_cache.misses), (1, 1))
+
+    def test_expired_token_is_not_served_from_cache(self):
+        token = create_access_token({'id': 1}, expires_delta=timedelta(seconds=-1))
+        self.assertIsNone(decode_access_token(token))
+        self.assertEqual(len(token_payload_cache), 0)
+
+        token = create_access_token({'id': 1}, expires_delta=timedelta(seconds=60))
+        decode_access_token(token)
+        with mock.patch('core.utils.time.time', return_value=time.time() + 120):
+            with mock.patch('core.authentication.jwt.decode', side_effect=jwt.ExpiredSignatureError):
+                self.assertIsNone(decode_access_token(token))
+
+
+@override_settings(JWT_STATELESS_AUTH=True)
+class StatelessJWTAuthTests(RebindRouterMixin, TestCase):
+
+    def setUp(self):
+        cache.clear()
+
+        self.client = TestClient(router)
+        self.user = User.objects.create_user(username="testuser", password="password")
+        invalidate_user_state(self.user.pk)
+        self.product = Product.objects.create(
+            user=self.user,
+            title="Test Product",
+            description="Test Description",
+            price=10,
+        )
+        self.headers = {"Authorization": f"Bearer {create_access_token({'id': self.user.pk})}"}
+
+    def test_authentication_does_not_query_users(self):
+        response = self.client.get(f"/products/{self.product.id}", headers=self.headers)
+        self.assertEqual(response.status_code, 200)
+
+        # product, images
+        with self.assertNumQueries(2):
+            response = self.client.get(f"/products/{self.product.id}", headers=self.headers)
+        self.assertEqual(response.status_code, 200)
+
+    def test_deactivated_user_is_rejected(self):
+        response = self.client.get(f"/products/{self.product.id}", headers=self.headers)
+        self.assertEqual(response.status_code, 200)
+
+        self.user.is_active = False
+        self.user.save()
+
+        response = self.client.get(f"/products/{self.product.id}", headers=self.headers)
+        self.assertEqual(response.status_code, 401)
+
+    def test_deleted_user_is_rejected(self):
+        self.user.delete()
+
+        response = self.client.get("/products", headers=self.headers)
+        self.assertEqual(response.status_code, 401)
@@ -0,0 +1,216 @@
+import json
+import pickle
+import uuid
+from unittest import mock
+
+from django.core.cache.backends.redis import RedisSerializer
+from django.test import SimpleTestCase
+
+from ..cache_backends import LocalCacheTier, TwoTierRedisCache
+
+
+class FakeRedisCacheClient:
+    """
+    Stands in for django's `RedisCacheClient`, values are pickled like on a
+    real server so callers never share them.
+    """
+
+    def __init__(self):
+        self.data = {}
+        self.reads = 0
+        self.published = []
+        self._serializer = RedisSerializer()
+
+    def get_client(self, key=None, *, write=False):
+        return self
+
+    def publish(self, channel, message):
+        self.published.append((channel, json.loads(message)))
+
+    def get(self, key, default):
+        self.reads += 1
+        return pickle.loads(self.data[key]) if key in self.data else default
+
+    def get_many(self, keys):
+        self.reads += 1
+        return {key: pickle.loads(self.data[key]) for key in keys if key in self.data}
+
+    def set(self, key, value, timeout):
+        self.data[key] = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+
+    def add(self, key, value, timeout):
+        if key in self.data:
+            return False
+        self.set(key, value, timeout)
+        return True
+
+    def incr(self, key, delta):
+        value = pickle.loads(self.data[key]) + delta
+        self.set(key, value, None)
+        return value
+
+    def delete(self, key):
+        return self.data.pop(key, None) is not None
+
+    def register_script(self, script):
+        def delete_if_equal(keys, args):
+            if self.data.get(keys[0]) != args[0]:
+                return 0
+            return int(self.delete(keys[0]))
+
+        return delete_if_equal
+
+    def clear(self):
+        self.data.clear()
+        return True
+
+
+class TwoTierRedisCacheTests(SimpleTestCase):
+
+    def setUp(self):
+        self.channel = f'test:{uuid.uuid4().hex}'
+        self.redis = FakeRedisCacheClient()
+        self.cache = self.make_cache()
+
+    def make_cache(self, max_entries=100):
+        cache = TwoTierRedisCache('redis://localhost:6379', {
+            'OPTIONS': {'LOCAL_MAX_ENTRIES': max_entries, 'LOCAL_TIMEOUT': 5, 'INVALIDATION_CHANNEL': self.channel},
+        })
+        cache._cache = self.redis
+        cache._local.subscribed.set()
+        return cache
+
+    def make_other_worker(self):
+        cache = self.make_cache()
+        cache._local = LocalCacheTier(100, 5, self.channel)
+        cache._local.subscribed.set()
+        return cache
+
+    def deliver(self, cache):
+        for _, message in self.redis.published:
+            cache._local.handle_message(json.dumps(message))
+
+    def test_reads_are_answered_locally(self):
+        self.cache.set('key', ['value'])
+        self.assertEqual(self.cache.get('key'), ['value'])
+        self.assertEqual(self.redis.reads, 0)
+
+        other = self.make_other_worker()
+        self.assertEqual(other.get('key'), ['value'])
+        self.assertEqual(other.get('key'), ['value'])
+        self.assertEqual(other.get_many(['key', 'missing']), {'key': ['value']})
+        self.assertEqual(self.redis.reads, 2)
+
+    def test_local_values_can_not_be_mutated_by_callers(self):
+        self.cache.set('key', [1])
+        self.cache.get('key').append(2)
+        self.assertEqual(self.cache.get('key'), [1])
+
+    def test_writes_invalidate_other_workers(self):
+        other = self.make_other_worker()
+        self.cache.set('version', 1)
+        self.assertEqual(other.get('version'), 1)
+
+        self.redis.published.clear()
+        self.cache.incr('version')
+        self.assertEqual(
+            self.redis.published,
+            [(self.channel, {'sender': self.cache._local.sender, 'keys': [':1:version']})]
+        )
+        # the stale copy stays until the invalidation arrives
+        self.assertEqual(other.get('version'), 1)
+        self.deliver(other)
+        self.assertEqual(other.get('version'), 2)
+
+        self.cache.delete('version')
+        self.deliver(other)
+        self.assertIsNone(other.get('version'))
+
+        other.set('key', 'value')
+        self.cache.clear()
+        self.deliver(other)
+        self.assertEqual(len(other._local.entries), 0)
+
+    def test_own_invalidations_are_ignored(self):
+        self.cache.set('key', 'value')
+        self.deliver(self.cache)
+        reads = self.redis.reads
+        self.assertEqual(self.cache.get('key'), 'value')
+        self.assertEqual(self.redis.reads, reads)
+
+    def test_value_read_before_an_invalidation_is_not_kept(self):
+        other = self.make_other_worker()
+        self.cache.set('key', 'old')
+        get = self.redis.get
+
+        def get_racing_a_write(key, default):
+            value = get(key, default)
+            self.cache.set('key', 'new')
+            self.deliver(other)
+            return value
+
+        self.redis.get = get_racing_a_write
+        self.assertEqual(other.get('key'), 'old')
+        self.redis.get = get
+        self.assertEqual(other.get('key'), 'new')
+
+    def test_value_read_before_an_own_write_is_not_kept(self):
+        self.cache.set('key', 'old')
+        self.cache._local.entries.clear()
+        get = self.redis.get
+
+        def get_racing_a_write(key, default):
+            value = get(key, default)
+            self.cache.set('key', 'new')
+            return value
+
+        self.redis.get = get_racing_a_write
+        self.assertEqual(self.cache.get('key'), 'old')
+        self.redis.get = get
+        self.assertEqual(self.cache.get('key'), 'new')
+
+    def test_value_read_during_an_own_delete_is_not_kept(self):
+        self.cache.set('key', 'old')
+        self.cache._local.entries.clear()
+        delete = self.redis.delete
+
+        def delete_racing_a_read(key):
+            # read before the key is gone from Redis
+            self.assertEqual(self.cache.get('key'), 'old')
+            return delete(key)
+
+        self.redis.delete = delete_racing_a_read
+        self.assertTrue(self.cache.delete('key'))
+        self.assertIsNone(self.cache.get('key'))
+
+    def test_delete_if_equal_keeps_a_value_set_meanwhile(self):
+        other = self.make_other_worker()
+        self.cache.set('lock', 'token')
+        self.assertEqual(other.get('lock'), 'token')
+
+        self.assertFalse(self.cache.delete_if_equal('lock', 'other_token'))
+        self.assertEqual(self.cache.get('lock'), 'token')
+
+        self.assertTrue(self.cache.delete_if_equal('lock', 'token'))
+        self.assertIsNone(self.cache.get('lock'))
+        self.deliver(other)
+        self.assertIsNone(other.get('lock'))
+
+    def test_reads_go_to_redis_while_unsubscribed(self):
+        self.cache.set('key', 'value')
+        self.cache._local.subscribed.clear()
+        with mock.patch.object(self.cache._local, 'start_listener') as start_listener:
+            self.assertEqual(self.cache.get('key'), 'value')
+            self.assertEqual(self.cache.get('key'), 'value')
+
+        self.assertEqual(self.redis.reads, 2)
+        start_listener.assert_called_with(self.redis)
+
+    def test_local_tier_can_be_turned_off(self):
+        self.channel = f'test:{uuid.uuid4().hex}'
+        cache = self.make_cache(max_entries=0)
+        cache.set('key', 'value')
+        self.assertEqual(cache.get('key'), 'value')
+        self.assertEqual(cache.get('key'), 'value')
+        self.assertEqual(self.redis.reads, 2)
+        self.assertEqual(self.redis.published, [])
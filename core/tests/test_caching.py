@@ -0,0 +1,93 @@
+import asyncio
+import threading
+import time
+from unittest import mock
+
+from asgiref.sync import async_to_sync
+from django.core.cache import cache
+from django.test import SimpleTestCase, override_settings
+
+from ..caching import REBUILD_LOCK_CACHE_KEY, aget_or_rebuild, get_or_rebuild
+
+
+@override_settings(CACHE_STALE_TIMEOUT=30, CACHE_REBUILD_LOCK_TIMEOUT=5, CACHE_EARLY_REFRESH_BETA=1)
+class GetOrRebuildTests(SimpleTestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.builds = 0
+
+    def build(self, value='value', delay=0.0):
+        def build():
+            self.builds += 1
+            time.sleep(delay)
+            return value
+
+        return build
+
+    def test_concurrent_misses_rebuild_once(self):
+        build = self.build(delay=0.2)
+        results = []
+        threads = [
+            threading.Thread(target=lambda: results.append(get_or_rebuild('key', build, 60))) for _ in range(10)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(self.builds, 1)
+        self.assertEqual(results, ['value'] * 10)
+        self.assertIsNone(cache.get(REBUILD_LOCK_CACHE_KEY.format(key='key')))
+
+    def test_expired_value_is_served_while_rebuilding(self):
+        cache.set('key', ('stale', time.time() - 1, 0.1), 60)
+        cache.add(REBUILD_LOCK_CACHE_KEY.format(key='key'), 'other', 5)
+
+        self.assertEqual(get_or_rebuild('key', self.build('fresh'), 60), 'stale')
+        self.assertEqual(self.builds, 0)
+
+        cache.delete(REBUILD_LOCK_CACHE_KEY.format(key='key'))
+        self.assertEqual(get_or_rebuild('key', self.build('fresh'), 60), 'fresh')
+        self.assertEqual(get_or_rebuild('key', self.build('fresh'), 60), 'fresh')
+        self.assertEqual(self.builds, 1)
+
+    def test_value_is_refreshed_early_near_its_expiry(self):
+        cache.set('key', ('old', time.time() + 1, 0.5), 60)
+
+        with mock.patch('core.caching.random.random', return_value=0.0):
+            self.assertEqual(get_or_rebuild('key', self.build('new'), 60), 'old')
+        self.assertEqual(self.builds, 0)
+
+        # a draw close to 1 makes the early expiration reach past the expiry
+        with mock.patch('core.caching.random.random', return_value=0.99):
+            self.assertEqual(get_or_rebuild('key', self.build('new'), 60), 'new')
+        self.assertEqual(self.builds, 1)
+
+    @override_settings(CACHE_REBUILD_LOCK_TIMEOUT=1)
+    def test_waits_for_the_rebuild_of_another_request(self):
+        cache.add(REBUILD_LOCK_CACHE_KEY.format(key='key'), 'other', 5)
+        timer = threading.Timer(0.2, lambda: cache.set('key', ('built', time.time() + 60, 0.1), 60))
+        timer.start()
+        self.addCleanup(timer.cancel)
+
+        self.assertEqual(get_or_rebuild('key', self.build('own'), 60), 'built')
+        self.assertEqual(self.builds, 0)
+
+        # without a value after the lock timeout the request rebuilds on its own
+        self.assertEqual(get_or_rebuild('other_key', self.build('own'), 60), 'own')
+        cache.add(REBUILD_LOCK_CACHE_KEY.format(key='missing'), 'other', 5)
+        self.assertEqual(get_or_rebuild('missing', self.build('own'), 60), 'own')
+        self.assertEqual(self.builds, 2)
+
+    def test_async_concurrent_misses_rebuild_once(self):
+        async def build():
+            self.builds += 1
+            await asyncio.sleep(0.2)
+            return 'value'
+
+        async def run():
+            return await asyncio.gather(*(aget_or_rebuild('key', build, 60) for _ in range(10)))
+
+        self.assertEqual(async_to_sync(run)(), ['value'] * 10)
+        self.assertEqual(self.builds, 1)
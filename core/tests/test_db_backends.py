@@ -0,0 +1,186 @@
+import threading
+from unittest import mock
+
+import psycopg2
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE, TRANSACTION_STATUS_INTRANS
+from django.db import connections
+from django.test import SimpleTestCase
+
+from ..db_backends.postgresql_pool.base import (
+    ConnectionPool,
+    DatabaseWrapper,
+    PoolTimeout,
+    close_pools,
+    get_pool,
+    render_pool_metrics,
+)
+
+
+class FakeConnection:
+    """
+    Stands in for a psycopg2 connection, `alive` turns false when the server
+    dropped it.
+    """
+
+    def __init__(self):
+        self.closed = 0
+        self.alive = True
+        self.info = mock.Mock(transaction_status=TRANSACTION_STATUS_IDLE)
+        self.autocommit = False
+        self.rollbacks = 0
+        self.executed = []
+
+    def cursor(self):
+        cursor = mock.MagicMock()
+        if self.alive:
+            cursor.__enter__.return_value.execute.side_effect = self.executed.append
+        else:
+            cursor.__enter__.return_value.execute.side_effect = psycopg2.OperationalError()
+        return cursor
+
+    def rollback(self):
+        self.rollbacks += 1
+        self.info.transaction_status = TRANSACTION_STATUS_IDLE
+
+    def close(self):
+        self.closed = 1
+
+
+class ConnectionPoolTests(SimpleTestCase):
+
+    def setUp(self):
+        self.pool = ConnectionPool(max_size=2, max_overflow=1, timeout=0.05, check_interval=30)
+
+    def test_connections_are_reused(self):
+        connection = self.pool.getconn(FakeConnection)
+        self.pool.putconn(connection)
+        self.assertIs(self.pool.getconn(FakeConnection), connection)
+
+        stats = self.pool.stats()
+        self.assertEqual((stats['opened'], stats['checkouts'], stats['in_use']), (1, 2, 1))
+
+    def test_overflow_connections_are_closed_when_returned(self):
+        connections = [self.pool.getconn(FakeConnection) for _ in range(3)]
+        for connection in connections:
+            self.pool.putconn(connection)
+
+        # returned while the pool is over its size
+        self.assertEqual([connection.closed for connection in connections], [1, 0, 0])
+        self.assertEqual(self.pool.stats()['idle'], 2)
+
+    def test_checkout_waits_for_a_returned_connection(self):
+        connections = [self.pool.getconn(FakeConnection) for _ in range(3)]
+        with self.assertRaises(PoolTimeout):
+            self.pool.getconn(FakeConnection)
+
+        timer = threading.Timer(0.01, self.pool.putconn, [connections[2]])
+        timer.start()
+        self.pool.timeout = 1
+        # the overflow connection is closed, the waiter opens one in its place
+        self.assertIsNot(self.pool.getconn(FakeConnection), connections[2])
+        timer.join()
+        self.assertTrue(connections[2].closed)
+
+        stats = self.pool.stats()
+        self.assertEqual((stats['waits'], stats['timeouts'], stats['opened']), (2, 1, 4))
+
+    def test_checkout_reuses_a_returned_connection(self):
+        pool = ConnectionPool(max_size=1, max_overflow=0, timeout=1, check_interval=30)
+        connection = pool.getconn(FakeConnection)
+
+        timer = threading.Timer(0.01, pool.putconn, [connection])
+        timer.start()
+        self.assertIs(pool.getconn(FakeConnection), connection)
+        timer.join()
+
+    def test_open_transactions_are_rolled_back(self):
+        connection = self.pool.getconn(FakeConnection)
+        connection.info.transaction_status = TRANSACTION_STATUS_INTRANS
+        self.pool.putconn(connection)
+        self.assertEqual(connection.rollbacks, 1)
+
+    def test_session_state_is_reset(self):
+        connection = self.pool.getconn(FakeConnection)
+        self.pool.putconn(connection)
+        self.assertEqual(connection.executed, ['DISCARD ALL'])
+        self.assertTrue(connection.autocommit)
+
+    def test_closed_pool_disconnects(self):
+        idle, in_use = self.pool.getconn(FakeConnection), self.pool.getconn(FakeConnection)
+        self.pool.putconn(idle)
+        self.pool.close()
+        self.assertTrue(idle.closed)
+
+        self.pool.putconn(in_use)
+        self.assertTrue(in_use.closed)
+        self.assertEqual(self.pool.stats()['size'], 0)
+
+    def test_broken_connections_are_replaced(self):
+        self.pool.check_interval = 0
+        connection = self.pool.getconn(FakeConnection)
+        self.pool.putconn(connection)
+        connection.alive = False
+
+        self.assertIsNot(self.pool.getconn(FakeConnection), connection)
+        self.assertTrue(connection.closed)
+        stats = self.pool.stats()
+        self.assertEqual((stats['failed_checks'], stats['size']), (1, 1))
+
+        discarded = self.pool.getconn(FakeConnection)
+        self.pool.putconn(discarded, discard=True)
+        self.assertTrue(discarded.closed)
+        self.assertEqual(self.pool.stats()['size'], 1)
+
+    def test_failed_connect_frees_its_slot(self):
+        with self.assertRaises(psycopg2.OperationalError):
+            self.pool.getconn(mock.Mock(side_effect=psycopg2.OperationalError()))
+        self.assertEqual(self.pool.stats()['size'], 0)
+
+    def test_render_pool_metrics(self):
+        with mock.patch.dict('core.db_backends.postgresql_pool.base._pools', {('default', ()): self.pool}):
+            self.pool.getconn(FakeConnection)
+            metrics = render_pool_metrics()
+
+        self.assertIn('db_pool_connections{alias="default",state="in_use"} 1', metrics)
+        self.assertIn('db_pool_opened_total{alias="default"} 1', metrics)
+
+
+class PooledDatabaseWrapperTests(SimpleTestCase):
+
+    def setUp(self):
+        self.addCleanup(close_pools, 'pooled')
+        self.wrapper = DatabaseWrapper({**connections['default'].settings_dict, 'NAME': 'toman_shop'}, alias='pooled')
+        self.pool = get_pool('pooled', self.wrapper.settings_dict, {'dbname': 'toman_shop'})
+
+    def checkout(self):
+        self.wrapper.connection = self.pool.getconn(FakeConnection)
+        self.wrapper._pool = self.pool
+        self.wrapper.autocommit = True
+        return self.wrapper.connection
+
+    def test_pools_are_per_database(self):
+        self.assertIs(get_pool('pooled', self.wrapper.settings_dict, {'dbname': 'toman_shop'}), self.pool)
+        self.assertIsNot(get_pool('pooled', self.wrapper.settings_dict, {'dbname': 'test_toman_shop'}), self.pool)
+
+    def test_connections_are_returned_at_request_end(self):
+        connection = self.checkout()
+        # `CONN_MAX_AGE = 0`
+        self.wrapper.close_at = 0
+        self.wrapper.close_if_unusable_or_obsolete()
+        self.assertFalse(connection.closed)
+        self.assertEqual(self.pool.stats()['idle'], 1)
+
+    def test_close_disconnects(self):
+        connection = self.checkout()
+        self.wrapper.close()
+        self.assertTrue(connection.closed)
+        self.assertEqual(self.pool.stats()['size'], 0)
+
+    def test_close_pools(self):
+        connection = self.checkout()
+        self.wrapper.close_at = 0
+        self.wrapper.close_if_unusable_or_obsolete()
+
+        close_pools('pooled')
+        self.assertTrue(connection.closed)
+        self.assertIsNot(get_pool('pooled', self.wrapper.settings_dict, {'dbname': 'toman_shop'}), self.pool)
@@ -0,0 +1,134 @@
+import os
+import shutil
+import tempfile
+import time
+from io import StringIO
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.contrib.contenttypes.models import ContentType
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+
+from core.models import FileDeletion, Product, Image, ImageBlob, _write_blob
+from ..files import delete_queued_files
+
+User = get_user_model()
+
+
+class FileDeletionTests(TestCase):
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings_override = override_settings(MEDIA_ROOT=media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        self.user = User.objects.create_user(username="testuser", password="password")
+        self.product = Product.objects.create(
+            user=self.user,
+            title="Test Product",
+            description="Test Description",
+            price=10,
+        )
+        self.image = Image.objects.create(
+            object_id=self.product.id,
+            content_type=ContentType.objects.get_for_model(Product),
+            image=SimpleUploadedFile("picture.jpeg", b"file_content", content_type="image/jpeg")
+        )
+
+    def test_image_delete_is_deferred(self):
+        name = self.image.image.name
+        self.image.delete()
+
+        self.assertTrue(default_storage.exists(name))
+        self.assertEqual(list(FileDeletion.objects.values_list('name', flat=True)), [name])
+
+        self.assertEqual(delete_queued_files(), 1)
+        self.assertFalse(default_storage.exists(name))
+        self.assertFalse(FileDeletion.objects.exists())
+
+    def test_queryset_delete_queues_files(self):
+        name = self.image.image.name
+        self.product.images.delete()
+
+        self.assertFalse(Image.objects.exists())
+        self.assertEqual(list(FileDeletion.objects.values_list('name', flat=True)), [name])
+
+    def test_collect_orphan_images(self):
+        old_orphan = default_storage.save("images/product/old_orphan.jpeg", ContentFile(b"orphan"))
+        new_orphan = default_storage.save("images/product/new_orphan.jpeg", ContentFile(b"orphan"))
+        an_hour_ago = time.time() - 3601
+        for name in (old_orphan, self.image.image.name):
+            os.utime(default_storage.path(name), (an_hour_ago, an_hour_ago))
+
+        output = StringIO()
+        call_command("collect_orphan_images", "--dry-run", stdout=output)
+        self.assertIn("Found 1 orphan files", output.getvalue())
+        self.assertTrue(default_storage.exists(old_orphan))
+
+        call_command("collect_orphan_images", stdout=StringIO())
+        self.assertFalse(default_storage.exists(old_orphan))
+        self.assertTrue(default_storage.exists(new_orphan))
+        self.assertTrue(default_storage.exists(self.image.image.name))
+
+
+@override_settings(IMAGE_CONTENT_ADDRESSED_STORAGE=True)
+class ContentAddressedImageTests(TestCase):
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings_override = override_settings(MEDIA_ROOT=media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        self.user = User.objects.create_user(username="testuser", password="password")
+        self.products = [
+            Product.objects.create(user=self.user, title=f"Product {i}", description="Description", price=10)
+            for i in range(2)
+        ]
+
+    def attach(self, product, content=b"file_content"):
+        return product.attach_images([SimpleUploadedFile("picture.jpeg", content, content_type="image/jpeg")])[0]
+
+    def test_identical_uploads_share_one_file(self):
+        with mock.patch('core.models._write_blob', wraps=_write_blob) as write_blob:
+            first = self.attach(self.products[0])
+            second = self.attach(self.products[1])
+            other = self.attach(self.products[1], b"other_content")
+
+        self.assertEqual(write_blob.call_count, 2)
+        self.assertEqual(first.image.name, second.image.name)
+        self.assertNotEqual(first.image.name, other.image.name)
+        self.assertTrue(first.image.name.startswith("images/blobs/"))
+        self.assertEqual(ImageBlob.objects.get(name=first.image.name).ref_count, 2)
+        with default_storage.open(first.image.name) as file:
+            self.assertEqual(file.read(), b"file_content")
+
+    def test_blob_is_deleted_with_its_last_reference(self):
+        first = self.attach(self.products[0])
+        second = self.attach(self.products[1])
+
+        first.delete()
+        self.assertFalse(FileDeletion.objects.exists())
+        self.assertEqual(ImageBlob.objects.get().ref_count, 1)
+
+        self.products[1].images.delete()
+        self.assertFalse(ImageBlob.objects.exists())
+        self.assertIn(second.image.name, FileDeletion.objects.values_list('name', flat=True))
+
+        delete_queued_files()
+        self.assertFalse(default_storage.exists(second.image.name))
+
+    def test_reupload_cancels_queued_deletion(self):
+        self.attach(self.products[0]).delete()
+        image = self.attach(self.products[1])
+
+        self.assertFalse(FileDeletion.objects.filter(name=image.image.name).exists())
+        delete_queued_files()
+        self.assertTrue(default_storage.exists(image.image.name))
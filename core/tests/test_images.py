@@ -0,0 +1,95 @@
+import io
+import os
+from datetime import timedelta
+
+from django.contrib.auth import get_user_model
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from PIL import Image as PILImage
+
+from core.models import Product, Image
+from ..caching import PRODUCT_LIST_VERSION_CACHE_KEY
+from ..images import claim_pending_images, process_pending_images
+
+User = get_user_model()
+
+
+def create_png(size=(800, 600)) -> bytes:
+    buffer = io.BytesIO()
+    PILImage.new('RGB', size, color='red').save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+class ImageVariantsTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username="testuser", password="password")
+        self.product = Product.objects.create(
+            user=self.user,
+            title="Test Product",
+            description="Test Description",
+            price=10,
+        )
+        self.content_type = ContentType.objects.get_for_model(Product)
+
+    def test_process_pending_images(self):
+        image = Image.objects.create(
+            object_id=self.product.id,
+            content_type=self.content_type,
+            image=SimpleUploadedFile("picture.png", create_png(), content_type="image/png")
+        )
+        self.assertEqual(image.variants_status, Image.VariantsStatus.PENDING)
+        version_key = PRODUCT_LIST_VERSION_CACHE_KEY.format(user_id=self.user.id)
+        version = cache.get(version_key)
+
+        self.assertEqual(process_pending_images(), 1)
+        # the cached list pages of the owner show the variants
+        self.assertNotEqual(cache.get(version_key), version)
+
+        image.refresh_from_db()
+        self.assertEqual(image.variants_status, Image.VariantsStatus.READY)
+        self.assertTrue(os.path.exists(image.webp.path))
+        with PILImage.open(image.thumbnail.path) as thumbnail:
+            self.assertEqual(thumbnail.format, 'WEBP')
+            self.assertEqual(thumbnail.size, (320, 240))
+
+        self.assertEqual(process_pending_images(), 0)
+        image.delete()
+
+    def test_invalid_image_is_marked_failed(self):
+        image = Image.objects.create(
+            object_id=self.product.id,
+            content_type=self.content_type,
+            image=SimpleUploadedFile("picture.jpeg", b"file_content", content_type="image/jpeg")
+        )
+
+        with self.assertLogs('core.images', level='ERROR'):
+            process_pending_images()
+
+        image.refresh_from_db()
+        self.assertEqual(image.variants_status, Image.VariantsStatus.FAILED)
+        self.assertFalse(image.thumbnail)
+
+    @override_settings(IMAGE_PROCESSING_TIMEOUT=600)
+    def test_expired_claims_are_reclaimed(self):
+        images = [
+            Image.objects.create(
+                object_id=self.product.id,
+                content_type=self.content_type,
+                image=SimpleUploadedFile("picture.png", b"file_content", content_type="image/png")
+            )
+            for _ in range(3)
+        ]
+        self.assertEqual(len(claim_pending_images(batch_size=10)), 3)
+        self.assertEqual(claim_pending_images(batch_size=10), [])
+
+        # the worker of the first one died
+        Image.objects.filter(id=images[0].id).update(claimed_at=timezone.now() - timedelta(seconds=601))
+        self.assertEqual([image.id for image in claim_pending_images(batch_size=10)], [images[0].id])
+
+        images[0].refresh_from_db()
+        self.assertEqual(images[0].variants_status, Image.VariantsStatus.PROCESSING)
+        self.assertGreater(images[0].claimed_at, timezone.now() - timedelta(seconds=600))
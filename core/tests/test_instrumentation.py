@@ -0,0 +1,203 @@
+import shutil
+import tempfile
+import time
+from collections import defaultdict
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import SimpleTestCase, TestCase, override_settings
+
+from core.models import Product, Image
+from ..authentication import create_access_token
+from ..db_backends.postgresql_pool.base import ConnectionPool
+from ..instrumentation import (
+    MetricsRegistry,
+    QueryBudgetExceeded,
+    RedisMetricsStore,
+    RequestMetrics,
+    get_metrics_store,
+    registry,
+)
+
+User = get_user_model()
+
+
+@override_settings(QUERY_BUDGET_STRICT=True, SERVER_TIMING_HEADER=True)
+class RequestMetricsTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        registry.clear()
+        get_metrics_store().clear()
+
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings_override = override_settings(MEDIA_ROOT=media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        self.user = User.objects.create_user(username="testuser", password="password")
+        content_type = ContentType.objects.get_for_model(Product)
+        for i in range(10):
+            product = Product.objects.create(user=self.user, title=f"Product {i}", description="Description", price=10)
+            Image.objects.bulk_create(
+                Image(object_id=product.id, content_type=content_type, image=f"images/picture_{i}_{j}.jpeg")
+                for j in range(2)
+            )
+        self.product = product
+        self.headers = {"HTTP_AUTHORIZATION": f"Bearer {create_access_token({'id': self.user.pk})}"}
+
+    def test_server_timing_header(self):
+        response = self.client.get("/api/v1/products", **self.headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('db;dur=', response["Server-Timing"])
+        self.assertIn('desc="4 queries"', response["Server-Timing"])
+        self.assertIn('cache;desc="0 hits 1 misses"', response["Server-Timing"])
+
+        response = self.client.get("/api/v1/products", **self.headers)
+        self.assertIn('cache;desc="1 hits 0 misses"', response["Server-Timing"])
+
+    def test_metrics_endpoint(self):
+        self.client.get("/api/v1/products", **self.headers)
+        self.client.get("/api/v1/products/0", **self.headers)
+
+        response = self.client.get("/metrics")
+        self.assertEqual(response.status_code, 200)
+        content = response.content.decode()
+        self.assertIn('http_requests_total{method="GET",route="/api/v1/products",status="200"} 1', content)
+        self.assertIn('http_requests_total{method="GET",route="/api/v1/products/<product_id>",status="404"} 1', content)
+        self.assertIn('http_request_duration_seconds_count{method="GET",route="/api/v1/products"} 1', content)
+        self.assertIn('http_request_db_queries_total{method="GET",route="/api/v1/products"} 4', content)
+
+    def test_metrics_of_all_workers_are_added_up(self):
+        self.client.get("/api/v1/products", **self.headers)
+        other_worker = MetricsRegistry()
+        other_worker.observe("GET", "/api/v1/products", 200, 0.2, RequestMetrics(db_queries=3))
+        get_metrics_store().add(other_worker.take(), {})
+
+        content = self.client.get("/metrics").content.decode()
+        self.assertIn('http_requests_total{method="GET",route="/api/v1/products",status="200"} 2', content)
+        self.assertIn('http_request_duration_seconds_bucket{method="GET",route="/api/v1/products",le="0.25"} 2', content)
+        self.assertIn('http_request_db_queries_total{method="GET",route="/api/v1/products"} 7', content)
+
+        # flushed values are not added twice
+        content = self.client.get("/metrics").content.decode()
+        self.assertIn('http_requests_total{method="GET",route="/api/v1/products",status="200"} 2', content)
+
+    def test_routes_stay_within_their_query_budget(self):
+        json_headers = {"content_type": "application/json", **self.headers}
+        product_url = f"/api/v1/products/{self.product.id}"
+
+        self.assertEqual(self.client.get("/api/v1/products?page=1", **self.headers).status_code, 200)
+        self.assertEqual(self.client.get("/api/v1/products?pagination=cursor", **self.headers).status_code, 200)
+        self.assertEqual(self.client.get(product_url, **self.headers).status_code, 200)
+        self.assertEqual(
+            self.client.post("/api/v1/products/", {"title": "New", "description": "New", "price": 1}, **json_headers)
+            .status_code,
+            201
+        )
+        self.assertEqual(self.client.put(f"{product_url}/", {"price": 20}, **json_headers).status_code, 200)
+        self.assertEqual(self.client.get("/api/v1/products/search?q=product", **self.headers).status_code, 200)
+        response = self.client.get("/api/v1/products/export?format=csv", **self.headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(b"".join(response.streaming_content).splitlines()), 12)
+        response = self.client.get("/api/v1/products/changes", **self.headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            self.client.get(f"/api/v1/products/changes?since={response.json()['cursor']}", **self.headers).status_code,
+            200
+        )
+        operations = [
+            {"op": "create", "title": "Batch", "description": "Batch", "price": 1},
+            {"op": "update", "id": self.product.id, "price": 30},
+        ]
+        self.assertEqual(
+            self.client.post("/api/v1/products/batch/", {"operations": operations}, **json_headers).status_code,
+            200
+        )
+
+        response = self.client.post(
+            f"{product_url}/images/",
+            {"images": [SimpleUploadedFile("picture.jpeg", b"file_content", content_type="image/jpeg")]},
+            **self.headers
+        )
+        self.assertEqual(response.status_code, 201)
+        response = self.client.delete(f"{product_url}/images/{response.json()[0]['id']}/", **self.headers)
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(self.client.delete(product_url, **self.headers).status_code, 204)
+
+    def test_route_over_budget_fails(self):
+        # without the prefetch every item queries its own images
+        with mock.patch.object(Product, 'prefetch_images', side_effect=lambda objects: objects):
+            with self.assertRaises(QueryBudgetExceeded):
+                self.client.get("/api/v1/products", **self.headers)
+
+        with override_settings(QUERY_BUDGET_STRICT=False), self.assertLogs('core.instrumentation', 'WARNING'):
+            with mock.patch.object(Product, 'prefetch_images', side_effect=lambda objects: objects):
+                cache.clear()
+                self.assertEqual(self.client.get("/api/v1/products", **self.headers).status_code, 200)
+
+        response = self.client.get("/metrics")
+        self.assertIn(
+            'http_request_query_budget_exceeded_total{method="GET",route="/api/v1/products"} 2',
+            response.content.decode()
+        )
+
+
+class FakeRedis:
+
+    def __init__(self):
+        self.hashes = defaultdict(dict)
+
+    def pipeline(self, transaction=True):
+        return mock.MagicMock(__enter__=mock.Mock(return_value=self))
+
+    def execute(self):
+        pass
+
+    def hincrbyfloat(self, key, field, value):
+        self.hashes[key][field.encode()] = self.hashes[key].get(field.encode(), 0) + value
+
+    def hset(self, key, field, value):
+        self.hashes[key][field.encode()] = value
+
+    def hgetall(self, key):
+        return {field: str(value).encode() for field, value in self.hashes[key].items()}
+
+    def hdel(self, key, *fields):
+        for field in fields:
+            self.hashes[key].pop(field)
+
+
+@override_settings(METRICS_FLUSH_INTERVAL=5)
+class RedisMetricsStoreTests(SimpleTestCase):
+
+    def setUp(self):
+        self.store = RedisMetricsStore('redis://localhost:6379/2')
+        self.store.client = FakeRedis()
+
+    def test_workers_are_added_up(self):
+        pool = ConnectionPool(max_size=2, max_overflow=0, timeout=1, check_interval=30)
+        pool.getconn(object)
+        pool_stats = {'default': pool.stats()}
+        for worker in ('app:1', 'app:2'):
+            metrics = MetricsRegistry()
+            metrics.observe("GET", "/api/v1/products", 200, 0.01, RequestMetrics(db_queries=2))
+            with mock.patch('core.instrumentation.socket.gethostname', return_value=worker):
+                self.store.add(metrics.take(), pool_stats)
+
+        content = self.store.render()
+        self.assertIn('http_requests_total{method="GET",route="/api/v1/products",status="200"} 2', content)
+        self.assertIn('http_request_db_queries_total{method="GET",route="/api/v1/products"} 4', content)
+        self.assertIn('db_pool_connections{alias="default",state="in_use"} 2', content)
+        self.assertIn('db_pool_checkouts_total{alias="default"} 2', content)
+
+    def test_stopped_workers_are_dropped(self):
+        with mock.patch('core.instrumentation.time.time', return_value=time.time() - 16):
+            self.store.add({}, {'default': ConnectionPool(2, 0, 1, 30).stats()})
+
+        self.assertNotIn('alias="default"', self.store.render())
+        self.assertEqual(self.store.client.hashes[RedisMetricsStore.POOLS_KEY], {})
@@ -0,0 +1,147 @@
+import fcntl
+import json
+import logging
+import os
+import shutil
+import socket
+import sys
+import tempfile
+from pathlib import Path
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.test import SimpleTestCase, TestCase
+
+from ..authentication import create_access_token
+from ..logs import JsonFormatter, QueuedFileHandler, RequestIdFilter, SamplingFilter, request_id_context
+
+User = get_user_model()
+
+
+def make_record(level=logging.INFO, msg='message', args=(), **extra):
+    record = logging.LogRecord('core.test', level, __file__, 1, msg, args, None)
+    record.__dict__.update(extra)
+    return record
+
+
+class LogFormattingTests(SimpleTestCase):
+
+    def test_json_formatter(self):
+        record = make_record(msg='%s products', args=(3, ), route='/products', status=200)
+        entry = json.loads(JsonFormatter().format(record))
+        self.assertEqual(entry['message'], '3 products')
+        self.assertEqual((entry['level'], entry['route'], entry['status']), ('INFO', '/products', 200))
+
+        try:
+            raise ValueError('broken')
+        except ValueError:
+            record = make_record(level=logging.ERROR)
+            record.exc_info = sys.exc_info()
+        self.assertIn('ValueError: broken', json.loads(JsonFormatter().format(record))['exception'])
+
+    def test_request_id_filter(self):
+        record = make_record()
+        with request_id_context('abc'):
+            RequestIdFilter().filter(record)
+        self.assertEqual(record.request_id, 'abc')
+
+    def test_sampling_filter(self):
+        sampling = SamplingFilter(rate=0.5)
+        with mock.patch('core.logs.random.random', return_value=0.7):
+            self.assertFalse(sampling.filter(make_record()))
+            self.assertTrue(sampling.filter(make_record(level=logging.WARNING)))
+        with mock.patch('core.logs.random.random', return_value=0.3):
+            self.assertTrue(sampling.filter(make_record()))
+
+
+class QueuedFileHandlerTests(SimpleTestCase):
+
+    def setUp(self):
+        log_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, log_dir)
+        self.filename = Path(log_dir) / 'test.log'
+
+    def read_entries(self):
+        # one file per process
+        filename = self.filename.with_name(f'test.{socket.gethostname()}.{os.getpid()}.log')
+        return [json.loads(line) for line in filename.read_text().splitlines()]
+
+    def test_each_process_writes_its_own_file(self):
+        pid, host = os.getpid(), socket.gethostname()
+        handler = QueuedFileHandler(self.filename, when='midnight')
+        self.assertEqual(Path(handler.target.baseFilename).name, f'test.{host}.{pid}.log')
+
+        # a forked child reopens its own file
+        with mock.patch('core.logs.os.getpid', return_value=pid + 1):
+            handler.handle(make_record())
+            self.assertEqual(Path(handler.target.baseFilename).name, f'test.{host}.{pid + 1}.log')
+            handler.close()
+
+    def test_files_of_stopped_processes_are_pruned(self):
+        log_dir = self.filename.parent
+        names = ['test.other.9.log', 'test.app.7.log', 'test.app.7.log.1', 'test.app.8.log', 'test.worker.7.log']
+        for i, name in enumerate(names):
+            (log_dir / name).write_text('')
+            os.utime(log_dir / name, (1000 + i, 1000 + i))
+        (log_dir / 'test.app.8.lock').write_text('')
+        # another process that still writes
+        with open(log_dir / 'test.other.9.lock', 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            handler = QueuedFileHandler(self.filename, backup_count=2)
+            handler.close()
+
+        self.assertEqual(
+            sorted(path.name for path in log_dir.iterdir() if path.suffix != '.lock'),
+            ['test.app.8.log', 'test.other.9.log', 'test.worker.7.log']
+        )
+
+    def test_records_are_written_by_the_listener(self):
+        handler = QueuedFileHandler(self.filename, max_bytes=1024, backup_count=1)
+        handler.setFormatter(JsonFormatter())
+        titles = ['first']
+        handler.handle(make_record(msg='titles %s', args=(titles, )))
+        # the message is resolved when logged
+        titles.append('second')
+        handler.close()
+
+        self.assertEqual([entry['message'] for entry in self.read_entries()], ["titles ['first']"])
+
+    def test_records_are_dropped_when_queue_is_full(self):
+        handler = QueuedFileHandler(self.filename, queue_size=2)
+        handler.setFormatter(JsonFormatter())
+        handler.listener.stop()
+        for i in range(3):
+            handler.handle(make_record(msg=f'record {i}'))
+        self.assertEqual(handler.dropped, 1)
+
+        handler._start()
+        handler.queue.join()
+        handler.handle(make_record(msg='record 3'))
+        handler.close()
+
+        self.assertEqual(
+            [entry['message'] for entry in self.read_entries()],
+            ['record 0', 'record 1', 'record 3', 'Dropped 1 log records, the queue was full']
+        )
+
+
+class AccessLogTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username="testuser", password="password")
+        self.headers = {"HTTP_AUTHORIZATION": f"Bearer {create_access_token({'id': self.user.pk})}"}
+
+    def test_access_log(self):
+        with self.assertLogs('core.access', level='INFO') as logs:
+            response = self.client.get("/api/v1/products", HTTP_X_REQUEST_ID="request-1", **self.headers)
+            self.client.get("/api/v1/products/0", **self.headers)
+
+        self.assertEqual(response["X-Request-ID"], "request-1")
+        found, not_found = logs.records
+        self.assertEqual(
+            (found.request_id, found.route, found.status, found.user_id, found.levelno),
+            ("request-1", "/api/v1/products", 200, self.user.id, logging.INFO)
+        )
+        self.assertEqual((not_found.status, not_found.levelno), (404, logging.WARNING))
+        self.assertGreater(found.latency_ms, 0)
+        self.assertEqual(len(not_found.request_id), 32)
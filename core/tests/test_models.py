@@ -0,0 +1,65 @@
+import re
+from datetime import timedelta
+from unittest import skipUnless
+
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import TestCase
+from django.utils import timezone
+
+from core.models import PRODUCT_ORDERINGS, Product
+
+User = get_user_model()
+
+
+class ProductListIndexTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username="testuser", password="password")
+        self.products = Product.objects.filter(user=self.user)
+        if connection.vendor == 'postgresql':
+            # the planner prefers a sequential scan of a table this small
+            with connection.cursor() as cursor:
+                cursor.execute('SET enable_seqscan = off')
+
+    def assertUsesIndex(self, queryset, index_name):
+        plan = queryset[:20].explain()
+        # the whole name, other indexes of the column share its prefix
+        self.assertRegex(plan, rf'\b{re.escape(index_name)}\b')
+        # the index also yields the order, nothing is sorted afterwards
+        self.assertNotIn('TEMP B-TREE', plan)
+        self.assertNotIn('Sort', plan)
+
+    def test_sorts_use_an_index(self):
+        indexes = {
+            'price': 'core_product_price_idx',
+            'created_at': 'core_product_created_idx',
+            'updated_at': 'core_product_updated_idx',
+            # without the operator classes of PostgreSQL the prefix index has
+            # the same order and SQLite picks it
+            'title': 'core_product_title_idx' if connection.vendor == 'postgresql' else 'core_product_title_prefix_idx',
+        }
+        for sort, ordering in PRODUCT_ORDERINGS.items():
+            if sort == '-id':
+                continue
+            with self.subTest(sort=sort):
+                self.assertUsesIndex(self.products.order_by(*ordering), indexes[sort.lstrip('-')])
+
+    def test_range_filters_use_an_index(self):
+        now = timezone.now()
+        self.assertUsesIndex(
+            self.products.filter(price__gte=10, price__lte=100).order_by(*PRODUCT_ORDERINGS['-price']),
+            'core_product_price_idx'
+        )
+        self.assertUsesIndex(
+            self.products.filter(created_at__gte=now - timedelta(days=7)).order_by(*PRODUCT_ORDERINGS['created_at']),
+            'core_product_created_idx'
+        )
+        self.assertUsesIndex(
+            self.products.filter(updated_at__lt=now).order_by(*PRODUCT_ORDERINGS['-updated_at']),
+            'core_product_updated_idx'
+        )
+
+    @skipUnless(connection.vendor == 'postgresql', 'LIKE is case-insensitive on SQLite and can not use the index')
+    def test_title_prefix_uses_an_index(self):
+        self.assertIn('core_product_title_prefix_idx', self.products.filter(title__startswith='Pro').explain())
@@ -0,0 +1,96 @@
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+from django.http import StreamingHttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+
+from core.models import Product
+from ..authentication import create_access_token
+from ..middleware import ReadReplicaMiddleware
+from ..routers import PrimaryReplicaRouter, route_request_reads, use_primary_after_write
+
+User = get_user_model()
+
+
+@override_settings(DATABASE_REPLICAS=['replica_0'])
+class PrimaryReplicaRouterTests(SimpleTestCase):
+
+    def setUp(self):
+        self.router = PrimaryReplicaRouter()
+
+    def test_reads_go_to_replica_until_write(self):
+        with route_request_reads():
+            self.assertEqual(self.router.db_for_read(Product), 'replica_0')
+            self.assertEqual(self.router.db_for_write(Product), DEFAULT_DB_ALIAS)
+            # the rest of the request reads its own write
+            self.assertEqual(self.router.db_for_read(Product), DEFAULT_DB_ALIAS)
+
+        with route_request_reads():
+            self.assertEqual(self.router.db_for_read(Product), 'replica_0')
+
+    def test_reads_outside_request_go_to_primary(self):
+        self.assertEqual(self.router.db_for_read(Product), DEFAULT_DB_ALIAS)
+
+        with override_settings(DATABASE_REPLICAS=[]), route_request_reads() as routing:
+            self.assertIsNone(routing)
+            self.assertEqual(self.router.db_for_read(Product), DEFAULT_DB_ALIAS)
+
+    def test_streamed_response_reads_replica(self):
+        # an export reads its products while the server consumes the stream
+        def stream():
+            yield self.router.db_for_read(Product)
+
+        middleware = ReadReplicaMiddleware(lambda request: StreamingHttpResponse(stream()))
+        response = middleware(RequestFactory().get('/products/export'))
+
+        self.assertEqual(self.router.db_for_read(Product), DEFAULT_DB_ALIAS)
+        self.assertEqual(b''.join(response.streaming_content), b'replica_0')
+        self.assertEqual(self.router.db_for_read(Product), DEFAULT_DB_ALIAS)
+
+    async def test_async_streamed_response_reads_replica(self):
+        async def stream():
+            yield self.router.db_for_read(Product)
+
+        async def get_response(request):
+            return StreamingHttpResponse(stream())
+
+        response = await ReadReplicaMiddleware(get_response)(RequestFactory().get('/products/export'))
+
+        self.assertEqual([chunk async for chunk in response.streaming_content], [b'replica_0'])
+        self.assertEqual(self.router.db_for_read(Product), DEFAULT_DB_ALIAS)
+
+    def test_migrations_run_on_primary(self):
+        self.assertTrue(self.router.allow_migrate(DEFAULT_DB_ALIAS, 'core'))
+        self.assertFalse(self.router.allow_migrate('replica_0', 'core'))
+
+
+@override_settings(DATABASE_REPLICAS=['replica_0'])
+class ReadYourWritesTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username="testuser", password="password")
+        self.other_user = User.objects.create_user(username="otheruser", password="password")
+        self.headers = {"HTTP_AUTHORIZATION": f"Bearer {create_access_token({'id': self.user.pk})}"}
+
+    def test_reads_in_transaction_go_to_primary(self):
+        with route_request_reads():
+            self.assertEqual(PrimaryReplicaRouter().db_for_read(Product), DEFAULT_DB_ALIAS)
+
+    def test_write_pins_user_to_primary(self):
+        self.client.get("/api/v1/products", **self.headers)
+        with route_request_reads() as routing:
+            use_primary_after_write(self.user.id)
+            self.assertFalse(routing.use_primary)
+
+        data = {"title": "Product", "description": "Description", "price": 10}
+        response = self.client.post("/api/v1/products/", data, content_type="application/json", **self.headers)
+        self.assertEqual(response.status_code, 201)
+
+        with route_request_reads() as routing:
+            use_primary_after_write(self.user.id)
+            self.assertTrue(routing.use_primary)
+
+        with route_request_reads() as routing:
+            use_primary_after_write(self.other_user.id)
+            self.assertFalse(routing.use_primary)
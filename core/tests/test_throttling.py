@@ -0,0 +1,81 @@
+from unittest import mock
+
+import redis
+from django.contrib.auth import get_user_model
+from django.test import RequestFactory, SimpleTestCase, override_settings
+from ninja import Router
+from ninja.testing import TestClient
+
+from ..authentication import TokenUser
+from ..throttling import AnonRateThrottle, AuthRateThrottle, LocalTokenBucket, get_token_bucket
+
+
+class LocalTokenBucketTests(SimpleTestCase):
+
+    def test_burst_then_refill(self):
+        bucket = LocalTokenBucket()
+        with mock.patch('core.throttling.time.time', return_value=1000.0):
+            self.assertEqual([bucket.consume('key', 3, 1.0)[0] for _ in range(4)], [True, True, True, False])
+            self.assertEqual(bucket.consume('key', 3, 1.0), (False, 1.0))
+            # other keys have buckets of their own
+            self.assertTrue(bucket.consume('other_key', 3, 1.0)[0])
+
+        with mock.patch('core.throttling.time.time', return_value=1001.5):
+            self.assertEqual(bucket.consume('key', 3, 1.0), (True, 0.5))
+            self.assertFalse(bucket.consume('key', 3, 1.0)[0])
+
+        with mock.patch('core.throttling.time.time', return_value=2000.0):
+            self.assertEqual([bucket.consume('key', 3, 1.0)[0] for _ in range(4)], [True, True, True, False])
+
+
+@override_settings(THROTTLE_BACKEND='local')
+class TokenBucketThrottleTests(SimpleTestCase):
+
+    def setUp(self):
+        get_token_bucket().clear()
+
+        router = Router()
+
+        @router.get('/limited', throttle=AnonRateThrottle('2/m', scope='limited'))
+        def limited(request):
+            return {}
+
+        @router.get('/default', throttle=[AnonRateThrottle('3/m'), AuthRateThrottle('5/m')])
+        def default(request):
+            return {}
+
+        self.client = TestClient(router)
+
+    def test_routes_have_limits_of_their_own(self):
+        self.assertEqual([self.client.get('/limited').status_code for _ in range(3)], [200, 200, 429])
+        self.assertEqual([self.client.get('/default').status_code for _ in range(4)], [200, 200, 200, 429])
+
+    def test_clients_have_limits_of_their_own(self):
+        self.assertEqual([self.client.get('/limited').status_code for _ in range(3)], [200, 200, 429])
+        self.assertEqual(self.client.get('/limited', META={'REMOTE_ADDR': '10.0.0.1'}).status_code, 200)
+
+    def test_forwarded_addresses_sent_by_the_client_are_ignored(self):
+        # nginx appends the address it sees to the header of the client
+        statuses = [
+            self.client.get('/limited', META={'HTTP_X_FORWARDED_FOR': f'10.0.1.{i}, 10.0.0.2'}).status_code
+            for i in range(3)
+        ]
+        self.assertEqual(statuses, [200, 200, 429])
+        self.assertEqual(
+            self.client.get('/limited', META={'HTTP_X_FORWARDED_FOR': '10.0.1.1, 10.0.0.3'}).status_code,
+            200
+        )
+
+    def test_requests_are_let_through_when_redis_is_down(self):
+        bucket = mock.Mock(**{'consume.side_effect': redis.ConnectionError})
+        with mock.patch('core.throttling.get_token_bucket', return_value=bucket), self.assertLogs('core.throttling'):
+            self.assertEqual([self.client.get('/limited').status_code for _ in range(3)], [200, 200, 200])
+
+    def test_users_are_throttled_by_id(self):
+        throttle = AuthRateThrottle('5/m')
+        request, other_request = RequestFactory().get('/default'), RequestFactory().get('/default')
+        request.auth = TokenUser(id=1)
+        other_request.auth = get_user_model()(pk=1, username='testuser')
+
+        self.assertEqual(throttle.get_cache_key(request), 'throttle:auth:user:1')
+        self.assertEqual(throttle.get_cache_key(other_request), 'throttle:auth:user:1')
@@ -0,0 +1,93 @@
+import os
+import shutil
+import tempfile
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase, override_settings
+
+from core.models import Product, Image
+from ..authentication import create_access_token
+from ..uploadhandlers import StoredUploadedFile, StreamingImageUploadHandler
+
+User = get_user_model()
+
+
+class StreamingImageUploadTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings_override = override_settings(MEDIA_ROOT=media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        self.user = User.objects.create_user(username="testuser", password="password")
+        self.product = Product.objects.create(
+            user=self.user,
+            title="Test Product",
+            description="Test Description",
+            price=10,
+        )
+        self.url = f"/api/v1/products/{self.product.id}/images/"
+        self.headers = {"HTTP_AUTHORIZATION": f"Bearer {create_access_token({'id': self.user.pk})}"}
+
+    def upload(self, *contents: bytes):
+        files = [SimpleUploadedFile(f"picture{i}.jpeg", content, content_type="image/jpeg") for i, content in enumerate(contents)]
+        return self.client.post(self.url, {"images": files}, **self.headers)
+
+    def test_upload_is_written_to_its_final_path(self):
+        with mock.patch('core.uploadhandlers.StoredUploadedFile', wraps=StoredUploadedFile) as stored:
+            response = self.upload(b"file_content")
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(stored.call_count, 1)
+        image = Image.objects.get()
+        self.assertEqual(image.image.name, stored.call_args.args[2])
+        self.assertEqual(os.listdir(os.path.dirname(image.image.path)), [os.path.basename(image.image.name)])
+        with default_storage.open(image.image.name) as file:
+            self.assertEqual(file.read(), b"file_content")
+
+    def test_oversized_upload_is_aborted(self):
+        receive_data_chunk = StreamingImageUploadHandler.receive_data_chunk
+        with mock.patch.object(Product, 'MAX_IMAGE_SIZE_MB', 1), \
+                mock.patch.object(StreamingImageUploadHandler, 'receive_data_chunk', autospec=True,
+                                  side_effect=receive_data_chunk) as receive:
+            response = self.upload(b"small", b"x" * (3 * 1024 * 1024))
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()["detail"], "Image size cannot exceed 1 MB.")
+        # the oversized part is rejected before being fully received
+        self.assertLess(receive.call_count, 3 * 1024 * 1024 // 65536)
+        self.assertFalse(Image.objects.exists())
+        self.assertEqual(os.listdir(default_storage.path("images/product")), [])
+
+    def test_image_count_limit(self):
+        response = self.upload(*[b"file_content"] * (Product.MAX_IMAGE_COUNT + 1))
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()["detail"], f"Image count cannot exceed {Product.MAX_IMAGE_COUNT}")
+        self.assertFalse(Image.objects.exists())
+
+    def test_rejected_request_leaves_no_files(self):
+        response = self.client.post(
+            self.url,
+            {"image": SimpleUploadedFile("picture.jpeg", b"file_content", content_type="image/jpeg")},
+            **self.headers
+        )
+
+        self.assertEqual(response.status_code, 422)
+        self.assertFalse(Image.objects.exists())
+        self.assertFalse(os.path.exists(default_storage.path("images/product")))
+
+    def test_attached_files_are_kept_when_the_request_fails(self):
+        with mock.patch('core.apis.v1.bump_product_list_version', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                self.upload(b"file_content")
+
+        self.assertTrue(os.path.exists(Image.objects.get().image.path))
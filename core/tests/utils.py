@@ -0,0 +1,16 @@
+from toman_shop.urls import api
+from ..apis.v1 import router
+
+
+class RebindRouterMixin:
+    """
+    ninja's `TestClient` binds the router it is given to a bare api of its
+    own. Test cases using one bind the v1 router back to the project api when
+    they finish, the requests of other tests go through its exception
+    handlers and throttles again.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.addClassCleanup(router.set_api_instance, api)
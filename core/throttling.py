@@ -0,0 +1,174 @@
+import logging
+import threading
+import time
+from functools import lru_cache
+from typing import Optional, Tuple
+
+import redis
+from django.conf import settings
+from django.http import HttpRequest
+from ninja.throttling import BaseThrottle
+
+from .utils import ExpiringLRUCache
+
+
+logger = logging.getLogger(__name__)
+
+THROTTLE_KEY = 'throttle:{scope}:{ident}'
+
+# Refills the bucket for the time passed since the last request by the
+# server's clock, so every worker sees the same bucket, and takes a token.
+# Returns whether the request is allowed and the seconds until the next token.
+TOKEN_BUCKET_SCRIPT = """
+local capacity = tonumber(ARGV[1])
+local refill_rate = tonumber(ARGV[2])
+local time = redis.call('TIME')
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated_at')
+local tokens = tonumber(bucket[1]) or capacity
+local updated_at = tonumber(bucket[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - updated_at) * refill_rate)
+
+local allowed = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+    allowed = 1
+end
+
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated_at', tostring(now))
+redis.call('PEXPIRE', KEYS[1], math.ceil(capacity / refill_rate * 1000))
+return {allowed, tostring(math.max(0, 1 - tokens) / refill_rate)}
+"""
+
+
+def parse_rate(rate: str) -> Tuple[int, int]:
+    """
+    `'100/s'` to the number of requests and the period in seconds, in the
+    format of ninja's throttles.
+    """
+    num, period = rate.split('/')
+    return int(num), {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}[period[0]]
+
+
+class RedisTokenBucket:
+    """
+    Token buckets kept in Redis, each request costs one `EVALSHA`.
+    """
+
+    def __init__(self, url: str):
+        self.client = redis.Redis.from_url(url)
+        self.script = self.client.register_script(TOKEN_BUCKET_SCRIPT)
+
+    def consume(self, key: str, capacity: int, refill_rate: float) -> Tuple[bool, float]:
+        allowed, wait = self.script(keys=[key], args=[capacity, refill_rate])
+        return bool(allowed), float(wait)
+
+    def clear(self) -> None:
+        for key in self.client.scan_iter(THROTTLE_KEY.format(scope='*', ident='*')):
+            self.client.delete(key)
+
+
+class LocalTokenBucket:
+    """
+    Per process token buckets with the same semantics, used by the tests and
+    single process setups.
+    """
+
+    def __init__(self, max_entries: int = 100000):
+        self.buckets = ExpiringLRUCache(max_entries)
+        self._lock = threading.Lock()
+
+    def consume(self, key: str, capacity: int, refill_rate: float) -> Tuple[bool, float]:
+        with self._lock:
+            now = time.time()
+            tokens, updated_at = self.buckets.get(key, (capacity, now))
+            tokens = min(capacity, tokens + max(0.0, now - updated_at) * refill_rate)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+
+            self.buckets.set(key, (tokens, now), now + capacity / refill_rate)
+            return allowed, max(0.0, 1 - tokens) / refill_rate
+
+    def clear(self) -> None:
+        self.buckets.clear()
+
+
+@lru_cache
+def _get_token_bucket(backend: str, redis_url: str):
+    if backend == 'local':
+        return LocalTokenBucket()
+    return RedisTokenBucket(redis_url)
+
+
+def get_token_bucket():
+    return _get_token_bucket(settings.THROTTLE_BACKEND, settings.THROTTLE_REDIS_URL)
+
+
+class TokenBucketThrottle(BaseThrottle):
+    """
+    Allows bursts of up to the number of requests of `rate` and refills at
+    `rate`, atomically across workers with `THROTTLE_BACKEND = 'redis'`.
+    Buckets are kept per `scope`, so a route can get a limit of its own.
+    Redis errors let requests through, the API should not go down with the
+    rate limiter.
+    """
+
+    scope: str = 'default'
+
+    def __init__(self, rate: str, scope: Optional[str] = None):
+        self.rate = rate
+        self.num_requests, self.duration = parse_rate(rate)
+        self.refill_rate = self.num_requests / self.duration
+        if scope:
+            self.scope = scope
+        # a throttle instance serves every request of the api
+        self._state = threading.local()
+
+    def get_cache_key(self, request: HttpRequest) -> Optional[str]:
+        raise NotImplementedError('.get_cache_key() must be overridden')
+
+    def allow_request(self, request: HttpRequest) -> bool:
+        self._state.wait = None
+        if (key := self.get_cache_key(request)) is None:
+            return True
+
+        try:
+            allowed, self._state.wait = get_token_bucket().consume(key, self.num_requests, self.refill_rate)
+        except redis.RedisError:
+            logger.warning('Could not check the %s throttle', self.scope, exc_info=True)
+            return True
+
+        return allowed
+
+    def wait(self) -> Optional[float]:
+        return getattr(self._state, 'wait', None)
+
+
+class AnonRateThrottle(TokenBucketThrottle):
+    """
+    Throttles unauthenticated requests by client address.
+    """
+
+    scope = 'anon'
+
+    def get_cache_key(self, request: HttpRequest) -> Optional[str]:
+        if getattr(request, 'auth', None) is not None:
+            return None
+        return THROTTLE_KEY.format(scope=self.scope, ident=self.get_ident(request))
+
+
+class AuthRateThrottle(TokenBucketThrottle):
+    """
+    Throttles authenticated requests by user and the others by client address.
+    """
+
+    scope = 'auth'
+
+    def get_cache_key(self, request: HttpRequest) -> Optional[str]:
+        if getattr(request, 'auth', None) is not None:
+            ident = f'user:{request.auth.pk}'
+        else:
+            ident = self.get_ident(request)
+        return THROTTLE_KEY.format(scope=self.scope, ident=ident)
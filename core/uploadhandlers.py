@@ -0,0 +1,165 @@
+import hashlib
+import os
+from contextlib import contextmanager
+from typing import Iterable, Iterator, List, Optional, Type
+
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import UploadedFile
+from django.core.files.uploadhandler import FileUploadHandler, StopFutureHandlers
+from django.http import HttpRequest
+from django.utils.translation import gettext_lazy as _
+
+from .exceptions import ApiValidationError
+from .models import BaseModelWithImage, Image
+from .utils import get_upload_image_path
+
+
+class StoredUploadedFile(UploadedFile):
+    """
+    An upload that was streamed straight to its final storage name, it has to
+    be attached by name instead of being saved through the storage again.
+    `claimed` once a view took over removing it on failure.
+    """
+
+    def __init__(
+        self,
+        file,
+        name: str,
+        storage_name: str,
+        content_type: str,
+        size: int,
+        charset: Optional[str],
+        sha256: Optional[str] = None
+    ):
+        super().__init__(file, name, content_type, size, charset)
+        self.storage_name = storage_name
+        self.sha256 = sha256
+        self.claimed = False
+
+    def temporary_file_path(self) -> str:
+        return self.file.name
+
+
+class StreamingImageUploadHandler(FileUploadHandler):
+    """
+    Writes the images uploaded as `field_name` chunk by chunk to their final
+    storage path and aborts the request as soon as a part exceeds
+    `MAX_IMAGE_SIZE_MB` or the object would exceed `MAX_IMAGE_COUNT`. Other
+    parts are left to the next handlers.
+    """
+
+    def __init__(
+        self,
+        request: HttpRequest,
+        model_cls: Type[BaseModelWithImage],
+        object_id: int,
+        field_name: str = 'images'
+    ):
+        super().__init__(request)
+        self.model_cls = model_cls
+        self.object_id = object_id
+        self.image_field_name = field_name
+        self.streaming = False
+        self.max_size = model_cls.MAX_IMAGE_SIZE_MB * 1024 * 1024
+        self.remaining_count: Optional[int] = None
+        self.stored_names: List[str] = []
+        self.stored_files: List[StoredUploadedFile] = []
+        self.file = None
+        self.storage_name = None
+        self.hasher = None
+
+    def new_file(self, field_name, file_name, content_type, content_length, charset=None, content_type_extra=None):
+        super().new_file(field_name, file_name, content_type, content_length, charset, content_type_extra)
+        self.streaming = field_name == self.image_field_name
+        if not self.streaming:
+            return
+
+        content_type_obj = ContentType.objects.get_for_model(self.model_cls)
+        if self.remaining_count is None:
+            self.remaining_count = self.model_cls.MAX_IMAGE_COUNT - Image.objects.filter(
+                content_type=content_type_obj,
+                object_id=self.object_id
+            ).count()
+
+        self.remaining_count -= 1
+        if self.remaining_count < 0:
+            self._abort(_('Image count cannot exceed %s') % self.model_cls.MAX_IMAGE_COUNT)
+
+        if content_length is not None and content_length > self.max_size:
+            self._abort(_('Image size cannot exceed %s MB.') % self.model_cls.MAX_IMAGE_SIZE_MB)
+
+        name = get_upload_image_path(Image(object_id=self.object_id, content_type=content_type_obj), file_name)
+        self.storage_name = default_storage.get_available_name(name)
+        path = default_storage.path(self.storage_name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.file = open(path, 'wb')
+        self.stored_names.append(self.storage_name)
+        # content addressed storage needs the digest, computing it here saves reading the file again
+        self.hasher = hashlib.sha256() if settings.IMAGE_CONTENT_ADDRESSED_STORAGE else None
+        raise StopFutureHandlers()
+
+    def receive_data_chunk(self, raw_data, start):
+        if not self.streaming:
+            return raw_data
+
+        if start + len(raw_data) > self.max_size:
+            self._abort(_('Image size cannot exceed %s MB.') % self.model_cls.MAX_IMAGE_SIZE_MB)
+
+        self.file.write(raw_data)
+        if self.hasher:
+            self.hasher.update(raw_data)
+
+    def file_complete(self, file_size):
+        if not self.streaming:
+            return None
+
+        self.file.close()
+        file = open(self.file.name, 'rb')
+        stored_file = StoredUploadedFile(
+            file,
+            self.file_name,
+            self.storage_name,
+            self.content_type,
+            file_size,
+            self.charset,
+            self.hasher.hexdigest() if self.hasher else None,
+        )
+        self.stored_files.append(stored_file)
+        return stored_file
+
+    def discard(self) -> None:
+        """
+        Removes the files streamed so far that no view claimed, as when the
+        request was rejected before reaching the view.
+        """
+        if self.file:
+            self.file.close()
+
+        claimed = {file.storage_name for file in self.stored_files if file.claimed}
+        for name in self.stored_names:
+            if name not in claimed:
+                default_storage.delete(name)
+
+    def _abort(self, detail: str) -> None:
+        self.discard()
+        raise ApiValidationError(detail, status_code=400)
+
+
+@contextmanager
+def discard_stored_files_on_error(files: Iterable[UploadedFile]) -> Iterator[None]:
+    """
+    Removes the files that were streamed to storage when the view fails before
+    attaching them.
+    """
+    stored_files = [file for file in files if getattr(file, 'storage_name', None)]
+    for file in stored_files:
+        file.claimed = True
+    try:
+        yield
+    except Exception:
+        for file in stored_files:
+            file.close()
+            default_storage.delete(file.storage_name)
+        raise
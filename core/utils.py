@@ -1,5 +1,10 @@
+import hashlib
 import os
+import threading
+import time
+from collections import OrderedDict
 from datetime import datetime
+from typing import Any, Dict, Hashable
 
 
 def get_upload_image_path(image, filename) -> str:
@@ -8,3 +13,76 @@ def get_upload_image_path(image, filename) -> str:
     filename = f"{image.object_id}_{now}"
     model_cls = image.content_type.model_class()
     return f"images/{model_cls.__name__.lower()}/{filename}{file_extension}"
+
+
+IMAGE_BLOB_PREFIX = 'images/blobs/'
+
+
+def get_image_blob_path(digest: str, filename: str) -> str:
+    _, file_extension = os.path.splitext(filename)
+    return f"{IMAGE_BLOB_PREFIX}{digest[:2]}/{digest}{file_extension.lower()}"
+
+
+def get_file_digest(file) -> str:
+    hasher = hashlib.sha256()
+    for chunk in file.chunks():
+        hasher.update(chunk)
+    file.seek(0)
+    return hasher.hexdigest()
+
+
+def get_image_variant_names(source_name: str) -> Dict[str, str]:
+    base_name, _ = os.path.splitext(source_name)
+    return {
+        'thumbnail': f'{base_name}_thumbnail.webp',
+        'webp': f'{base_name}_optimized.webp',
+    }
+
+
+class ExpiringLRUCache:
+    """
+    Bounded, thread-safe in-process LRU cache whose entries expire at a given
+    unix timestamp.
+    """
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data: OrderedDict[Hashable, tuple[Any, float]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[1] <= time.time():
+                if entry is not None:
+                    del self._data[key]
+                self.misses += 1
+                return default
+
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key: Hashable, value: Any, expires_at: float) -> None:
+        if self.maxsize <= 0:
+            return
+
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key: Hashable) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self.hits = self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
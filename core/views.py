@@ -0,0 +1,18 @@
+from django.http import HttpRequest, HttpResponse
+from django.views.decorators.http import require_GET
+
+from .instrumentation import flush_metrics, get_metrics_store
+
+
+@require_GET
+def metrics(request: HttpRequest) -> HttpResponse:
+    """
+    Request and connection pool metrics of every worker in the Prometheus
+    text format, scraped from the app containers directly. Other workers
+    report theirs every `METRICS_FLUSH_INTERVAL` seconds.
+    """
+    flush_metrics()
+    return HttpResponse(
+        get_metrics_store().render(),
+        content_type='text/plain; version=0.0.4; charset=utf-8'
+    )
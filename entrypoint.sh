@@ -2,6 +2,12 @@
 
 set -e
 
+export ASYNC_API="${ASYNC_API:-0}"
+
 python manage.py collectstatic --noinput
 python manage.py migrate
-gunicorn --bind 0.0.0.0:8000 --workers=4 toman_shop.wsgi:application
+if [ "$ASYNC_API" = "1" ]; then
+    gunicorn --bind 0.0.0.0:8000 --workers=4 --worker-class=uvicorn_worker.UvicornWorker toman_shop.asgi:application
+else
+    gunicorn --bind 0.0.0.0:8000 --workers=4 toman_shop.wsgi:application
+fi
@@ -1,8 +1,21 @@
+import os
+import sys
 from pathlib import Path
 
 
 LOG_DIR = Path(__file__).resolve().parent.parent / 'logs'
 
+# records waiting for the writer thread, more are dropped instead of slowing
+# requests down
+LOG_QUEUE_SIZE = int(os.getenv('LOG_QUEUE_SIZE', 10000))
+# every process writes and rotates its own `<name>.<host>.<pid>.log` files, the
+# newest LOG_BACKUP_COUNT files of stopped processes are kept
+LOG_MAX_BYTES = int(os.getenv('LOG_MAX_BYTES', 50 * 1024 * 1024))
+LOG_BACKUP_COUNT = int(os.getenv('LOG_BACKUP_COUNT', 7))
+# fraction of the successful requests written to the access log, the 4xx and
+# 5xx ones are always written
+ACCESS_LOG_SAMPLE_RATE = float(os.getenv('ACCESS_LOG_SAMPLE_RATE', 1))
+
 LOGGING = {
     'version': 1,
     'disable_existing_loggers': False,
@@ -15,13 +28,38 @@ LOGGING = {
             'format': '{levelname} {asctime} {message}',
             'style': '{',
         },
+        'json': {
+            '()': 'core.logs.JsonFormatter',
+        },
+    },
+    'filters': {
+        'request_id': {
+            '()': 'core.logs.RequestIdFilter',
+        },
+        'access_sampling': {
+            '()': 'core.logs.SamplingFilter',
+            'rate': ACCESS_LOG_SAMPLE_RATE,
+        },
     },
     'handlers': {
         'django_file': {
-            'level': 'ERROR',
-            'class': 'logging.FileHandler',
-            'formatter': 'simple',
-            'filename': LOG_DIR / 'django.log'
+            'level': 'WARNING',
+            'class': 'core.logs.QueuedFileHandler',
+            'formatter': 'json',
+            'filters': ['request_id'],
+            'filename': LOG_DIR / 'django.log',
+            'max_bytes': LOG_MAX_BYTES,
+            'backup_count': LOG_BACKUP_COUNT,
+            'queue_size': LOG_QUEUE_SIZE,
+        },
+        'access_file': {
+            'level': 'INFO',
+            'class': 'core.logs.QueuedFileHandler',
+            'formatter': 'json',
+            'filename': LOG_DIR / 'access.log',
+            'when': 'midnight',
+            'backup_count': LOG_BACKUP_COUNT,
+            'queue_size': LOG_QUEUE_SIZE,
         },
     },
     'loggers': {
@@ -35,5 +73,20 @@ LOGGING = {
             'level': 'ERROR',
             'propagate': False,
         },
+        'core': {
+            'handlers': ['django_file'],
+            'level': 'WARNING',
+            'propagate': False,
+        },
+        'core.access': {
+            'handlers': ['access_file'],
+            'level': 'INFO',
+            'filters': ['access_sampling'],
+            'propagate': False,
+        },
     }
 }
+
+if sys.argv[1:2] == ['test']:
+    # the tests write no log files, `assertLogs()` still gets the records
+    LOGGING['handlers'] = {name: {'class': 'logging.NullHandler'} for name in LOGGING['handlers']}
@@ -1,4 +1,5 @@
 import os
+import sys
 from pathlib import Path
 
 from dotenv import load_dotenv
@@ -11,6 +12,8 @@ load_dotenv()
 
 BASE_DIR = Path(__file__).resolve().parent.parent
 
+TESTING = sys.argv[1:2] == ['test']
+
 SECRET_KEY = os.getenv('SECRET_KEY', 'change_me')
 
 DEBUG = bool(int(os.getenv('DEBUG', 0)))
@@ -24,6 +27,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
 
     'ninja',
 
@@ -31,8 +35,12 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'core.middleware.AccessLogMiddleware',
+    'core.middleware.RequestMetricsMiddleware',
+    'core.middleware.ReadReplicaMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
+    'core.middleware.ImageUploadHandlerMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
@@ -59,25 +67,63 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'toman_shop.wsgi.application'
+ASGI_APPLICATION = 'toman_shop.asgi.application'
+
+# Serves `core.apis.v1_async` instead of `core.apis.v1`, meant for the ASGI deployment.
+ASYNC_API = bool(int(os.getenv('ASYNC_API', 0)))
 
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.postgresql',
+        # connections are pooled per process, with `DB_POOL=0` they are kept
+        # open by each thread for `DB_CONN_MAX_AGE` seconds instead
+        'ENGINE': (
+            'core.db_backends.postgresql_pool' if bool(int(os.getenv('DB_POOL', 1)))
+            else 'django.db.backends.postgresql'
+        ),
         'NAME': os.getenv('DB_NAME', 'toman_shop'),
         'USER': os.getenv('DB_USER', 'toman_shop'),
         'PASSWORD': os.getenv('DB_PASSWORD', 'toman_shop'),
         'HOST': os.getenv('DB_HOST', 'db'),
         'PORT': os.getenv('DB_PORT', '5432'),
+        'CONN_MAX_AGE': int(os.getenv('DB_CONN_MAX_AGE', 0)),
+        'CONN_HEALTH_CHECKS': True,
+        'POOL': {
+            'MAX_SIZE': int(os.getenv('DB_POOL_MAX_SIZE', 10)),
+            'MAX_OVERFLOW': int(os.getenv('DB_POOL_MAX_OVERFLOW', 10)),
+            'TIMEOUT': float(os.getenv('DB_POOL_TIMEOUT', 5)),
+            'CHECK_INTERVAL': float(os.getenv('DB_POOL_CHECK_INTERVAL', 30)),
+        },
     }
 }
 
+# Read replicas of `default`, as a comma separated list of hosts. Tests read
+# them through the test database of `default`.
+DATABASE_REPLICAS = []
+for index, host in enumerate(filter(None, os.getenv('DB_REPLICA_HOSTS', '').split(','))):
+    DATABASES[f'replica_{index}'] = {**DATABASES['default'], 'HOST': host.strip(), 'TEST': {'MIRROR': 'default'}}
+    DATABASE_REPLICAS.append(f'replica_{index}')
+
+DATABASE_ROUTERS = ['core.routers.PrimaryReplicaRouter']
+# how long the reads of a user go to the primary after a write, longer than
+# the replication lag
+DATABASE_PRIMARY_STICKY_SECONDS = int(os.getenv('DB_PRIMARY_STICKY_SECONDS', 5))
+
 CACHES = {
     "default": {
-        "BACKEND": "django.core.cache.backends.redis.RedisCache",
+        "BACKEND": "core.cache_backends.TwoTierRedisCache",
         "LOCATION": f"redis://{os.getenv('REDIS_HOST', 'redis')}:{os.getenv('REDIS_PORT', '6379')}",
         "TIMEOUT": int(os.getenv("REDIS_TIMEOUT", 60)),
+        "OPTIONS": {
+            # per worker LRU in front of Redis, 0 entries turns it off
+            "LOCAL_MAX_ENTRIES": int(os.getenv("LOCAL_CACHE_MAX_ENTRIES", 10000)),
+            "LOCAL_TIMEOUT": int(os.getenv("LOCAL_CACHE_TIMEOUT", 5)),
+        },
     }
 }
+# how long an expired entry is still served while one request rebuilds it
+CACHE_STALE_TIMEOUT = int(os.getenv('CACHE_STALE_TIMEOUT', 30))
+CACHE_REBUILD_LOCK_TIMEOUT = int(os.getenv('CACHE_REBUILD_LOCK_TIMEOUT', 10))
+CACHE_EARLY_REFRESH_BETA = float(os.getenv('CACHE_EARLY_REFRESH_BETA', 1))
 
 
 AUTH_PASSWORD_VALIDATORS = [
@@ -114,6 +160,20 @@ STATIC_ROOT = BASE_DIR / 'static'
 MEDIA_URL = os.getenv('MEDIA_URL', '/media/')
 MEDIA_ROOT = BASE_DIR / 'media'
 
+IMAGE_THUMBNAIL_SIZE = (int(os.getenv('IMAGE_THUMBNAIL_SIZE', 320)), ) * 2
+IMAGE_WEBP_QUALITY = int(os.getenv('IMAGE_WEBP_QUALITY', 80))
+# images claimed longer ago are claimed again, their worker is assumed dead
+IMAGE_PROCESSING_TIMEOUT = int(os.getenv('IMAGE_PROCESSING_TIMEOUT', 600))
+IMAGE_CONTENT_ADDRESSED_STORAGE = bool(int(os.getenv('IMAGE_CONTENT_ADDRESSED_STORAGE', 0)))
+
+PRODUCT_BATCH_MAX_OPERATIONS = int(os.getenv('PRODUCT_BATCH_MAX_OPERATIONS', 1000))
+PRODUCT_EXPORT_CHUNK_SIZE = int(os.getenv('PRODUCT_EXPORT_CHUNK_SIZE', 1000))
+PRODUCT_SYNC_PAGE_SIZE = int(os.getenv('PRODUCT_SYNC_PAGE_SIZE', 500))
+# changes this recent are sent again by the next sync, transactions may commit
+# after changes with a later timestamp
+PRODUCT_SYNC_LAG_SECONDS = int(os.getenv('PRODUCT_SYNC_LAG_SECONDS', 5))
+PRODUCT_SYNC_TOMBSTONE_RETENTION_DAYS = int(os.getenv('PRODUCT_SYNC_TOMBSTONE_RETENTION_DAYS', 30))
+
 LOCALE_PATHS = [
     (BASE_DIR / 'locale')
 ]
@@ -126,6 +186,32 @@ JWT_SECRET_KEY = os.getenv('JWT_SECRET_KEY', 'change_me')
 JWT_ALGORITHM = "HS256"
 JWT_ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv('JWT_ACCESS_TOKEN_EXPIRE_MINUTES', 30))
 JWT_REFRESH_TOKEN_EXPIRE_DAYS = int(os.getenv('JWT_REFRESH_TOKEN_EXPIRE_DAYS', 7))
+JWT_PAYLOAD_CACHE_SIZE = int(os.getenv('JWT_PAYLOAD_CACHE_SIZE', 10000))
+JWT_STATELESS_AUTH = bool(int(os.getenv('JWT_STATELESS_AUTH', 0)))
+JWT_USER_CACHE_TIMEOUT = int(os.getenv('JWT_USER_CACHE_TIMEOUT', 300))
+JWT_USER_LOCAL_CACHE_TIMEOUT = int(os.getenv('JWT_USER_LOCAL_CACHE_TIMEOUT', 5))
+JWT_USER_LOCAL_CACHE_SIZE = int(os.getenv('JWT_USER_LOCAL_CACHE_SIZE', 10000))
 
 ANON_RATE_THROTTLE = os.getenv('ANON_RATE_THROTTLE', '50/s')
 AUTH_RATE_THROTTLE = os.getenv('AUTH_RATE_THROTTLE', '100/s')
+LOGIN_RATE_THROTTLE = os.getenv('LOGIN_RATE_THROTTLE', '10/m')
+# 'redis' shares the token buckets between workers, 'local' keeps them per process
+THROTTLE_BACKEND = os.getenv('THROTTLE_BACKEND', 'local' if TESTING else 'redis')
+THROTTLE_REDIS_URL = os.getenv(
+    'THROTTLE_REDIS_URL',
+    f"redis://{os.getenv('REDIS_HOST', 'redis')}:{os.getenv('REDIS_PORT', '6379')}/1"
+)
+# proxies in front of the app, nginx appends the address it sees to X-Forwarded-For and the
+# throttles key on that entry, the ones before it are sent by the client
+NINJA_NUM_PROXIES = int(os.getenv('NINJA_NUM_PROXIES', 1))
+
+SERVER_TIMING_HEADER = bool(int(os.getenv('SERVER_TIMING_HEADER', 1)))
+# requests over their route query budget fail under `manage.py test` and are only logged otherwise
+QUERY_BUDGET_STRICT = bool(int(os.getenv('QUERY_BUDGET_STRICT', TESTING)))
+# 'redis' adds up the metrics of every worker, 'local' keeps them per process
+METRICS_BACKEND = os.getenv('METRICS_BACKEND', 'local' if TESTING else 'redis')
+METRICS_REDIS_URL = os.getenv(
+    'METRICS_REDIS_URL',
+    f"redis://{os.getenv('REDIS_HOST', 'redis')}:{os.getenv('REDIS_PORT', '6379')}/2"
+)
+METRICS_FLUSH_INTERVAL = float(os.getenv('METRICS_FLUSH_INTERVAL', 5))
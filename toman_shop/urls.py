@@ -3,17 +3,19 @@ from django.conf.urls.static import static
 from django.contrib import admin
 from django.urls import path
 from ninja import NinjaAPI
-from ninja.throttling import (
+
+from core.exceptions import ApiValidationError
+from core.instrumentation import InstrumentedJSONRenderer
+from core.throttling import (
     AnonRateThrottle,
     AuthRateThrottle
 )
-
-from core.apis.v1 import router as core_v1_router
-from core.exceptions import ApiValidationError
+from core.views import metrics
 
 
 urlpatterns = [
     path('admin/', admin.site.urls),
+    path('metrics', metrics),
 ]
 
 if settings.DEBUG:
@@ -26,6 +28,7 @@ if settings.DEBUG:
 
 
 api = NinjaAPI(
+    renderer=InstrumentedJSONRenderer(),
     throttle=[
         AnonRateThrottle(settings.ANON_RATE_THROTTLE),
         AuthRateThrottle(settings.AUTH_RATE_THROTTLE)
@@ -44,6 +47,11 @@ def api_error(request, exception):
     )
 
 
+if settings.ASYNC_API:
+    from core.apis.v1_async import router as core_v1_router
+else:
+    from core.apis.v1 import router as core_v1_router
+
 api.add_router("v1/", core_v1_router)
 
 urlpatterns.append(